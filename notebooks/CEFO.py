@@ -0,0 +1,1705 @@
+"""CEFO engine: classroom/bottleneck agents, ledgers and the negotiation episode loop.
+
+Importing this module does no work: no simulation runs and nothing outside the
+standard library is loaded (numpy is imported on first use of ScheduleMatrix).
+Plotting lives in the notebook and the web server in demo_visualization.py.
+"""
+import bisect
+import heapq
+import random
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+
+# ---------- messages ----------
+# Offers and commitments are slotted; their ids are only formatted when read.
+
+def _lazy_id(cls, name: str, render):
+    """Serves dataclass slot `name` through a property that renders a stored non-str on read; returns the raw slot."""
+    slot = cls.__dict__[name]
+
+    def get(self):
+        value = slot.__get__(self, cls)
+        return value if isinstance(value, str) else render(self)
+
+    setattr(cls, name, property(get, slot.__set__))
+    return slot
+
+@dataclass(slots=True)
+class Offer:
+    offer_id: Optional[str]   # None: "offer_<proposer>_to_<acceptor>_ep<n>" ("counter_..." for counter-offers)
+    proposer: str
+    acceptor: str
+    old_offset: int
+    shift_min: int
+    moved_students: int
+    episode_created: int
+    counter_to_offer_id: Optional[str] = None
+
+_OFFER_ID = _lazy_id(Offer, "offer_id", lambda o: (f"{'counter' if o.counter_to_offer_id is not None else 'offer'}"
+                                                   f"_{o.proposer}_to_{o.acceptor}_ep{o.episode_created}"))
+
+class _CounterId:
+    """Held in place of a counter-offer commitment's id until it is formatted."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "_COUNTER_ID"
+
+    def __reduce__(self):
+        return "_COUNTER_ID"
+
+_COUNTER_ID = _CounterId()
+
+@dataclass(slots=True)
+class Commitment:
+    commitment_id: Optional[str]   # None (_COUNTER_ID for a counter-offer): "com_" + the id of the offer it came from
+    proposer: str   # owes
+    acceptor: str   # is owed
+    shift_min: int
+    moved_students: int
+    created_episode: int
+    due_episode: int
+    fulfilled: bool = False
+    fulfilled_episode: Optional[int] = None
+    times_missed: int = 0
+
+    @property
+    def counter(self) -> bool:
+        """Created by a counter-offer, as its id says: "com_counter_..."."""
+        stored = _COMMITMENT_ID.__get__(self)
+        return stored is _COUNTER_ID or (stored is not None and stored.startswith("com_counter_"))
+
+    @classmethod
+    def from_offer(cls, offer: Offer, episode: int) -> "Commitment":
+        """What an accepted offer commits its proposer to, due the next episode."""
+        offer_id = _OFFER_ID.__get__(offer)
+        if offer_id is None:
+            commitment_id = _COUNTER_ID if offer.counter_to_offer_id is not None else None
+        else:
+            commitment_id = f"com_{offer_id}"
+        return cls(commitment_id, offer.proposer, offer.acceptor,
+                   offer.shift_min, offer.moved_students, episode, episode + 1)
+
+_COMMITMENT_ID = _lazy_id(Commitment, "commitment_id", lambda c: (f"com_{'counter' if c.counter else 'offer'}"
+                                                                  f"_{c.proposer}_to_{c.acceptor}_ep{c.created_episode}"))
+
+def _given_id(com: Commitment) -> Optional[str]:
+    """The id a commitment was created with; None if it is formatted on read."""
+    stored = _COMMITMENT_ID.__get__(com)
+    return None if stored is _COUNTER_ID else stored
+
+# ---------- events ----------
+# Agents emit Event records into an EventBus; text is only rendered by sinks that want it.
+
+EVENT_TEMPLATES = {
+    "episode_start":     "\n" + "=" * 40 + "\nRUNNING EPISODE {episode} ({tag})",
+    "broadcast":         "[B] broadcast: per_batch_capacity = {per_batch}, total_est={total_estimate}",
+    "initial_slots":     "[Initial slot map] {slot_map}",
+    "after_fulfill":     "[After fulfill attempts] slot_map: {slot_map}",
+    "fulfilled":         "[FULFILLED] {agent} fulfilled {commitment} by giving {students} to {acceptor} at slot {slot}",
+    "fulfill_failed":    "[FULFILL FAILED] {agent} couldn't fulfill {commitment} (missed {times_missed})",
+    "fulfill_partial":   "[FULFILL PARTIAL/FAIL] {agent} couldn't free enough for {commitment} (missed {times_missed})",
+    "violation":         lambda d: (f"[VIOLATION] {d['agent']} exceeded violation threshold for {d['commitment']}"
+                                    + (". Reputation penalized." if d.get("partial") else "")),
+    "round_clear":       "No congestion after negotiation round {round} in episode {episode}",
+    "round_start":       "[Negotiation round {round}] congested offsets: {offsets}",
+    "propose":           "[{agent}] (most students) is proposing to [{other}].",
+    "auction":           "[B] sealed-bid auction: {bids} bids from {agents} classrooms, {moved} students moved, "
+                         "{displaced} placed below their best bid",
+    "propose_shares":    "[{agent}] (most students) asks others to move {students} students off offset {offset} in {offers} offers.",
+    "low_reputation":    "[{agent}] refuses to negotiate with {other} due to low reputation ({reputation:.2f}).",
+    "utility":           "[{agent}] calculated utility for {subject}: {utility:.2f} (threshold: {threshold})",
+    "offer_accepted":    "[{agent}]'s offer to shift by {shift} min was ACCEPTED by [{other}].",
+    "offer_rejected":    "[{agent}]'s offer was REJECTED by [{other}]. Checking for a counter-offer...",
+    "counter_skipped":   "[{agent}] considered a counter-offer but deemed it not beneficial enough.",
+    "counter_formulating": "[{agent}] is formulating a counter-offer...",
+    "counter_offer":     "[{agent}] counters with a proposal to shift by {shift} min.",
+    "counter_accepted":  "[{agent}] ACCEPTS the counter-offer from [{other}].",
+    "counter_rejected":  "[{agent}] REJECTS the counter-offer from [{other}]. Negotiation ends.",
+    "no_counter":        "[{agent}] did not provide a counter-offer. Negotiation ends.",
+    "committed":         lambda d: (f"[COMMITTED] {d['commitment']} created"
+                                    + (" from counter-offer" if d.get("counter") else "")
+                                    + f", due in episode {d['due']}."),
+    "central_fallback":  "[CENTRAL] offsets {offsets} still congested; solver moved {moved} students "
+                         "(cost {cost:.1f}, overflow {overflow})",
+    "final_slots":       "[Final slot_map after episode] {slot_map}",
+    "schedules":         lambda d: "Schedules:" + "".join(f"\n {cid}: {slots}" for cid, slots in d["schedules"].items()),
+}
+
+@dataclass
+class Event:
+    kind: str            # a key of EVENT_TEMPLATES
+    episode: Optional[int]
+    data: Dict
+
+    def text(self) -> str:
+        template = EVENT_TEMPLATES[self.kind]
+        return template(self.data) if callable(template) else template.format(**self.data)
+
+class EventBus:
+    """Fans events out to sinks; with no sinks attached, emit() returns before building anything."""
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+        self.episode: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.sinks)
+
+    def subscribe(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def emit(self, kind: str, **data):
+        if not self.sinks:
+            return
+        if kind == "episode_start":
+            self.episode = data["episode"]
+        event = Event(kind, self.episode, data)
+        for sink in self.sinks:
+            sink.write(event)
+
+    def phase(self, name: str):
+        """Context manager timing a phase of the episode for sinks with record_phase(name, seconds)."""
+        if not self.sinks:
+            return _NO_PHASE
+        timed = [sink for sink in self.sinks if hasattr(sink, "record_phase")]
+        return _Phase(timed, name) if timed else _NO_PHASE
+
+_NO_PHASE = nullcontext()
+
+class _Phase:
+    def __init__(self, sinks, name: str):
+        self.sinks = sinks
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        for sink in self.sinks:
+            sink.record_phase(self.name, elapsed)
+        return False
+
+class NullSink:
+    def write(self, event: Event):
+        pass
+
+class PrintSink:
+    """Prints each event's text, i.e. the classic console log.
+
+    Kinds in `skip` are left out; by default that is the per-offer utility
+    detail, which only the demo's session log shows.
+    """
+    def __init__(self, skip: Iterable[str] = ("utility",)):
+        self.skip = frozenset(skip)
+
+    def write(self, event: Event):
+        if event.kind not in self.skip:
+            print(event.text())
+
+class RingBufferSink:
+    """Keeps the last `maxlen` events (all of them if maxlen is None) as records."""
+    def __init__(self, maxlen: Optional[int] = None):
+        self.events = deque(maxlen=maxlen)
+
+    def write(self, event: Event):
+        self.events.append(event)
+
+    def texts(self) -> List[str]:
+        return [e.text() for e in self.events]
+
+    def clear(self):
+        self.events.clear()
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __len__(self):
+        return len(self.events)
+
+class FileSink:
+    """Appends one text line per event to a file (a path or an open text file)."""
+    def __init__(self, target):
+        self._owns = isinstance(target, str)
+        self.file = open(target, "a") if self._owns else target
+
+    def write(self, event: Event):
+        self.file.write(event.text() + "\n")
+
+    def close(self):
+        if self._owns:
+            self.file.close()
+
+
+# ---------- agents ----------
+
+class BottleneckAgent:
+    def __init__(self, cfg, events: Optional[EventBus] = None):
+        self.events = events if events is not None else EventBus()
+        self.cap_per_min = cfg["bottleneck"]["capacity_per_minute"]
+        self.batch_duration = cfg["bottleneck"]["batch_duration_min"]
+        self.per_batch = self.cap_per_min * self.batch_duration
+
+    def broadcast_capacity(self, attendance_list, episode_tag):
+        total_estimate = sum(attendance_list)
+        msg = {"cap_per_min": self.cap_per_min, "total_estimate": total_estimate, "episode_tag": episode_tag}
+        self.events.emit("broadcast", per_batch=self.per_batch, total_estimate=total_estimate)
+        return msg
+
+    def clear_auction(self, bids, span: int = 1) -> List[tuple]:
+        """Places every bidding slot's students at once: a list of (agent id, source, target, students) awards.
+
+        `bids` holds (agent id, submit_bids() list) in classroom order. Bids are
+        served highest value first, ties going to the earlier classroom and then
+        to the earlier bid, and each slot fills its best target with room,
+        spilling into its next ones. A batch starting at an offset occupies the
+        `span` ticks from it, none of which may exceed per_batch. Students no
+        bid could place stay at their source, over capacity.
+        """
+        entries, left = [], {}
+        for rank, (agent_id, agent_bids) in enumerate(bids):
+            for order, (src, cnt, target, value) in enumerate(agent_bids):
+                entries.append((-value, rank, order, agent_id, src, target))
+                left[agent_id, src] = cnt
+        entries.sort()
+        occupancy: Dict[int, int] = {}
+        awards, unplaced = [], len(left)
+        for _, _, _, agent_id, src, target in entries:
+            if not unplaced:
+                break
+            want = left[agent_id, src]
+            if not want:
+                continue
+            room = self.per_batch - max(occupancy.get(t, 0) for t in range(target, target + span))
+            take = min(want, room)
+            if take <= 0:
+                continue
+            for t in range(target, target + span):
+                occupancy[t] = occupancy.get(t, 0) + take
+            awards.append((agent_id, src, target, take))
+            left[agent_id, src] = want - take
+            if take == want:
+                unplaced -= 1
+        awards.extend((agent_id, src, src, cnt) for (agent_id, src), cnt in left.items() if cnt)
+        return awards
+
+
+class ClassroomAgent:
+    def __init__(self, id_, attendance, cfg, professor_willingness=0.7, ledger=None, matrix=None, rng=None, events=None):
+        self.id = id_
+        self.attendance = attendance
+        self.cfg = cfg
+        # rng: a random.Random for isolated runs; defaults to the module-level generator
+        self.personality = (rng or random).choice(['prefers_early', 'prefers_late', 'flexible'])
+        self.utility_threshold = 0.1 # Agent's minimum acceptable utility
+        self.reputation = 1.0
+        self.is_stubborn = False
+        self.commitment_history: List[Commitment] = []
+        self.events = events if events is not None else EventBus()
+        # running counters, so nobody has to rescan commitment history
+        self.violations = 0             # times this agent was penalised for missing a commitment
+        self.missed_commitments = 0     # commitments this agent was party to (either side) that were missed
+        # shared SlotLedger (optional); schedule changes are pushed to it as deltas
+        self.ledger = ledger
+        if ledger is not None:
+            ledger.register(self)
+        # sparse schedule: offset -> students, in the order the slots were first filled
+        self._slots: Dict[int, int] = {}
+        # compact mode: the schedule lives in a row of a shared ScheduleMatrix;
+        # _order keeps the occupied columns in the same order the list form would
+        self.matrix = matrix
+        self._row = matrix.allocate_row() if matrix is not None else None
+        self._order: List[int] = []
+        self.per_batch = self.cfg["bottleneck"]["capacity_per_minute"] * self.cfg["bottleneck"]["batch_duration_min"]
+
+    @property
+    def planned_slots(self) -> List[tuple]:
+        if self.matrix is None:
+            return list(self._slots.items())
+        offsets, row = self.matrix.offsets, self.matrix.counts[self._row]
+        return [(offsets[j], int(row[j])) for j in self._order]
+
+    @planned_slots.setter
+    def planned_slots(self, slots: List[tuple]):
+        # wholesale replacement: retract the old schedule from the ledger, post the new one
+        if self.ledger is not None:
+            for off, cnt in self.planned_slots:
+                self.ledger.add(off, -cnt, self)
+                if not cnt:
+                    self.ledger.release(off, self)
+            for off, cnt in slots:
+                self.ledger.add(off, cnt, self)
+                if not cnt:
+                    self.ledger.hold(off, self)
+        if self.matrix is None:
+            self._slots = {}
+            for off, cnt in slots:
+                self._slots[off] = self._slots.get(off, 0) + cnt
+            return
+        self.matrix.counts[self._row] = 0
+        self._order = []
+        for off, cnt in slots:
+            j = self.matrix.column(off)
+            if j not in self._order:
+                self._order.append(j)
+            self.matrix.counts[self._row, j] += cnt
+
+    def _slot_count(self, offset: int) -> int:
+        if self.matrix is None:
+            return self._slots.get(offset, 0)
+        j = self.matrix.col.get(offset)
+        return 0 if j is None else int(self.matrix.counts[self._row, j])
+
+    def _first_offset(self) -> int:
+        if self.matrix is None:
+            return next(iter(self._slots))
+        return self.matrix.offsets[self._order[0]]
+
+    def _move_students(self, src: Optional[int], dst: int, count: int, slot_map: Optional[Dict[int, int]] = None):
+        """Move `count` students from src to dst (src=None adds them); emptied slots are dropped."""
+        if self.matrix is not None:
+            counts, row = self.matrix.counts, self._row
+            if src is not None:
+                js = self.matrix.column(src)
+                counts[row, js] -= count
+                if counts[row, js] <= 0:
+                    self._order.remove(js)
+            jd = self.matrix.column(dst)
+            counts = self.matrix.counts  # column() may have grown the matrix
+            if counts[row, jd] == 0 and jd not in self._order:
+                self._order.append(jd)
+            counts[row, jd] += count
+        else:
+            slots = self._slots
+            if src in slots:
+                left = slots[src] - count
+                if left > 0:
+                    slots[src] = left
+                else:
+                    del slots[src]
+            slots[dst] = slots.get(dst, 0) + count
+        self._shift_load(slot_map, src, dst, count)
+
+    def _drop_if_empty(self, offset: int):
+        """Drops the slot at `offset` if it holds no students, as a schedule change would."""
+        if self.matrix is None:
+            if self._slots.get(offset) != 0:
+                return
+            del self._slots[offset]
+        else:
+            j = self.matrix.col.get(offset)
+            if j not in self._order or self.matrix.counts[self._row, j]:
+                return
+            self._order.remove(j)
+        if self.ledger is not None:
+            self.ledger.release(offset, self)
+
+    def _shift_load(self, slot_map: Dict[int, int], src: Optional[int], dst: int, count: int):
+        """Record `count` students moving from src to dst (src=None for a pure addition)."""
+        if self.ledger is not None:
+            if src is not None:
+                self.ledger.add(src, -count, self)
+            self.ledger.add(dst, count, self)
+            return
+        if slot_map is None:
+            return
+        if src is not None:
+            slot_map[src] = slot_map.get(src, 0) - count
+        slot_map[dst] = slot_map.get(dst, 0) + count
+
+    def on_capacity_broadcast(self, msg, index=0):
+        self.per_batch = msg["cap_per_min"] * self.cfg["bottleneck"]["batch_duration_min"]
+        # INITIAL slots = 0
+        self.planned_slots = [(0, self.attendance)]
+
+    def broadcast_schedule(self):
+        return {"id": self.id, "slots": list(self.planned_slots)}
+
+    def _offset_index(self, slot_map) -> "OffsetIndex":
+        """The slot map's OffsetIndex (ledgers and their snapshots carry one); plain dicts get indexed here."""
+        index = getattr(slot_map, "index", None)
+        return index if index is not None else OffsetIndex(self.cfg["time_offsets"], slot_map)
+
+    def propose_shift(self, target_agent, congested_offset, current_episode, slot_map: Dict[int, int]):
+        # least-loaded slot, but never the congested one itself
+        best_slot = self._offset_index(slot_map).least_loaded(exclude=congested_offset)
+        if best_slot is None:
+            return None  # No valid slot found to make a proposal
+        offer_amount = min(self._slot_count(congested_offset), self.per_batch)
+        if offer_amount <= 0:
+            return None
+        offer = Offer(
+            offer_id=None,
+            proposer=self.id,
+            acceptor=target_agent.id,
+            old_offset=congested_offset,
+            shift_min=best_slot - congested_offset,  # DYNAMICALLY calculated shift
+            moved_students=offer_amount,
+            episode_created=current_episode
+        )
+        return offer
+
+    def propose_shares(self, acceptors, congested_offset, current_episode, slot_map: Dict[int, int]) -> List[Offer]:
+        """Splits the excess at congested_offset over the acceptors, in order: one offer per acceptor and target.
+
+        Each acceptor is offered the least-loaded offsets on the side of the
+        hour it prefers (any side if flexible), each filled up to capacity as
+        the earlier offers leave it, so together the offers clear the offset
+        when the acceptors have the students and the window has the room.
+        """
+        index = self._offset_index(slot_map).copy()
+        load = index.load(congested_offset)
+        excess = (slot_map.get(congested_offset, 0) if load is None else load) - self.per_batch
+        span = batch_span(self.cfg)
+        offers = []
+        for acceptor in acceptors:
+            want = min(acceptor._slot_count(congested_offset), excess)
+            while want > 0:
+                if acceptor.personality == 'flexible':
+                    target = index.least_loaded(exclude=congested_offset)
+                else:
+                    target = index.least_loaded_side(congested_offset, later=acceptor.personality == 'prefers_late')
+                room = self.per_batch - index.load(target) if target is not None else 0
+                if room <= 0:
+                    break  # no room on this acceptor's side
+                take = min(want, room)
+                offers.append(Offer(None, self.id, acceptor.id, congested_offset, target - congested_offset,
+                                    take, current_episode))
+                # every batch overlapping the target's may now peak that much higher
+                for off in range(target - span + 1, target + span):
+                    peak = index.load(off)
+                    if peak is not None:
+                        index.set(off, peak + take)
+                want -= take
+                excess -= take
+            if excess <= 0:
+                break
+        return offers
+
+    def apply_awards(self, awards):
+        """Moves this agent's students as the auction placed them: (source, target, students) per award."""
+        for src, target, cnt in awards:
+            if target != src:
+                self._move_students(src, target, min(cnt, self._slot_count(src)))
+
+    def apply_offer(self, offer: Offer):
+        old = offer.old_offset
+        moved = min(self._slot_count(old), offer.moved_students)
+        if moved > 0:
+            self._move_students(old, old + offer.shift_min, moved)
+        else:
+            self._drop_if_empty(old)
+
+    def calculate_utility(self, offer: Offer) -> float:
+        """Calculates a score for how good an offer is to this agent."""
+        utility = 0.0
+        if offer.proposer == self.id: utility += 0.3
+        return utility + self.shift_utility(offer.shift_min)
+
+    def shift_utility(self, shift_direction: int) -> float:
+        """What moving by shift_direction minutes is worth to this agent's personality."""
+        if self.personality == 'prefers_early' and shift_direction < 0: return 0.5
+        elif self.personality == 'prefers_late' and shift_direction > 0: return 0.5
+        elif self.personality != 'flexible' and ( (self.personality == 'prefers_early' and shift_direction > 0) or (self.personality == 'prefers_late' and shift_direction < 0) ): return -0.5
+        return 0.0
+
+    def submit_bids(self, offsets: List[int]) -> List[tuple]:
+        """Sealed bids for the auction: (source offset, students, target, value) per slot and acceptable target.
+
+        A slot bids for staying put and for every offset in the window this
+        agent would accept an offer to move to, at its utility for the move
+        (as the one proposing it) weighted by reputation.
+        """
+        bids = []
+        for src, cnt in self.planned_slots:
+            if cnt <= 0:
+                continue
+            for target in [src] + [o for o in offsets if o != src]:
+                utility = 0.3 + self.shift_utility(target - src)
+                if target == src or self.personality == 'flexible' or utility >= self.utility_threshold:
+                    bids.append((src, cnt, target, self.reputation * utility))
+        return bids
+
+    def evaluate_offer(self, offer: Offer) -> bool:
+        """Returns True if the agent accepts the offer, False otherwise."""
+        if self.personality == 'flexible': return True
+        return self.calculate_utility(offer) >= self.utility_threshold
+
+    def formulate_counter_offer(self, original_offer: Offer, current_episode: int, slot_map: Dict[int, int]):
+        if self.personality == 'flexible': return None
+        # least-loaded slot on the side of the hour this agent prefers
+        best_alternative_slot = self._offset_index(slot_map).least_loaded_side(
+            0, later=self.personality == 'prefers_late', exclude=original_offer.old_offset)
+        if best_alternative_slot is None: return None
+        my_current_offset, offer_amount = self._first_offset(), min(self.attendance, self.per_batch)
+        hypothetical_shift = best_alternative_slot - my_current_offset
+        hypothetical_offer = Offer(
+            offer_id="hypothetical", proposer=self.id, acceptor=original_offer.proposer,
+            old_offset=my_current_offset, shift_min=hypothetical_shift,
+            moved_students=offer_amount, episode_created=current_episode
+        )
+        if self.calculate_utility(hypothetical_offer) < self.utility_threshold:
+            self.events.emit("counter_skipped", agent=self.id)
+            return None
+        self.events.emit("counter_formulating", agent=self.id)
+        return Offer(
+            offer_id=None,
+            proposer=self.id, acceptor=original_offer.proposer, old_offset=my_current_offset,
+            shift_min=hypothetical_shift, moved_students=offer_amount,
+            episode_created=current_episode, counter_to_offer_id=original_offer.offer_id
+        )
+
+    def reduce_load_for_fulfillment(self, amount, forbidden_offset, slot_map: Dict[int, int], B_agent, agents_by_id):
+        if self.is_stubborn:
+            return False
+        index = self._offset_index(slot_map)
+        for src_off, src_cnt in list(self.planned_slots):
+            if src_off == forbidden_offset or src_cnt <= 0:
+                continue
+            can_take = min(src_cnt, amount)
+            # first slot, in time_offsets order, with room for them
+            tgt = index.first_with_room(B_agent.per_batch - can_take, exclude=(forbidden_offset, src_off))
+            if tgt is not None:
+                self._move_students(src_off, tgt, can_take, slot_map)
+                for off, cnt in self.planned_slots:
+                    if not cnt:
+                        self._drop_if_empty(off)
+                return True
+        return False
+
+    def _note_miss(self, com: Commitment, acceptor_agent: "ClassroomAgent", violation_threshold: int) -> bool:
+        """Bumps the miss counters; True once the commitment crosses the violation threshold."""
+        com.times_missed += 1
+        if com.times_missed == 1:
+            self.missed_commitments += 1
+            acceptor_agent.missed_commitments += 1
+        if com.times_missed >= violation_threshold:
+            self.violations += 1
+            self.reputation *= 0.8
+            return True
+        return False
+
+    def fulfill_due_commitments(self, commitments_global: "CommitmentLedger", current_episode: int, slot_map: Dict[int,int],
+                                B_agent, agents_by_id: Dict[str, "ClassroomAgent"], violation_threshold: int):
+        if isinstance(commitments_global, CommitmentLedger):
+            due = commitments_global.due(self.id, current_episode)
+        else:
+            due = [com for com in commitments_global if com.proposer == self.id and com.due_episode == current_episode]
+        for com in due:
+            if com.fulfilled:
+                continue
+            acceptor_agent = agents_by_id[com.acceptor]
+            if not acceptor_agent.planned_slots:
+                continue
+            # target slot for acceptor
+            target_slot = acceptor_agent._first_offset() + abs(com.shift_min)
+            load_at = slot_map.peak if isinstance(slot_map, SlotLedger) else slot_map.get
+            available = B_agent.per_batch - load_at(target_slot, 0)
+            to_give = min(com.moved_students, max(0, available))
+            if to_give <= 0:
+                success = self.reduce_load_for_fulfillment(com.moved_students, forbidden_offset=target_slot,
+                                                          slot_map=slot_map, B_agent=B_agent, agents_by_id=agents_by_id)
+                if success:
+                    available = B_agent.per_batch - load_at(target_slot, 0)
+                    to_give = min(com.moved_students, max(0, available))
+                else:
+                    violated = self._note_miss(com, acceptor_agent, violation_threshold)
+                    self.events.emit("fulfill_failed", agent=self.id, commitment=com.commitment_id, times_missed=com.times_missed)
+                    if violated:
+                        self.events.emit("violation", agent=self.id, commitment=com.commitment_id)
+                    continue
+            if to_give > 0:
+                freed = self.reduce_load_for_fulfillment(to_give, forbidden_offset=target_slot, slot_map=slot_map,
+                                                         B_agent=B_agent, agents_by_id=agents_by_id)
+                if freed:
+                    acceptor_agent._move_students(None, target_slot, to_give, slot_map)
+                    com.fulfilled = True
+                    com.fulfilled_episode = current_episode
+                    self.events.emit("fulfilled", agent=self.id, commitment=com.commitment_id, students=to_give,
+                                     acceptor=acceptor_agent.id, slot=target_slot)
+                else:
+                  violated = self._note_miss(com, acceptor_agent, violation_threshold)
+                  self.events.emit("fulfill_partial", agent=self.id, commitment=com.commitment_id, times_missed=com.times_missed)
+                  if violated:
+                      self.events.emit("violation", agent=self.id, commitment=com.commitment_id, partial=True)
+
+
+# ---------- ledgers ----------
+
+def compute_slot_map(classrooms: List[ClassroomAgent]) -> Dict[int,int]:
+    slot_map = {}
+    for c in classrooms:
+        for off, cnt in c.planned_slots:
+            slot_map[off] = slot_map.get(off, 0) + cnt
+    return slot_map
+
+class _MinTree:
+    """Iterative segment tree of int keys (min); absent leaves hold _MinTree.EMPTY."""
+    EMPTY = float("inf")
+
+    def __init__(self, keys: List[int]):
+        size = 1
+        while size < len(keys):
+            size *= 2
+        t = [self.EMPTY] * (2 * size)
+        t[size:size + len(keys)] = keys
+        for i in range(size - 1, 0, -1):
+            a, b = t[2 * i], t[2 * i + 1]
+            t[i] = a if a < b else b
+        self.size, self.t = size, t
+
+    def __getitem__(self, i: int):
+        return self.t[self.size + i]
+
+    def copy(self) -> "_MinTree":
+        clone = object.__new__(_MinTree)
+        clone.size, clone.t = self.size, self.t[:]
+        return clone
+
+    def set(self, i: int, key: int):
+        t = self.t
+        i += self.size
+        t[i] = key
+        i //= 2
+        while i:
+            a, b = t[2 * i], t[2 * i + 1]
+            t[i] = a if a < b else b
+            i //= 2
+
+    def min(self, lo: int, hi: int):
+        t, best = self.t, self.EMPTY
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                if t[lo] < best:
+                    best = t[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if t[hi] < best:
+                    best = t[hi]
+            lo //= 2
+            hi //= 2
+        return best
+
+    def leftmost(self, lo: int, hi: int, limit: int) -> Optional[int]:
+        """Position of the first key <= limit in [lo, hi), or None."""
+        t = self.t
+        left, right = [], []
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                left.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right.append(hi)
+            lo //= 2
+            hi //= 2
+        for node in left + right[::-1]:
+            if t[node] <= limit:
+                while node < self.size:
+                    node = 2 * node if t[2 * node] <= limit else 2 * node + 1
+                return node - self.size
+        return None
+
+
+class OffsetIndex:
+    """Load-ordered index over a fixed window of offsets, kept up to date by a SlotLedger.
+
+    Ties go to the offset listed first in `offsets` (its rank), like a scan of
+    cfg["time_offsets"] would pick. One tree is ordered by rank, one by time;
+    every query and update is O(log n).
+    """
+    _RANK_BITS = 20
+    _RANK_MASK = (1 << _RANK_BITS) - 1
+
+    def __init__(self, offsets: List[int], loads: Optional[Dict[int, int]] = None):
+        self.offsets = list(offsets)
+        self.rank = {off: r for r, off in enumerate(self.offsets)}
+        self.by_time = sorted(self.offsets)
+        self._time_pos = {off: p for p, off in enumerate(self.by_time)}
+
+        get, bits, rank = (loads or {}).get, self._RANK_BITS, self.rank
+        self._rank_tree = _MinTree([(get(off, 0) << bits) | r for r, off in enumerate(self.offsets)])
+        self._time_tree = _MinTree([(get(off, 0) << bits) | rank[off] for off in self.by_time])
+
+    def copy(self) -> "OffsetIndex":
+        clone = object.__new__(OffsetIndex)
+        clone.__dict__.update(self.__dict__)  # the offset tables are shared, they never change
+        clone._rank_tree, clone._time_tree = self._rank_tree.copy(), self._time_tree.copy()
+        return clone
+
+    def set(self, offset: int, load: int):
+        """Records the load at `offset`; offsets outside the window are ignored."""
+        r = self.rank.get(offset)
+        if r is None:
+            return
+        key = (load << self._RANK_BITS) | r
+        self._rank_tree.set(r, key)
+        self._time_tree.set(self._time_pos[offset], key)
+
+    def load(self, offset: int) -> Optional[int]:
+        """The load recorded at `offset`, None outside the window."""
+        r = self.rank.get(offset)
+        return None if r is None else self._rank_tree[r] >> self._RANK_BITS
+
+    def _offset(self, key) -> Optional[int]:
+        return None if key == _MinTree.EMPTY else self.offsets[key & self._RANK_MASK]
+
+    @staticmethod
+    def _min_without(tree: _MinTree, lo: int, hi: int, hole: Optional[int]):
+        if hole is None or not lo <= hole < hi:
+            return tree.min(lo, hi)
+        a, b = tree.min(lo, hole), tree.min(hole + 1, hi)
+        return a if a < b else b
+
+    def least_loaded(self, exclude: Optional[int] = None) -> Optional[int]:
+        """Least-loaded offset other than `exclude`."""
+        return self._offset(self._min_without(self._rank_tree, 0, len(self.offsets), self.rank.get(exclude)))
+
+    def least_loaded_side(self, pivot: int, later: bool, exclude: Optional[int] = None) -> Optional[int]:
+        """Least-loaded offset strictly after (later=True) or before `pivot`, other than `exclude`."""
+        if later:
+            lo, hi = bisect.bisect_right(self.by_time, pivot), len(self.by_time)
+        else:
+            lo, hi = 0, bisect.bisect_left(self.by_time, pivot)
+        return self._offset(self._min_without(self._time_tree, lo, hi, self._time_pos.get(exclude)))
+
+    def first_with_room(self, limit: int, exclude=()) -> Optional[int]:
+        """First offset, in rank order, whose load is at most `limit` (skipping `exclude`)."""
+        if limit < 0:
+            return None
+        bound = (limit << self._RANK_BITS) | self._RANK_MASK
+        lo = 0
+        holes = sorted(r for r in {self.rank.get(off) for off in exclude} if r is not None)
+        for hi in holes + [len(self.offsets)]:
+            if lo < hi:
+                r = self._rank_tree.leftmost(lo, hi, bound)
+                if r is not None:
+                    return self.offsets[r]
+            lo = hi + 1
+        return None
+
+
+class LoadSnapshot(dict):
+    """A point-in-time slot map (offset -> load), with a frozen copy of the ledger's OffsetIndex."""
+    def __init__(self, loads=(), index: Optional[OffsetIndex] = None):
+        super().__init__(loads)
+        self.index = index
+
+
+class SlotLedger:
+    """Per-offset load for the whole campus, maintained by deltas as schedules change.
+
+    Agents holding a reference push every move into the ledger, so the load at any
+    offset and the set of congested offsets are available without walking schedules.
+    Moves attributed to an agent also keep an inverted offset -> {agent: students}
+    index, with a lazily pruned max-heap per offset for top-contributor queries;
+    an empty slot in a schedule is listed there too, with 0 students.
+    Given the offset window, an OffsetIndex answers best-slot queries over it,
+    ranking offsets by peak(): here just the load, see WindowedSlotLedger.
+    """
+    def __init__(self, per_batch: int, offsets: Optional[List[int]] = None):
+        self.per_batch = per_batch
+        self._index = OffsetIndex(offsets) if offsets is not None else None
+        self._stale: set = set()  # offsets whose load changed since the index was last brought up to date
+        self.loads: Dict[int, int] = {}
+        self.congested: set = set()
+        self.contributors: Dict[int, Dict["ClassroomAgent", int]] = {}
+        self._heaps: Dict[int, list] = {}
+        self._agent_rank: Dict["ClassroomAgent", int] = {}
+
+    def register(self, agent) -> int:
+        """Gives the agent its tie-break rank (registration order, i.e. classroom order)."""
+        return self._agent_rank.setdefault(agent, len(self._agent_rank))
+
+    def add(self, offset: int, delta: int, agent=None):
+        if delta == 0:
+            return
+        load = self.loads.get(offset, 0) + delta
+        if load:
+            self.loads[offset] = load
+        else:
+            del self.loads[offset]
+        if self._index is not None:
+            self._stale.add(offset)
+        if load > self.per_batch:
+            self.congested.add(offset)
+        else:
+            self.congested.discard(offset)
+        if agent is not None:
+            self._contribute(offset, agent, delta)
+
+    def _contribute(self, offset: int, agent, delta: int):
+        at = self.contributors.setdefault(offset, {})
+        cnt = at.get(agent, 0) + delta
+        if cnt > 0:
+            at[agent] = cnt
+            heap = self._heaps.setdefault(offset, [])
+            heapq.heappush(heap, (-cnt, self.register(agent), agent))
+            if len(heap) > 2 * len(at) + 16:
+                # too many stale entries: rebuild from the live index
+                self._heaps[offset] = [(-c, self._agent_rank[a], a) for a, c in at.items()]
+                heapq.heapify(self._heaps[offset])
+        else:
+            at.pop(agent, None)
+
+    def hold(self, offset: int, agent):
+        """Lists the agent at `offset` for an empty slot in its schedule (e.g. no attendance):
+        compute_slot_map() sees such a slot, so the agent can still be picked to negotiate there."""
+        at = self.contributors.setdefault(offset, {})
+        if agent not in at:
+            at[agent] = 0
+            heapq.heappush(self._heaps.setdefault(offset, []), (0, self.register(agent), agent))
+
+    def release(self, offset: int, agent):
+        """Drops an empty slot listed by hold()."""
+        at = self.contributors.get(offset)
+        if at and at.get(agent) == 0:
+            del at[agent]
+
+    @property
+    def index(self) -> Optional[OffsetIndex]:
+        if self._stale:
+            for offset in self._stale:
+                self._index.set(offset, self.peak(offset))
+            self._stale.clear()
+        return self._index
+
+    def peak(self, offset: int, default: int = 0) -> int:
+        """Most students in the bottleneck at once while a batch starting at `offset` is."""
+        return self.loads.get(offset, default)
+
+    def peak_load(self) -> int:
+        return max(self.loads.values(), default=0)
+
+    def students_at(self, offset: int, agent) -> int:
+        return self.contributors.get(offset, {}).get(agent, 0)
+
+    def top_contributors(self, offset: int, k: int = 2) -> list:
+        """The k agents with the most students at `offset`, ties broken by classroom order."""
+        heap, at = self._heaps.get(offset, []), self.contributors.get(offset, {})
+        top, live = [], []
+        while heap and len(top) < k:
+            entry = heapq.heappop(heap)
+            neg_cnt, _, agent = entry
+            if at.get(agent) != -neg_cnt or agent in top:
+                continue  # stale or duplicate entry, drop it
+            top.append(agent)
+            live.append(entry)
+        for entry in live:
+            heapq.heappush(heap, entry)
+        return top
+
+    def ranked_contributors(self, offset: int) -> list:
+        """Every agent with a slot at `offset`, most students first, ties broken by classroom order."""
+        at, rank = self.contributors.get(offset, {}), self._agent_rank
+        return sorted(at, key=lambda agent: (-at[agent], rank[agent]))
+
+    def get(self, offset: int, default: int = 0) -> int:
+        return self.loads.get(offset, default)
+
+    def __getitem__(self, offset: int) -> int:
+        return self.loads.get(offset, 0)
+
+    def items(self):
+        return self.loads.items()
+
+    def congested_offsets(self) -> List[int]:
+        """Congested offsets in slot-map order: as compute_slot_map() would first meet them
+        walking the classrooms' schedules, i.e. by the first classroom holding students
+        there, then by where the offset sits in that classroom's schedule."""
+        rank = self._agent_rank
+
+        def first_seen(offset):
+            at = self.contributors.get(offset)
+            if not at:
+                return len(rank), 0, offset  # load added without an agent
+            agent = min(at, key=rank.__getitem__)
+            return rank[agent], [off for off, _ in agent.planned_slots].index(offset), offset
+
+        return sorted(self.congested, key=first_seen)
+
+    def snapshot(self) -> LoadSnapshot:
+        """Point-in-time copy, ordered by offset."""
+        index = self.index
+        return LoadSnapshot(sorted(self.loads.items()), index.copy() if index is not None else None)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.snapshot()})"
+
+
+class WindowedSlotLedger(SlotLedger):
+    """SlotLedger for a time grid finer than the batch: a batch spans `span` ticks.
+
+    Students starting at offset o are in the bottleneck during ticks [o, o + span),
+    so capacity is checked per tick: `occupancy` holds the students present at
+    each tick, an offset's peak() is the busiest tick its batch covers, and an
+    occupied offset is congested when that peak exceeds per_batch. `loads` stays
+    keyed by start offset. With span 1 this is a plain SlotLedger.
+    """
+    def __init__(self, per_batch: int, offsets: Optional[List[int]] = None, span: int = 1):
+        super().__init__(per_batch, offsets)
+        self.span = span
+        self.occupancy: Dict[int, int] = {}
+
+    def add(self, offset: int, delta: int, agent=None):
+        if delta == 0:
+            return
+        super().add(offset, delta, agent)
+        occupancy = self.occupancy
+        for tick in range(offset, offset + self.span):
+            n = occupancy.get(tick, 0) + delta
+            if n:
+                occupancy[tick] = n
+            else:
+                del occupancy[tick]
+        # every start offset whose batch overlaps the changed ticks
+        touched = range(offset - self.span + 1, offset + self.span)
+        for start in touched:
+            if start in self.loads and self.peak(start) > self.per_batch:
+                self.congested.add(start)
+            else:
+                self.congested.discard(start)
+        if self._index is not None:
+            self._stale.update(touched)
+
+    def peak(self, offset: int, default: int = 0) -> int:
+        occupancy = self.occupancy
+        return max(max(occupancy.get(tick, 0) for tick in range(offset, offset + self.span)), default)
+
+    def peak_load(self) -> int:
+        return max(self.occupancy.values(), default=0)
+
+class ScheduleMatrix:
+    """Compact campus schedule: one agents x offsets integer matrix.
+
+    Row i is agent i's schedule, column j the students at cfg["time_offsets"][j],
+    so moving students is an index update and column sums give the slot map.
+    Offsets outside the configured window get a column appended on first use.
+    """
+    def __init__(self, time_offsets: List[int], num_agents: int):
+        self.offsets: List[int] = list(time_offsets)
+        self.col: Dict[int, int] = {off: j for j, off in enumerate(self.offsets)}
+        import numpy as np
+        self.counts = np.zeros((num_agents, len(self.offsets)), dtype=np.int64)
+        self._rows = 0
+
+    def allocate_row(self) -> int:
+        if self._rows == self.counts.shape[0]:
+            import numpy as np
+            self.counts = np.vstack([self.counts, np.zeros((max(1, self._rows), self.counts.shape[1]), dtype=np.int64)])
+        self._rows += 1
+        return self._rows - 1
+
+    def column(self, offset: int) -> int:
+        j = self.col.get(offset)
+        if j is None:
+            j = len(self.offsets)
+            self.offsets.append(offset)
+            self.col[offset] = j
+            import numpy as np
+            self.counts = np.hstack([self.counts, np.zeros((self.counts.shape[0], 1), dtype=np.int64)])
+        return j
+
+    def slot_map(self) -> Dict[int, int]:
+        totals = self.counts[:self._rows].sum(axis=0)
+        return {self.offsets[j]: int(totals[j]) for j in totals.nonzero()[0]}
+
+class AgentIds:
+    """Interns agent ids as consecutive int handles, for storage that only holds numbers."""
+    def __init__(self, names=()):
+        self.names: List[str] = []
+        self.handles: Dict[str, int] = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name: str) -> int:
+        handle = self.handles.get(name)
+        if handle is None:
+            handle = self.handles[name] = len(self.names)
+            self.names.append(name)
+        return handle
+
+    def __len__(self):
+        return len(self.names)
+
+_COMMITMENT_ROW = [("proposer", "<i4"), ("acceptor", "<i4"), ("shift_min", "<i4"), ("moved_students", "<i4"),
+                   ("created_episode", "<i4"), ("due_episode", "<i4"), ("fulfilled_episode", "<i4"),
+                   ("times_missed", "<i4"), ("fulfilled", "?"), ("counter", "?")]
+
+class CommitmentArray:
+    """Commitments stored as the rows of one numpy structured array, 34 bytes each.
+
+    Agents are AgentIds handles and fulfilled_episode is -1 for None. Ids are
+    formatted on read like a Commitment's; only explicitly given ones are kept.
+    Reading a row builds a new Commitment, so this suits commitments that no
+    longer change, such as a ledger's archive. `array` is the live rows for
+    vectorised queries, e.g. archive.array["fulfilled"].mean().
+    """
+    def __init__(self, ids: Optional[AgentIds] = None, capacity: int = 1024):
+        import numpy as np
+        self.ids = ids if ids is not None else AgentIds()
+        self._rows = np.zeros(max(1, capacity), dtype=_COMMITMENT_ROW)
+        self._n = 0
+        self._given_ids: Dict[int, str] = {}
+
+    @property
+    def array(self):
+        return self._rows[:self._n]
+
+    def append(self, com: Commitment):
+        self.extend((com,))
+
+    def extend(self, coms):
+        coms = list(coms)
+        if not coms:
+            return
+        need = self._n + len(coms)
+        if need > self._rows.shape[0]:
+            import numpy as np
+            grown = np.zeros(max(need, 2 * self._rows.shape[0]), dtype=_COMMITMENT_ROW)
+            grown[:self._n] = self._rows[:self._n]
+            self._rows = grown
+        intern = self.ids.intern
+        rows = []
+        for k, com in enumerate(coms, self._n):
+            given = _given_id(com)
+            if given is not None:
+                self._given_ids[k] = given
+            rows.append((intern(com.proposer), intern(com.acceptor), com.shift_min, com.moved_students,
+                         com.created_episode, com.due_episode,
+                         -1 if com.fulfilled_episode is None else com.fulfilled_episode,
+                         com.times_missed, com.fulfilled, com.counter))
+        import numpy as np
+        self._rows[self._n:need] = np.array(rows, dtype=_COMMITMENT_ROW)
+        self._n = need
+
+    def _commitment(self, k: int, row: tuple) -> Commitment:
+        p, a, shift, moved, created, due, fulfilled_ep, missed, fulfilled, counter = row
+        names = self.ids.names
+        return Commitment(self._given_ids.get(k, _COUNTER_ID if counter else None), names[p], names[a], shift, moved,
+                          created, due, fulfilled, None if fulfilled_ep < 0 else fulfilled_ep, missed)
+
+    def __getitem__(self, k: int) -> Commitment:
+        if k < 0:
+            k += self._n
+        if not 0 <= k < self._n:
+            raise IndexError(k)
+        return self._commitment(k, self._rows[k].tolist())
+
+    def copy(self) -> "CommitmentArray":
+        """An independent array holding the same rows."""
+        clone = CommitmentArray(AgentIds(self.ids.names), capacity=self._n)
+        clone._rows[:self._n] = self._rows[:self._n]
+        clone._n = self._n
+        clone._given_ids = dict(self._given_ids)
+        return clone
+
+    def __iter__(self):
+        chunk = 1 << 16  # rows converted per tolist(), to bound the temporaries
+        for start in range(0, self._n, chunk):
+            for k, row in enumerate(self._rows[start:min(start + chunk, self._n)].tolist(), start):
+                yield self._commitment(k, row)
+
+    def __len__(self):
+        return self._n
+
+class CommitmentLedger:
+    """Commitments indexed for the fulfillment loop.
+
+    Open commitments are looked up by (proposer, due_episode) and by acceptor in O(1).
+    close_episode() moves everything that came due into the append-only `archive`,
+    fulfilled or not, since a due commitment is never retried in a later episode.
+    With keep_archive=False settled commitments are only counted, and kept in
+    `last_settled` until the next close_episode(), so memory does not grow with the run.
+    compact_archive=True keeps the archive as a CommitmentArray, whose rows are
+    read back as new Commitment objects.
+    """
+    def __init__(self, keep_archive: bool = True, compact_archive: bool = False):
+        self._due: Dict[tuple, List[Commitment]] = {}
+        self._by_episode: Dict[int, List[Commitment]] = {}
+        self._by_acceptor: Dict[str, Dict[int, Commitment]] = {}
+        self.keep_archive = keep_archive
+        self.archive = CommitmentArray() if compact_archive else []
+        self.last_settled: List[Commitment] = []
+        self.created = 0
+        self.fulfilled = 0
+        self.expired = 0
+
+    def append(self, com: Commitment):
+        self._due.setdefault((com.proposer, com.due_episode), []).append(com)
+        self._by_episode.setdefault(com.due_episode, []).append(com)
+        self._by_acceptor.setdefault(com.acceptor, {})[id(com)] = com
+        self.created += 1
+
+    def due(self, proposer: str, episode: int) -> List[Commitment]:
+        return self._due.get((proposer, episode), [])
+
+    def owed_to(self, acceptor: str) -> List[Commitment]:
+        return list(self._by_acceptor.get(acceptor, {}).values())
+
+    def close_episode(self, episode: int):
+        self.last_settled = self._by_episode.pop(episode, [])
+        for com in self.last_settled:
+            self._due.pop((com.proposer, episode), None)
+            self._by_acceptor[com.acceptor].pop(id(com), None)
+            if com.fulfilled:
+                self.fulfilled += 1
+            else:
+                self.expired += 1
+        if self.keep_archive:
+            self.archive.extend(self.last_settled)
+
+    def open(self) -> List[Commitment]:
+        return [com for bucket in self._by_episode.values() for com in bucket]
+
+    def __iter__(self):
+        # settled history first, then what is still open
+        yield from self.archive
+        for bucket in self._by_episode.values():
+            yield from bucket
+
+    def __len__(self):
+        return self.created
+
+
+# ---------- time grid ----------
+# By default offsets are whole minutes and a batch fits between two of them.
+# cfg["time_resolution_s"] switches to a finer grid: offsets (and shifts) count
+# ticks of that many seconds, and a batch occupies batch_span(cfg) ticks.
+
+DENSE_SCHEDULE_CELLS = 1 << 20  # compact_schedules="auto": largest agents x offsets matrix kept dense
+
+
+def time_grid(resolution_s: int, window_min: int) -> List[int]:
+    """Tick offsets covering +-window_min minutes, nearest first: 0, -1, 1, -2, 2, ..."""
+    ticks = window_min * 60 // resolution_s
+    return [0] + [sign * k for k in range(1, ticks + 1) for sign in (-1, 1)]
+
+
+def with_time_resolution(cfg: Dict, resolution_s: int, window_min: int) -> Dict:
+    """A copy of cfg on a grid of `resolution_s`-second ticks over +-window_min minutes.
+
+    Unless compact schedules were asked for, schedules pick their form by size ("auto").
+    """
+    return dict(cfg, time_resolution_s=resolution_s, time_offsets=time_grid(resolution_s, window_min),
+                compact_schedules=cfg.get("compact_schedules") or "auto")
+
+
+def batch_span(cfg: Dict) -> int:
+    """Ticks one batch occupies (1 on the default minute grid)."""
+    resolution = cfg.get("time_resolution_s")
+    if not resolution:
+        return 1
+    return max(1, -(-cfg["bottleneck"]["batch_duration_min"] * 60 // resolution))
+
+
+def dense_schedules(cfg: Dict) -> bool:
+    """Whether schedules live in a ScheduleMatrix; "auto" keeps them sparse once the matrix would be large."""
+    mode = cfg.get("compact_schedules")
+    if mode == "auto":
+        return len(cfg["time_offsets"]) * cfg["num_classrooms"] <= DENSE_SCHEDULE_CELLS
+    return bool(mode)
+
+
+# ---------- episode loop ----------
+
+def build_agents(cfg, rng=None, events=None):
+    """Bottleneck, shared ledger and classrooms for one run; `rng` isolates personality draws.
+
+    All agents share one EventBus (`events`, or a new sink-less one reachable as B.events).
+    """
+    B = BottleneckAgent(cfg, events=events)
+
+    # Shared per-offset load, updated by the agents as they move students
+    span = batch_span(cfg)
+    if span > 1:
+        ledger = WindowedSlotLedger(B.per_batch, cfg["time_offsets"], span)
+    else:
+        ledger = SlotLedger(B.per_batch, cfg["time_offsets"])
+
+    # Classrooms (optionally backed by one shared schedule matrix)
+    schedule_matrix = ScheduleMatrix(cfg["time_offsets"], cfg["num_classrooms"]) if dense_schedules(cfg) else None
+    classrooms = [ClassroomAgent(f"C{i+1}", cfg["attendance"][i], cfg, ledger=ledger, matrix=schedule_matrix, rng=rng,
+                                 events=B.events)
+                  for i in range(cfg["num_classrooms"])]
+    for c in classrooms:
+        c.is_stubborn = c.id in cfg.get("stubborn_classrooms", [])
+    return B, ledger, classrooms, {c.id: c for c in classrooms}
+
+
+def start_episode(ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger):
+    """Steps 1-2 of an episode: broadcast capacity, then fulfil carry-over commitments.
+
+    Returns the commitment counters finish_episode() reports against.
+    """
+    events = B.events
+    ep_tag = f"{cfg['episode_base_name']}_ep{ep}"
+    events.emit("episode_start", episode=ep, tag=ep_tag)
+
+    # 1) Broadcast capacity, initial slot assignment = 0
+    with events.phase("broadcast"):
+        msg = B.broadcast_capacity(cfg["attendance"], ep_tag)
+        for c in classrooms:
+            c.on_capacity_broadcast(msg)
+
+    if events.active:
+        events.emit("initial_slots", slot_map=compute_slot_map(classrooms))
+
+    fulfilled_before = commitments_global.fulfilled
+
+    # 2) Fulfill carry-over commitments (agents update the ledger as they move students)
+    with events.phase("fulfill"):
+        for c in classrooms:
+            c.fulfill_due_commitments(commitments_global, current_episode=ep,
+                                      slot_map=ledger, B_agent=B, agents_by_id=agents_by_id,
+                                      violation_threshold=cfg["violation_threshold"])
+        commitments_global.close_episode(ep)
+    if events.active:
+        events.emit("after_fulfill", slot_map=compute_slot_map(classrooms))
+    return fulfilled_before, len(commitments_global)
+
+
+def negotiation(off, a1, a2, ep, slot_map, events):
+    """The pairwise protocol at one congested offset, a1 proposing to a2.
+
+    A generator: every agent decision or schedule change is yielded as an
+    (agent, method name, args) request and the method's result is sent back,
+    so the same protocol runs called directly (drive) or as messages between
+    agent coroutines (async_negotiation). Returns the commitments it created.
+    """
+    events.emit("propose", agent=a1.id, other=a2.id)
+
+    # REPUTATION CHECK
+    if a2.reputation < 0.5:
+        events.emit("low_reputation", agent=a1.id, other=a2.id, reputation=a2.reputation)
+        return []  # a1 skips a2
+    offer = yield a1, "propose_shift", (a2, off, ep, slot_map)
+    if not offer:
+        return []
+    return (yield from answer_offer(offer, a1, a2, ep, slot_map, events))
+
+
+def answer_offer(offer, a1, a2, ep, slot_map, events):
+    """a2's side of a1's offer: accept it, or counter and let a1 decide. Returns the commitments created."""
+    if events.active:
+        events.emit("utility", agent=a2.id, subject="offer", utility=a2.calculate_utility(offer),
+                    threshold=a2.utility_threshold)
+    if (yield a2, "evaluate_offer", (offer,)):
+        # --- Offer Accepted ---
+        events.emit("offer_accepted", agent=a1.id, other=a2.id, shift=offer.shift_min)
+        yield a2, "apply_offer", (offer,)
+        com = Commitment.from_offer(offer, ep)
+        events.emit("committed", commitment=com.commitment_id, due=ep+1)
+        return [com]
+
+    # --- Offer Rejected, Initiating Counter-Offer Sequence ---
+    events.emit("offer_rejected", agent=a1.id, other=a2.id)
+    counter_offer = yield a2, "formulate_counter_offer", (offer, ep, slot_map)
+    if not counter_offer:
+        # a2 did not provide a counter-offer
+        events.emit("no_counter", agent=a2.id, other=a1.id)
+        return []
+
+    # a2 made a counter-offer. Now a1 must evaluate it.
+    events.emit("counter_offer", agent=a2.id, other=a1.id, shift=counter_offer.shift_min)
+    if events.active:
+        events.emit("utility", agent=a1.id, subject="counter-offer",
+                    utility=a1.calculate_utility(counter_offer), threshold=a1.utility_threshold)
+    if not (yield a1, "evaluate_offer", (counter_offer,)):
+        events.emit("counter_rejected", agent=a1.id, other=a2.id)
+        return []
+    events.emit("counter_accepted", agent=a1.id, other=a2.id)
+    yield a1, "apply_offer", (counter_offer,)  # a1 applies the offer to its own schedule
+    # a2, the counter-offer's proposer, now owes; a1 is owed
+    com = Commitment.from_offer(counter_offer, ep)
+    events.emit("committed", commitment=com.commitment_id, due=ep+1, counter=True)
+    return [com]
+
+
+def negotiation_n_way(off, agents, ep, slot_map, events):
+    """The N-way protocol at one congested offset: agents[0] splits the excess over all the other contributors.
+
+    The proposer offers shares of the excess to several acceptors and target
+    offsets in one step (propose_shares). Each offer is then answered like a
+    pairwise one, counter-offer included, so every accepted leg is its own
+    bilateral commitment. A generator, like negotiation().
+    """
+    a1, acceptors = agents[0], []
+    for a2 in agents[1:]:
+        if a2.reputation < 0.5:
+            events.emit("low_reputation", agent=a1.id, other=a2.id, reputation=a2.reputation)
+        else:
+            acceptors.append(a2)
+    if not acceptors:
+        return []
+    offers = yield a1, "propose_shares", (acceptors, off, ep, slot_map)
+    if not offers:
+        return []
+    if events.active:
+        events.emit("propose_shares", agent=a1.id, offset=off, offers=len(offers),
+                    students=sum(offer.moved_students for offer in offers))
+    by_id = {a.id: a for a in acceptors}
+    created, proposed = [], set()
+    for offer in offers:
+        a2 = by_id[offer.acceptor]
+        if a2.id not in proposed:
+            proposed.add(a2.id)
+            events.emit("propose", agent=a1.id, other=a2.id)
+        created += yield from answer_offer(offer, a1, a2, ep, slot_map, events)
+    return created
+
+
+NEGOTIATION_PROTOCOLS = ("pairwise", "n_way", "auction")
+
+
+def negotiation_parties(cfg, ledger, off) -> list:
+    """Who negotiates at a congested offset: the top two contributors, or all of them for "n_way"; [] if fewer than two."""
+    if cfg.get("negotiation_protocol", "pairwise") == "n_way":
+        parties = ledger.ranked_contributors(off)
+    else:
+        parties = ledger.top_contributors(off, 2)
+    return parties if len(parties) >= 2 else []
+
+
+def negotiate(cfg, off, parties, ep, slot_map, events):
+    """The configured protocol's generator for negotiation_parties()."""
+    protocol = cfg.get("negotiation_protocol", "pairwise")
+    if protocol == "n_way":
+        return negotiation_n_way(off, parties, ep, slot_map, events)
+    if protocol != "pairwise":
+        raise ValueError(f"{protocol!r} is not a negotiation_protocol with rounds, expected one of {NEGOTIATION_PROTOCOLS[:2]}")
+    return negotiation(off, parties[0], parties[1], ep, slot_map, events)
+
+
+def auction(ep, cfg, B, classrooms, events, bids=None) -> List[Commitment]:
+    """The "auction" protocol: one sealed-bid auction over the whole window instead of negotiation rounds.
+
+    Every classroom bids (submit_bids, unless `bids` already holds them in
+    classroom order), B clears all bids at once and the classrooms apply their
+    awards. A slot placed below its best bid is owed by the classroom with the
+    most students at that best target: one commitment per such slot, like the
+    one an accepted offer creates. Returns the commitments.
+    """
+    offsets = cfg["time_offsets"]
+    if bids is None:
+        bids = [c.submit_bids(offsets) for c in classrooms]
+    bids = [(c.id, agent_bids) for c, agent_bids in zip(classrooms, bids)]
+    awards = B.clear_auction(bids, batch_span(cfg))
+
+    by_agent: Dict[str, list] = {}
+    placed: Dict[tuple, list] = {}
+    winners: Dict[int, Dict[str, int]] = {}
+    for agent_id, src, target, cnt in awards:
+        by_agent.setdefault(agent_id, []).append((src, target, cnt))
+        placed.setdefault((agent_id, src), []).append((target, cnt))
+        at = winners.setdefault(target, {})
+        at[agent_id] = at.get(agent_id, 0) + cnt
+    for c in classrooms:
+        c.apply_awards(by_agent.get(c.id, ()))
+    # the two classrooms with the most students at each target; ties: the one awarded there first
+    leaders = {target: sorted(at, key=at.get, reverse=True)[:2] for target, at in winners.items()}
+
+    created, displaced = [], 0
+    for agent_id, agent_bids in bids:
+        best = {}
+        for src, _, target, value in agent_bids:
+            if src not in best or value > best[src][1]:
+                best[src] = (target, value)
+        for src, (target, _) in best.items():
+            elsewhere = [(cnt, t) for t, cnt in placed[agent_id, src] if t != target]
+            moved = sum(cnt for cnt, _ in elsewhere)
+            rivals = [a for a in leaders.get(target, ()) if a != agent_id]
+            if not moved or not rivals:
+                continue
+            displaced += moved
+            owes = rivals[0]
+            created.append(Commitment(None, owes, agent_id, max(elsewhere)[1] - src, moved, ep, ep + 1))
+    if events.active:
+        events.emit("auction", bids=sum(len(b) for _, b in bids), agents=len(bids),
+                    moved=sum(cnt for _, src, target, cnt in awards if target != src), displaced=displaced)
+        for com in created:
+            events.emit("committed", commitment=com.commitment_id, due=ep + 1)
+    return created
+
+
+def drive(steps):
+    """Runs a negotiation() generator to completion, calling each requested agent method directly."""
+    try:
+        agent, method, args = next(steps)
+        while True:
+            agent, method, args = steps.send(getattr(agent, method)(*args))
+    except StopIteration as done:
+        return done.value
+
+
+def finish_episode(ep, cfg, B, classrooms, commitments_global, ledger, counters, rounds, cleared):
+    """Step 4 (optional centralized fallback) and the episode summary; `counters` comes from start_episode()."""
+    events = B.events
+    fulfilled_before, commitments_before = counters
+
+    # 4) Optional centralized fallback when negotiation left offsets congested
+    fallback = bool(ledger.congested) and bool(cfg.get("central_fallback"))
+    if fallback:
+        from central_scheduler import apply_assignment, report_cost, solve_schedule
+        still_congested = ledger.congested_offsets()
+        with events.phase("central_fallback"):
+            assignment = solve_schedule(classrooms, cfg["time_offsets"], B.per_batch)
+            moved = apply_assignment(assignment, classrooms)
+        events.emit("central_fallback", offsets=still_congested, moved=moved,
+                    cost=report_cost(assignment.cost), overflow=assignment.overflow)
+
+    if events.active:
+        events.emit("final_slots", slot_map=compute_slot_map(classrooms))
+        events.emit("schedules", schedules={c.id: list(c.planned_slots) for c in classrooms})
+
+    return {
+        "episode": ep,
+        "rounds": rounds,
+        "cleared": cleared or not ledger.congested,
+        "fallback": fallback,
+        "peak_load": ledger.peak_load(),
+        "commitments_created": len(commitments_global) - commitments_before,
+        "commitments_fulfilled": commitments_global.fulfilled - fulfilled_before,
+    }
+
+
+def run_episode(ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger, cache=None):
+    """One broadcast -> fulfill -> negotiate cycle; returns a small summary of the episode.
+
+    Progress is reported as events on B.events, the bus shared by all agents.
+    With an EpisodeCache, repeated episodes are replayed from it and the
+    summary also says whether the episode was `cached` and `steady`.
+    """
+    if cache is not None:
+        return cache.run_episode(ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger)
+    events = B.events
+    counters = start_episode(ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger)
+    if cfg.get("negotiation_protocol") == "auction":
+        rounds, cleared, _ = run_auction(ep, cfg, B, classrooms, commitments_global, ledger)
+        return finish_episode(ep, cfg, B, classrooms, commitments_global, ledger, counters, rounds, cleared)
+    rounds, cleared = 0, False
+
+    # 3) Negotiation rounds
+    for round_ in range(cfg["max_negotiation_rounds"]):
+        congested_offsets = ledger.congested_offsets()
+        if not congested_offsets:
+            events.emit("round_clear", round=round_, episode=ep)
+            cleared = True
+            break
+        rounds += 1
+        # proposals within a round see the loads as they stood at the start of the round
+        slot_map = ledger.snapshot()
+        events.emit("round_start", round=round_, offsets=congested_offsets)
+        with events.phase("negotiation_round"):
+            for off in congested_offsets:
+                # the two biggest contributors at this offset negotiate (all of them, n_way)
+                parties = negotiation_parties(cfg, ledger, off)
+                if not parties:
+                    continue
+                for com in drive(negotiate(cfg, off, parties, ep, slot_map, events)):
+                    commitments_global.append(com)
+
+    return finish_episode(ep, cfg, B, classrooms, commitments_global, ledger, counters, rounds, cleared)
+
+
+def run_auction(ep, cfg, B, classrooms, commitments_global, ledger, bids=None):
+    """Step 3 under the "auction" protocol: one auction if anything is congested.
+
+    Returns (rounds, cleared, the commitments created).
+    """
+    events = B.events
+    rounds, created = 0, []
+    if ledger.congested:
+        rounds = 1
+        events.emit("round_start", round=0, offsets=ledger.congested_offsets())
+        with events.phase("auction"):
+            created = auction(ep, cfg, B, classrooms, events, bids)
+        for com in created:
+            commitments_global.append(com)
+    cleared = not ledger.congested
+    if cleared:
+        events.emit("round_clear", round=rounds, episode=ep)
+    return rounds, cleared, created
+
+
+class EpisodeCache:
+    """Bounded LRU of episode outcomes, keyed by the state an episode starts from.
+
+    An episode is a function of each classroom's attendance (and so its schedule
+    after the broadcast), personality, stubbornness, reputation and utility
+    threshold, and of the commitments falling due, in fulfilment order. On a
+    hit, run_episode() sets the recorded schedules, reputations and commitment
+    outcomes instead of fulfilling and negotiating. Counters the protocol never
+    reads (violations, missed commitments) are replayed as increments, and new
+    commitments get this episode's ids and due dates.
+
+    An episode that starts where the run's previous one did is `steady`: every
+    later episode repeats it, so a long run can stop there. Runs with event
+    sinks always take the full path, since a hit emits nothing. A cache can be
+    shared by runs of the same config, not across configs.
+    """
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._outcomes: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._previous = weakref.WeakKeyDictionary()  # ledger -> key its run's last episode started from
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._outcomes)
+
+    @staticmethod
+    def entry_key(ep, classrooms, commitments_global: "CommitmentLedger") -> tuple:
+        agents = tuple((c.attendance, c.personality, c.is_stubborn, c.reputation, c.utility_threshold)
+                       for c in classrooms)
+        due = tuple((com.proposer, com.acceptor, com.shift_min, com.moved_students, com.times_missed, com.fulfilled)
+                    for c in classrooms for com in commitments_global.due(c.id, ep))
+        return agents, due
+
+    def run_episode(self, ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger):
+        if not isinstance(commitments_global, CommitmentLedger):
+            return run_episode(ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger)
+        key = self.entry_key(ep, classrooms, commitments_global)
+        steady = self._previous.get(ledger) == key
+        self._previous[ledger] = key
+        outcome = self._outcomes.get(key) if not B.events.active else None
+        if outcome is not None:
+            self._outcomes.move_to_end(key)
+            self.hits += 1
+            summary = self._replay(outcome, ep, classrooms, commitments_global)
+        else:
+            self.misses += 1
+            summary = self._record(key, ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger)
+        summary.update(cached=outcome is not None, steady=steady)
+        return summary
+
+    def _record(self, key, ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger) -> Dict:
+        due = [com for c in classrooms for com in commitments_global.due(c.id, ep)]
+        counters = [(c.violations, c.missed_commitments) for c in classrooms]
+        summary = run_episode(ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger)
+        created = [com for com in commitments_global.open() if com.created_episode == ep]
+        if B.events.active or any(_given_id(com) is not None for com in created):
+            return summary
+        self._outcomes[key] = (
+            tuple(tuple(c.planned_slots) for c in classrooms),
+            tuple((c.reputation, c.violations - v, c.missed_commitments - m)
+                  for c, (v, m) in zip(classrooms, counters)),
+            tuple((com.fulfilled, com.times_missed) for com in due),
+            tuple((com.counter, com.proposer, com.acceptor, com.shift_min, com.moved_students) for com in created),
+            {k: v for k, v in summary.items() if k != "episode"},
+        )
+        if len(self._outcomes) > self.maxsize:
+            self._outcomes.popitem(last=False)
+        return summary
+
+    @staticmethod
+    def _replay(outcome, ep, classrooms, commitments_global: "CommitmentLedger") -> Dict:
+        schedules, agents, due_after, created, summary = outcome
+        due = [com for c in classrooms for com in commitments_global.due(c.id, ep)]
+        for c, slots, (reputation, violations, missed) in zip(classrooms, schedules, agents):
+            c.planned_slots = list(slots)
+            c.reputation = reputation
+            c.violations += violations
+            c.missed_commitments += missed
+        for com, (fulfilled, times_missed) in zip(due, due_after):
+            if fulfilled and not com.fulfilled:
+                com.fulfilled_episode = ep
+            com.fulfilled, com.times_missed = fulfilled, times_missed
+        commitments_global.close_episode(ep)
+        for counter, proposer, acceptor, shift, moved in created:
+            commitments_global.append(Commitment(_COUNTER_ID if counter else None, proposer, acceptor, shift, moved,
+                                                 ep, ep + 1))
+        return dict(summary, episode=ep)
+
+
+def stream_episodes(cfg, num_episodes: Optional[int] = None, rng=None, events=None, trace=None,
+                    cache: Optional[EpisodeCache] = None):
+    """Runs a fresh campus lazily, yielding one summary per episode (forever if num_episodes is None).
+
+    Only what later episodes depend on stays in memory: the agents, the slot
+    ledger and the open commitments. Settled commitments are dropped, or
+    written to `trace` (a TraceWriter) together with the episode's schedules,
+    loads and events, so memory is flat however long the run. Each summary
+    also carries the campus' mean and min reputation after the episode.
+    """
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=rng, events=events)
+    commitments_global = CommitmentLedger(keep_archive=False)
+    log = B.events.subscribe(RingBufferSink()) if trace is not None else None
+    ep = 0
+    while num_episodes is None or ep < num_episodes:
+        ep += 1
+        summary = run_episode(ep, cfg, B, classrooms, agents_by_id, commitments_global, ledger, cache=cache)
+        if log is not None:
+            trace.record_episode(ep, ledger, classrooms, commitments_global, log)
+            log.clear()
+        reputations = [c.reputation for c in classrooms]
+        summary["mean_reputation"] = sum(reputations) / len(reputations)
+        summary["min_reputation"] = min(reputations)
+        yield summary
+
+
+def episodes_from_events(events):
+    """Per-episode proposals, schedules, broadcast, fulfillments and violations, read straight off Event records."""
+    episodes = []
+    ep = None
+    current_round = None
+    last_rejected = None
+
+    for e in events:
+        d = e.data
+        if e.kind == "episode_start":
+            ep = {
+                "name": f"{d['episode']} ({d['tag']})",
+                "proposals": [],
+                "schedules": {},
+                "broadcast": None,
+                "fulfillments": [],
+                "violations": []
+            }
+            episodes.append(ep)
+            current_round, last_rejected = None, None
+        elif ep is None:
+            continue
+        elif e.kind == "broadcast":
+            ep["broadcast"] = {"per_batch_capacity": d["per_batch"], "total_est": d["total_estimate"]}
+        elif e.kind == "fulfilled":
+            ep["fulfillments"].append(e.text().split("] ", 1)[1])
+        elif e.kind == "violation":
+            ep["violations"].append(e.text().split("] ", 1)[1])
+        elif e.kind == "round_start":
+            current_round = d["round"]
+        elif e.kind == "offer_accepted":
+            ep["proposals"].append({"from": d["agent"], "to": d["other"], "shift": d["shift"],
+                                    "status": "accepted", "type": "direct", "round": current_round})
+        elif e.kind == "offer_rejected":
+            last_rejected = {"from": d["agent"], "to": d["other"],
+                             "status": "rejected", "type": "direct", "round": current_round}
+            ep["proposals"].append(last_rejected.copy())
+        elif e.kind == "counter_offer" and last_rejected:
+            # The counter is from the rejecter back to the original proposer
+            ep["proposals"].append({"from": last_rejected["to"], "to": last_rejected["from"], "shift": d["shift"],
+                                    "status": "counter_offered", "type": "counter", "round": current_round})
+        elif e.kind == "counter_accepted":
+            # Find the most recent counter offer and mark it as accepted
+            for prop in reversed(ep["proposals"]):
+                if (prop["type"] == "counter" and prop["from"] == d["other"] and prop["to"] == d["agent"]
+                        and prop.get("status") == "counter_offered"):
+                    prop["status"] = "accepted"
+                    break
+        elif e.kind == "schedules":
+            ep["schedules"] = {cls: list(slots) for cls, slots in d["schedules"].items()}
+
+    return episodes
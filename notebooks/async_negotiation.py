@@ -0,0 +1,198 @@
+"""Asyncio negotiation engine: classrooms as coroutines exchanging messages.
+
+Each ClassroomAgent is wrapped in an AgentActor, a coroutine that serves its
+inbox one message at a time. Messages carry the protocol's requests (propose,
+evaluate or apply an offer, formulate a counter-offer, bid). Commitments go to
+the shared CommitmentLedger, as in run_episode, so both engines leave the
+agents in the same state. The protocol itself is CEFO.negotiation
+(or negotiation_n_way, per cfg["negotiation_protocol"]), so decisions are
+exactly those of run_episode.
+
+Within a round, every congested offset's negotiation is its own task, so
+negotiations that share no agent run concurrently. An agent takes
+part in one negotiation at a time: each holds its agents' OrderedLocks, which
+are granted in the order the round lists its offsets (congested_offsets()), so
+conflicting negotiations run one after another in the order the sequential
+loop would use.
+
+The outcome is deterministic under a fixed seed whatever the decision
+latencies: parties are chosen from the ledger as it stood at the start of the
+round (proposals already see that snapshot), conflicts are ordered as the
+round lists its offsets, and a round's commitments and events are released in
+that order once all of its negotiations are done. It differs from run_episode only when a negotiation
+changes who the top contributors are at a later offset of the same round.
+
+    engine = AsyncNegotiationEngine(config, B, classrooms, agents_by_id, commitments, ledger,
+                                    decision_latency=0.05)
+    summary = engine.run_episode(ep)          # or: await engine.episode(ep)
+"""
+import asyncio
+import contextvars
+from typing import Dict, List, Optional
+
+from CEFO import finish_episode, negotiate, negotiation_parties, run_auction, start_episode
+
+# which negotiation (its position in the round) the running code belongs to
+_negotiation: contextvars.ContextVar = contextvars.ContextVar("negotiation", default=None)
+
+
+class OrderedLock:
+    """Per-agent lock granted strictly in ticket order; tickets are handed out in the order each round lists its offsets."""
+    def __init__(self):
+        self._issued = 0
+        self._serving = 0
+        self._turn = asyncio.Condition()
+
+    def ticket(self) -> int:
+        self._issued += 1
+        return self._issued - 1
+
+    async def acquire(self, ticket: int):
+        async with self._turn:
+            await self._turn.wait_for(lambda: self._serving == ticket)
+
+    async def release(self):
+        async with self._turn:
+            self._serving += 1
+            self._turn.notify_all()
+
+
+class AgentActor:
+    """A ClassroomAgent behind an inbox; `decision_latency` seconds are spent on every decision."""
+    DECISIONS = ("propose_shift", "propose_shares", "evaluate_offer", "formulate_counter_offer", "submit_bids")
+
+    def __init__(self, agent, decision_latency: float = 0.0):
+        self.agent = agent
+        self.decision_latency = decision_latency
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.lock = OrderedLock()
+
+    async def ask(self, method: str, args: tuple, negotiation_key=None):
+        reply = asyncio.get_running_loop().create_future()
+        await self.inbox.put((method, args, negotiation_key, reply))
+        return await reply
+
+    async def run(self):
+        while True:
+            message = await self.inbox.get()
+            if message is None:
+                return
+            method, args, key, reply = message
+            try:
+                if self.decision_latency and method in self.DECISIONS:
+                    await asyncio.sleep(self.decision_latency)
+                _negotiation.set(key)  # events the agent emits belong to the asking negotiation
+                reply.set_result(getattr(self.agent, method)(*args))
+            except Exception as exc:
+                reply.set_exception(exc)
+
+
+class _RoundCapture:
+    """Sink holding each negotiation's events until its round ends, so they come out in round order."""
+    def __init__(self):
+        self.buffers: Dict[Optional[int], list] = {}
+
+    def write(self, event):
+        self.buffers.setdefault(_negotiation.get(), []).append(event)
+
+
+class AsyncNegotiationEngine:
+    """run_episode with each round's negotiations running concurrently over agent coroutines."""
+    def __init__(self, cfg, B, classrooms, agents_by_id, commitments_global, ledger,
+                 decision_latency: float = 0.0):
+        self.cfg = cfg
+        self.B = B
+        self.classrooms = classrooms
+        self.agents_by_id = agents_by_id
+        self.commitments = commitments_global
+        self.ledger = ledger
+        self.decision_latency = decision_latency
+
+    def run_episode(self, ep: int) -> Dict:
+        return asyncio.run(self.episode(ep))
+
+    async def episode(self, ep: int) -> Dict:
+        cfg, ledger = self.cfg, self.ledger
+        counters = start_episode(ep, cfg, self.B, self.classrooms, self.agents_by_id, self.commitments, ledger)
+        actors = {c.id: AgentActor(c, self.decision_latency) for c in self.classrooms}
+        workers = [asyncio.create_task(a.run()) for a in actors.values()]
+        try:
+            if cfg.get("negotiation_protocol") == "auction":
+                rounds, cleared = await self._auction(ep, actors)
+            else:
+                rounds, cleared = await self._negotiate_rounds(ep, actors)
+        finally:
+            for a in actors.values():
+                a.inbox.put_nowait(None)
+            await asyncio.gather(*workers)
+        return finish_episode(ep, cfg, self.B, self.classrooms, self.commitments, ledger, counters, rounds, cleared)
+
+    async def _negotiate_rounds(self, ep, actors):
+        events, ledger = self.B.events, self.ledger
+        rounds, cleared = 0, False
+        for round_ in range(self.cfg["max_negotiation_rounds"]):
+            congested_offsets = ledger.congested_offsets()
+            if not congested_offsets:
+                events.emit("round_clear", round=round_, episode=ep)
+                cleared = True
+                break
+            rounds += 1
+            slot_map = ledger.snapshot()
+            events.emit("round_start", round=round_, offsets=congested_offsets)
+            with events.phase("negotiation_round"):
+                await self._round(ep, congested_offsets, slot_map, actors)
+        return rounds, cleared
+
+    async def _auction(self, ep, actors):
+        """Every classroom bids at once, each from its own actor; B then clears the bids as in run_episode."""
+        bids = None
+        if self.ledger.congested:
+            offsets = self.cfg["time_offsets"]
+            bids = await asyncio.gather(*(actors[c.id].ask("submit_bids", (offsets,)) for c in self.classrooms))
+        rounds, cleared, _ = run_auction(ep, self.cfg, self.B, self.classrooms, self.commitments, self.ledger, bids)
+        return rounds, cleared
+
+    async def _round(self, ep, congested_offsets, slot_map, actors):
+        events = self.B.events
+        negotiations = []
+        for off in congested_offsets:
+            parties = negotiation_parties(self.cfg, self.ledger, off)
+            if parties:
+                negotiations.append((off, [actors[a.id] for a in parties]))
+        # tickets in round order, before any task runs, fix the order of conflicting negotiations
+        tickets = [[p.lock.ticket() for p in parties] for _, parties in negotiations]
+
+        capture, sinks = _RoundCapture(), events.sinks
+        if sinks:
+            events.sinks = [capture]
+        try:
+            results = await asyncio.gather(*(
+                self._negotiate(key, off, parties, held, ep, slot_map)
+                for key, ((off, parties), held) in enumerate(zip(negotiations, tickets))))
+        finally:
+            events.sinks = sinks
+        for key, created in enumerate(results):
+            for event in capture.buffers.get(key, ()):
+                for sink in sinks:
+                    sink.write(event)
+            for com in created:
+                self.commitments.append(com)
+
+    async def _negotiate(self, key, off, parties: List[AgentActor], tickets: List[int], ep, slot_map) -> List:
+        _negotiation.set(key)
+        by_id = {p.agent.id: p for p in parties}
+        for p, ticket in zip(parties, tickets):
+            await p.lock.acquire(ticket)
+        try:
+            steps = negotiate(self.cfg, off, [p.agent for p in parties], ep, slot_map, self.B.events)
+            try:
+                agent, method, args = next(steps)
+                while True:
+                    result = await by_id[agent.id].ask(method, args, key)
+                    agent, method, args = steps.send(result)
+            except StopIteration as done:
+                return done.value
+        finally:
+            for p in reversed(parties):
+                await p.lock.release()
+
@@ -0,0 +1,374 @@
+"""Vectorized CEFO engine: N independent scenarios advanced in lockstep.
+
+Every scenario follows the protocol of the scalar run_episode loop
+(broadcast -> fulfil due commitments -> negotiation rounds) for the configs
+it supports: the pairwise protocol on the default minute grid, without the
+central fallback, over any cfg["time_offsets"] window. Other configs are
+rejected with a ValueError. State is held in stacked NumPy arrays with a
+leading scenario axis and each protocol step is applied to all scenarios at
+once, with masks where their paths diverge.
+"""
+import numpy as np
+from typing import Dict, List
+
+from CEFO import batch_span
+
+PERSONALITIES = ['prefers_early', 'prefers_late', 'flexible']
+EARLY, LATE, FLEXIBLE = 0, 1, 2
+
+_ABSENT = np.iinfo(np.int64).max
+
+
+def random_personalities(num_scenarios: int, num_agents: int, rng: np.random.Generator) -> np.ndarray:
+    return rng.integers(0, len(PERSONALITIES), size=(num_scenarios, num_agents)).astype(np.int8)
+
+
+def preferred_offsets(offsets: List[int]) -> Dict[int, List[int]]:
+    """Offsets formulate_counter_offer picks from, per personality: before or after the hour, in window order."""
+    return {EARLY: [o for o in offsets if o < 0], LATE: [o for o in offsets if o > 0]}
+
+
+def _utility(personality, shift, proposer: bool):
+    """ClassroomAgent.calculate_utility, element-wise."""
+    early, late = personality == EARLY, personality == LATE
+    bonus = np.where((early & (shift < 0)) | (late & (shift > 0)), 0.5,
+                     np.where((early & (shift > 0)) | (late & (shift < 0)), -0.5, 0.0))
+    return (0.0 + 0.3 if proposer else 0.0) + bonus
+
+
+class BatchSimulator:
+    """Runs the negotiation protocol for many scenarios sharing one config.
+
+    attendance and personalities are (num_scenarios, num_classrooms) arrays;
+    personalities hold indices into PERSONALITIES (strings are accepted too).
+    """
+    def __init__(self, cfg, attendance, personalities, stubborn=None, reputation=None, utility_threshold=0.1):
+        protocol = cfg.get("negotiation_protocol", "pairwise")
+        if protocol != "pairwise":
+            raise ValueError(f"BatchSimulator only runs the pairwise protocol, not {protocol!r}")
+        if batch_span(cfg) != 1:
+            raise ValueError(f"BatchSimulator needs one tick per batch, time_resolution_s={cfg['time_resolution_s']} "
+                             f"gives {batch_span(cfg)}")
+        if cfg.get("central_fallback"):
+            raise ValueError("BatchSimulator does not run the central_fallback scheduler")
+        self.cfg = cfg
+        self.per_batch = cfg["bottleneck"]["capacity_per_minute"] * cfg["bottleneck"]["batch_duration_min"]
+        self.attendance = np.asarray(attendance, dtype=np.int64)
+        self.N, self.A = self.attendance.shape
+        personalities = np.asarray(personalities)
+        if personalities.dtype.kind in 'US':
+            personalities = np.vectorize(PERSONALITIES.index)(personalities)
+        self.personality = personalities.astype(np.int8).reshape(self.N, self.A)
+        self.stubborn = np.zeros((self.N, self.A), bool) if stubborn is None else np.broadcast_to(stubborn, (self.N, self.A)).copy()
+        self.reputation = np.ones((self.N, self.A)) if reputation is None else np.array(reputation, dtype=float).reshape(self.N, self.A)
+        self.utility_threshold = np.broadcast_to(np.asarray(utility_threshold, dtype=float), (self.N, self.A)).copy()
+
+        # offset universe; fulfilment can land outside time_offsets, new columns are appended on demand
+        self.offsets: List[int] = []
+        self.col: Dict[int, int] = {}
+        self._lut_base, self._lut = 0, np.full(0, -1, dtype=np.int64)  # offset - base -> column
+        self.counts = np.zeros((self.N, self.A, 0), dtype=np.int64)
+        self.rank = np.full((self.N, self.A, 0), -1, dtype=np.int64)  # insertion order, -1 = no slot
+        self.loads = np.zeros((self.N, 0), dtype=np.int64)
+        self._tick = 0
+        # the window in cfg order, which is also the rank order ties go by (see OffsetIndex)
+        self._window = [int(o) for o in cfg["time_offsets"]]
+        self._start_col = self._columns([0])[0]
+        self._offset_cols = self._columns(self._window)
+        self._preferred = preferred_offsets(self._window)
+        self._pref_cols = {p: self._columns(o) for p, o in self._preferred.items()}
+
+        # commitments due next episode (the scalar loop only ever fulfils those created last episode)
+        self.pending = self._empty_commitments()
+        self.episode = 0
+        self.commitments_created = np.zeros(self.N, dtype=np.int64)
+        self.commitments_fulfilled = np.zeros(self.N, dtype=np.int64)
+        self.commitments_missed = np.zeros(self.N, dtype=np.int64)
+        self.violations = np.zeros(self.N, dtype=np.int64)
+        self.rounds_used: List[np.ndarray] = []
+        self.peak_load: List[np.ndarray] = []
+
+    # ---------- state helpers ----------
+
+    def _columns(self, offsets) -> np.ndarray:
+        new = [o for o in dict.fromkeys(int(o) for o in offsets) if o not in self.col]
+        if new:
+            for o in new:
+                self.col[o] = len(self.offsets)
+                self.offsets.append(o)
+            lo, hi = min(self.offsets), max(self.offsets)
+            self._lut_base, self._lut = lo, np.full(hi - lo + 1, -1, dtype=np.int64)
+            self._lut[np.array(self.offsets) - lo] = np.arange(len(self.offsets))
+            self._offset_values = np.array(self.offsets, dtype=np.int64)
+            k = len(new)
+            self.counts = np.concatenate([self.counts, np.zeros((self.N, self.A, k), np.int64)], axis=2)
+            self.rank = np.concatenate([self.rank, np.full((self.N, self.A, k), -1, np.int64)], axis=2)
+            self.loads = np.concatenate([self.loads, np.zeros((self.N, k), np.int64)], axis=1)
+        return np.array([self.col[int(o)] for o in offsets], dtype=np.int64)
+
+    def _col_of(self, offsets: np.ndarray) -> np.ndarray:
+        idx = offsets - self._lut_base
+        inside = (idx >= 0) & (idx < self._lut.size)
+        cols = np.where(inside, self._lut[np.where(inside, idx, 0)], -1)
+        if (cols < 0).any():
+            self._columns(np.unique(offsets[cols < 0]).tolist())
+            return self._col_of(offsets)
+        return cols
+
+    def _first_col(self, rows, agents):
+        r = self.rank[rows, agents]
+        return np.where(r >= 0, r, _ABSENT).argmin(axis=1)
+
+    def _slot_map_order(self, congested: np.ndarray) -> np.ndarray:
+        """SlotLedger.congested_offsets() per scenario: congested columns in slot-map order, -1 padded.
+
+        An offset's place is set by the first classroom with a slot there, even
+        an empty one, then by when it entered that classroom's schedule.
+        """
+        first = (self.rank >= 0).argmax(axis=1)
+        entered = np.take_along_axis(self.rank, first[:, None, :], axis=1)[:, 0, :]
+        key = np.where(congested, first * (self._tick + 1) + entered, _ABSENT)
+        order = np.argsort(key, axis=1, kind='stable')[:, :int(congested.sum(axis=1).max())]
+        return np.where(np.take_along_axis(key, order, axis=1) != _ABSENT, order, -1)
+
+    def _move(self, rows, agents, src, dst, amount):
+        """_move_students for one agent in each of `rows` (src=None adds students)."""
+        if src is not None:
+            left = self.counts[rows, agents, src] - amount
+            self.counts[rows, agents, src] = left
+            self.rank[rows, agents, src] = np.where(left <= 0, -1, self.rank[rows, agents, src])
+            self.loads[rows, src] -= amount
+        self._tick += 1
+        r = self.rank[rows, agents, dst]
+        self.rank[rows, agents, dst] = np.where(r >= 0, r, self._tick)
+        self.counts[rows, agents, dst] += amount
+        self.loads[rows, dst] += amount
+
+    def _empty_commitments(self, capacity: int = 8):
+        return {"proposer": np.zeros((self.N, capacity), np.int64), "acceptor": np.zeros((self.N, capacity), np.int64),
+                "shift": np.zeros((self.N, capacity), np.int64), "moved": np.zeros((self.N, capacity), np.int64),
+                "missed": np.zeros((self.N, capacity), np.int64), "fulfilled": np.zeros((self.N, capacity), bool),
+                "n": np.zeros(self.N, np.int64)}
+
+    def _commit(self, book, rows, proposer, acceptor, shift, moved):
+        idx = book["n"][rows]
+        cap = book["proposer"].shape[1]
+        if idx.size and idx.max() >= cap:
+            for key in ("proposer", "acceptor", "shift", "moved", "missed", "fulfilled"):
+                book[key] = np.concatenate([book[key], np.zeros_like(book[key])], axis=1)
+        book["proposer"][rows, idx] = proposer
+        book["acceptor"][rows, idx] = acceptor
+        book["shift"][rows, idx] = shift
+        book["moved"][rows, idx] = moved
+        book["n"][rows] += 1
+        self.commitments_created[rows] += 1
+
+    # ---------- protocol steps ----------
+
+    def broadcast(self):
+        c0 = self._start_col
+        self.counts[:] = 0
+        self.rank[:] = -1
+        self.counts[:, :, c0] = self.attendance
+        self.rank[:, :, c0] = 0
+        self.loads[:] = 0
+        self.loads[:, c0] = self.attendance.sum(axis=1)
+
+    def _reduce_load(self, rows, agents, amount, forbidden):
+        """reduce_load_for_fulfillment; returns the rows that managed to move students."""
+        ok = ~self.stubborn[rows, agents]
+        rows, agents, amount, forbidden = rows[ok], agents[ok], amount[ok], forbidden[ok]
+        if rows.size == 0:
+            return rows
+        rank = self.rank[rows, agents]
+        keyed = np.where(rank >= 0, rank, _ABSENT)
+        width = int((rank >= 0).sum(axis=1).max())
+        src = np.argsort(keyed, axis=1, kind='stable')[:, :width]
+        present = np.take_along_axis(keyed, src, axis=1) != _ABSENT
+        cnt = np.take_along_axis(self.counts[rows, agents], src, axis=1)
+        take = np.minimum(cnt, amount[:, None])
+        tgt = self._offset_cols
+        tgt_load = self.loads[rows[:, None], tgt]
+        feasible = ((present & (src != forbidden[:, None]) & (cnt > 0))[:, :, None]
+                    & (tgt[None, None, :] != forbidden[:, None, None])
+                    & (tgt[None, None, :] != src[:, :, None])
+                    & (tgt_load[:, None, :] + take[:, :, None] <= self.per_batch))
+        flat = feasible.reshape(rows.size, -1)
+        moved = flat.any(axis=1)
+        pick = flat.argmax(axis=1)[moved]
+        e, t = pick // len(tgt), pick % len(tgt)
+        rows, agents = rows[moved], agents[moved]
+        self._move(rows, agents, src[moved, e], tgt[t], take[moved, e])
+        self._drop_empty(rows, agents)
+        return rows
+
+    def _drop_empty(self, rows, agents, cols=slice(None)):
+        """_drop_if_empty: slots left holding no students leave the schedule."""
+        empty = self.counts[rows, agents, cols] == 0
+        self.rank[rows, agents, cols] = np.where(empty, -1, self.rank[rows, agents, cols])
+
+    def _miss(self, book, rows, m, proposers, threshold):
+        book["missed"][rows, m] += 1
+        self.commitments_missed[rows] += 1
+        hit = book["missed"][rows, m] >= threshold
+        self.reputation[rows[hit], proposers[hit]] *= 0.8
+        self.violations[rows[hit]] += 1
+
+    def fulfill(self, episode: int):
+        book, threshold = self.pending, self.cfg["violation_threshold"]
+        n = book["n"]
+        if not n.any():
+            return
+        # scalar order: classrooms in order, each walking the ledger in creation order
+        cap = book["proposer"].shape[1]
+        key = np.where(np.arange(cap)[None, :] < n[:, None], book["proposer"] * cap + np.arange(cap)[None, :], _ABSENT)
+        order = np.argsort(key, axis=1, kind='stable')
+        for t in range(int(n.max())):
+            rows = np.flatnonzero(n > t)
+            m = order[rows, t]
+            prop, acc = book["proposer"][rows, m], book["acceptor"][rows, m]
+            has_slots = (self.rank[rows, acc] >= 0).any(axis=1)
+            rows, m, prop, acc = rows[has_slots], m[has_slots], prop[has_slots], acc[has_slots]
+            moved = book["moved"][rows, m]
+            target = self._offset_values[self._first_col(rows, acc)] + np.abs(book["shift"][rows, m])
+            tcol = self._col_of(target)
+            to_give = np.minimum(moved, np.maximum(0, self.per_batch - self.loads[rows, tcol]))
+
+            blocked = to_give <= 0
+            if blocked.any():
+                b = np.flatnonzero(blocked)
+                freed = np.isin(rows[b], self._reduce_load(rows[b], prop[b], moved[b], tcol[b]))
+                failed = b[~freed]
+                self._miss(book, rows[failed], m[failed], prop[failed], threshold)
+                ok = b[freed]
+                to_give[ok] = np.minimum(moved[ok], np.maximum(0, self.per_batch - self.loads[rows[ok], tcol[ok]]))
+
+            g = np.flatnonzero(to_give > 0)
+            if g.size:
+                freed = np.isin(rows[g], self._reduce_load(rows[g], prop[g], to_give[g], tcol[g]))
+                ok, failed = g[freed], g[~freed]
+                self._move(rows[ok], acc[ok], None, tcol[ok], to_give[ok])
+                book["fulfilled"][rows[ok], m[ok]] = True
+                self.commitments_fulfilled[rows[ok]] += 1
+                self._miss(book, rows[failed], m[failed], prop[failed], threshold)
+
+    def negotiate(self, episode: int, book) -> np.ndarray:
+        """Runs the negotiation rounds; returns the number of rounds each scenario used."""
+        P = self.per_batch
+        offsets = np.array(self._window, dtype=np.int64)
+        offset_cols = self._offset_cols
+        rounds = np.zeros(self.N, dtype=np.int64)
+        for _ in range(self.cfg["max_negotiation_rounds"]):
+            congested = self.loads > P
+            active = congested.any(axis=1)
+            if not active.any():
+                break
+            rounds[active] += 1
+            snapshot = self.loads.copy()
+            order = self._slot_map_order(congested)
+            # step k negotiates each scenario's k-th congested offset
+            for step in range(order.shape[1]):
+                rows = np.flatnonzero(order[:, step] >= 0)
+                col = order[rows, step]
+                # every classroom with a slot there counts, even an empty one
+                present = self.rank[rows, :, col] >= 0
+                two = present.sum(axis=1) >= 2
+                rows, col, present = rows[two], col[two], present[two]
+                if rows.size == 0:
+                    continue
+                # top two contributors; argmax keeps the lower classroom index on ties, like the stable sort
+                key = np.where(present, self.counts[rows, :, col], -1)
+                a1 = key.argmax(axis=1)
+                key[np.arange(rows.size), a1] = -2
+                a2 = key.argmax(axis=1)
+                trusted = self.reputation[rows, a2] >= 0.5
+                rows, col, a1, a2 = rows[trusted], col[trusted], a1[trusted], a2[trusted]
+                off = self._offset_values[col]
+
+                # propose_shift: least-loaded offset (round-start view) other than the congested one
+                cand = np.where(offsets[None, :] == off[:, None], np.inf, snapshot[rows[:, None], offset_cols])
+                best = offsets[cand.argmin(axis=1)]
+                amount = np.minimum(self.counts[rows, a1, col], P)
+                valid = np.isfinite(cand.min(axis=1)) & (amount > 0)
+                rows, col, off, a1, a2 = rows[valid], col[valid], off[valid], a1[valid], a2[valid]
+                best, amount = best[valid], amount[valid]
+                if rows.size == 0:
+                    continue
+                shift = best - off
+                p1, p2 = self.personality[rows, a1], self.personality[rows, a2]
+                accepted = (p2 == FLEXIBLE) | (_utility(p2, shift, False) >= self.utility_threshold[rows, a2])
+
+                acc = np.flatnonzero(accepted)
+                if acc.size:
+                    r, a, src = rows[acc], a2[acc], col[acc]
+                    give = np.minimum(self.counts[r, a, src], amount[acc])
+                    mv = give > 0
+                    self._move(r[mv], a[mv], src[mv], self._col_of(best[acc][mv]), give[mv])
+                    self._drop_empty(r[~mv], a[~mv], src[~mv])
+                    self._commit(book, r, a1[acc], a, shift[acc], amount[acc])
+
+                rej = np.flatnonzero(~accepted)
+                if rej.size == 0:
+                    continue
+                # formulate_counter_offer by the rejecting agent
+                r, b1, b2, pers, old = rows[rej], a1[rej], a2[rej], p2[rej], off[rej]
+                alt = np.empty(r.size, dtype=np.int64)
+                has_alt = np.zeros(r.size, bool)
+                for p, cols in self._pref_cols.items():
+                    sel = np.flatnonzero(pers == p)
+                    if sel.size == 0:
+                        continue
+                    pref = np.array(self._preferred[p])
+                    l = np.where(pref[None, :] == old[sel][:, None], np.inf, snapshot[r[sel][:, None], cols])
+                    alt[sel] = pref[l.argmin(axis=1)]
+                    has_alt[sel] = np.isfinite(l.min(axis=1))
+                cur_col = self._first_col(r, b2)
+                current = self._offset_values[cur_col]
+                amount2 = np.minimum(self.attendance[r, b2], P)
+                hyp = alt - current
+                counter = has_alt & (_utility(pers, hyp, True) >= self.utility_threshold[r, b2])
+                p1r = p1[rej]
+                taken = counter & ((p1r == FLEXIBLE) | (_utility(p1r, hyp, False) >= self.utility_threshold[r, b1]))
+                c = np.flatnonzero(taken)
+                if c.size:
+                    r, b1, b2 = r[c], b1[c], b2[c]
+                    give = np.minimum(self.counts[r, b1, cur_col[c]], amount2[c])
+                    mv = give > 0
+                    self._move(r[mv], b1[mv], cur_col[c][mv], self._col_of(alt[c][mv]), give[mv])
+                    self._drop_empty(r[~mv], b1[~mv], cur_col[c][~mv])
+                    self._commit(book, r, b2, b1, hyp[c], amount2[c])
+        return rounds
+
+    def run_episode(self, episode: int, attendance=None):
+        """One episode in every scenario; `attendance` (num_scenarios, num_classrooms) replaces the headcounts."""
+        if attendance is not None:
+            self.attendance = np.asarray(attendance, dtype=np.int64).reshape(self.N, self.A)
+        self.broadcast()
+        self.fulfill(episode)
+        book = self._empty_commitments(max(8, self.cfg["max_negotiation_rounds"] * len(self._window)))
+        self.rounds_used.append(self.negotiate(episode, book))
+        self.peak_load.append(self.loads.max(axis=1))
+        self.pending = book
+        self.episode = episode
+
+    def run(self, num_episodes: int):
+        for ep in range(self.episode + 1, self.episode + num_episodes + 1):
+            self.run_episode(ep)
+        return self
+
+    # ---------- per-scenario views ----------
+
+    def schedules(self, i: int) -> List[List[tuple]]:
+        """planned_slots of every classroom in scenario i, in the scalar slot order."""
+        out = []
+        for a in range(self.A):
+            cols = [j for j in np.argsort(self.rank[i, a], kind='stable') if self.rank[i, a, j] >= 0]
+            out.append([(self.offsets[j], int(self.counts[i, a, j])) for j in cols])
+        return out
+
+    def slot_map(self, i: int) -> Dict[int, int]:
+        return {self.offsets[j]: int(self.loads[i, j]) for j in sorted(np.flatnonzero(self.loads[i]), key=lambda j: self.offsets[j])}
+
+    def congested(self) -> np.ndarray:
+        """Scenarios still above per-batch capacity at the end of the last episode."""
+        return (self.loads > self.per_batch).any(axis=1)
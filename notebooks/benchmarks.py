@@ -0,0 +1,298 @@
+"""Benchmarks for the CEFO engine across its scale dimensions.
+
+Phases timed: compute_slot_map, propose_shift, apply_offer,
+fulfill_due_commitments and whole episodes, under the pairwise protocol
+(episode), the N-way one (episode_n_way) and the sealed-bid auction
+(episode_auction). Each is swept one dimension at a
+time around a base scenario (60 classrooms, 7 offsets, 5 rounds, 5 episodes)
+over the number of classrooms, the size of time_offsets,
+max_negotiation_rounds and the horizon.
+
+Every result records the median wall time per call, the memory still allocated
+after one call (bytes and blocks) and its peak traced memory (tracemalloc).
+Episode results also record how well the schedules came out: rounds used,
+how often congestion cleared, and the final weighted displacement and overflow
+(central_scheduler.schedule_cost).
+
+    python benchmarks.py --save baseline.json           # record a baseline
+    python benchmarks.py --compare baseline.json        # exit 1 on regressions
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from CEFO import CommitmentLedger, build_agents, compute_slot_map, run_episode
+from central_scheduler import report_cost, schedule_cost
+
+BASE = {"classrooms": 60, "offsets": 7, "rounds": 5, "horizon": 5}
+AXES = {
+    "classrooms": [6, 60, 600, 2000, 10000],
+    "offsets": [7, 15, 31, 61],
+    "rounds": [5, 10, 20],
+    "horizon": [5, 20, 50],
+}
+# phases that do not depend on rounds/horizon only sweep the first two axes
+PHASE_AXES = {
+    "compute_slot_map": ("classrooms", "offsets"),
+    "propose_shift": ("classrooms", "offsets"),
+    "apply_offer": ("classrooms", "offsets"),
+    "fulfill_due_commitments": ("classrooms", "offsets"),
+    "episode": ("classrooms", "offsets", "rounds", "horizon"),
+    "episode_n_way": ("classrooms", "offsets", "rounds", "horizon"),
+    "episode_auction": ("classrooms", "offsets", "rounds", "horizon"),
+}
+# episode phases -> cfg["negotiation_protocol"]
+EPISODE_PROTOCOLS = {"episode": "pairwise", "episode_n_way": "n_way", "episode_auction": "auction"}
+
+
+@dataclass
+class BenchResult:
+    phase: str
+    params: Dict[str, int]
+    repeats: int
+    wall_s: float            # median seconds per call
+    min_s: float
+    alloc_bytes: int         # still allocated after one call
+    alloc_blocks: int
+    peak_bytes: int          # tracemalloc peak during one call
+    extra: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        return self.phase + "[" + ",".join(f"{k}={v}" for k, v in sorted(self.params.items())) + "]"
+
+
+def scaled_config(classrooms: int, offsets: int, rounds: int, seed: int = 0) -> Dict:
+    """A campus like the notebook's, scaled so capacity stays ~1.9x the total over the offset window."""
+    rng = random.Random(seed)
+    attendance = [rng.randint(20, 80) for _ in range(classrooms)]
+    time_offsets = [0] + [sign * 2 * k for k in range(1, offsets // 2 + 1) for sign in (-1, 1)]
+    per_batch = max(1, math.ceil(sum(attendance) * 1.93 / len(time_offsets)))
+    return {
+        "episode_base_name": "bench",
+        "num_classrooms": classrooms,
+        "attendance": attendance,
+        "bottleneck": {"capacity_per_minute": math.ceil(per_batch / 2), "batch_duration_min": 2},
+        "time_offsets": time_offsets,
+        "max_negotiation_rounds": rounds,
+        "violation_threshold": 1,
+        "stubborn_classrooms": ["C4"],
+        "compact_schedules": False,
+        "random_seed": seed,
+    }
+
+
+class _Run:
+    """Freshly built agents for one scenario (no event sinks, so nothing is formatted)."""
+    def __init__(self, cfg: Dict, seed: int = 0):
+        self.cfg = cfg
+        self.B, self.ledger, self.classrooms, self.agents_by_id = build_agents(cfg, rng=random.Random(seed))
+        self.commitments = CommitmentLedger()
+        self.ep = 0
+
+    def broadcast(self):
+        msg = self.B.broadcast_capacity(self.cfg["attendance"], "bench")
+        for c in self.classrooms:
+            c.on_capacity_broadcast(msg)
+
+    def episode(self):
+        self.ep += 1
+        return run_episode(self.ep, self.cfg, self.B, self.classrooms, self.agents_by_id,
+                           self.commitments, self.ledger)
+
+    def busiest_pair(self):
+        off = max(self.ledger.loads, key=self.ledger.loads.get)
+        return off, self.ledger.top_contributors(off, 2)
+
+
+def measure(phase: str, params: Dict, setup: Callable, run: Callable, repeats: int) -> BenchResult:
+    """Times run(setup()) `repeats` times (setup untimed), then traces memory over one more call."""
+    times = []
+    for _ in range(repeats):
+        state = setup()
+        t0 = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - t0)
+    state = setup()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    return BenchResult(
+        phase=phase, params=dict(params), repeats=repeats,
+        wall_s=statistics.median(times), min_s=min(times),
+        alloc_bytes=sum(d.size_diff for d in diff), alloc_blocks=sum(d.count_diff for d in diff),
+        peak_bytes=peak)
+
+
+def _repeats(classrooms: int, budget: int) -> int:
+    return max(3, min(budget, 200_000 // max(classrooms, 1)))
+
+
+def bench_phase(phase: str, p: Dict, budget: int = 50) -> BenchResult:
+    cfg = scaled_config(p["classrooms"], p["offsets"], p["rounds"])
+    repeats = _repeats(p["classrooms"], budget)
+
+    if phase == "compute_slot_map":
+        def setup():
+            run = _Run(cfg)
+            run.episode()  # spread students over several offsets
+            return run
+        return measure(phase, p, setup, lambda r: compute_slot_map(r.classrooms), repeats)
+
+    if phase == "propose_shift":
+        def setup():
+            run = _Run(cfg)
+            run.broadcast()
+            off, (a1, a2) = run.busiest_pair()
+            return run, off, a1, a2, run.ledger.snapshot()
+        return measure(phase, p, setup, lambda s: s[2].propose_shift(s[3], s[1], 1, s[4]), repeats)
+
+    if phase == "apply_offer":
+        def setup():
+            run = _Run(cfg)
+            run.broadcast()
+            off, (a1, a2) = run.busiest_pair()
+            return a2, a1.propose_shift(a2, off, 1, run.ledger.snapshot())
+        return measure(phase, p, setup, lambda s: s[0].apply_offer(s[1]), repeats)
+
+    if phase == "fulfill_due_commitments":
+        def setup():
+            run = _Run(cfg)
+            run.episode()  # creates the commitments due next episode
+            run.ep += 1
+            run.broadcast()
+            return run
+
+        def fulfill(run):
+            for c in run.classrooms:
+                c.fulfill_due_commitments(run.commitments, current_episode=run.ep, slot_map=run.ledger,
+                                          B_agent=run.B, agents_by_id=run.agents_by_id,
+                                          violation_threshold=cfg["violation_threshold"])
+        return measure(phase, p, setup, fulfill, max(3, repeats // 5))
+
+    if phase in EPISODE_PROTOCOLS:
+        cfg["negotiation_protocol"] = EPISODE_PROTOCOLS[phase]
+        summaries, final = [], []
+
+        def horizon(run):
+            summaries[:] = [run.episode() for _ in range(p["horizon"])]
+            final[:] = [run]
+        result = measure(phase, p, lambda: _Run(cfg), horizon, max(3, repeats // (5 * p["horizon"])))
+        cost, overflow = schedule_cost(final[0].classrooms, final[0].B.per_batch)
+        result.extra = {
+            "per_episode_s": result.wall_s / p["horizon"],
+            "cleared_fraction": sum(s["cleared"] for s in summaries) / len(summaries),
+            "rounds_per_episode": sum(s["rounds"] for s in summaries) / len(summaries),
+            "displacement_cost": report_cost(cost),
+            "overflow": overflow,
+            "commitments_per_episode": sum(s["commitments_created"] for s in summaries) / len(summaries),
+        }
+        return result
+
+    raise ValueError(f"unknown phase {phase!r}")
+
+
+def scenarios(phases=None, max_classrooms: Optional[int] = None):
+    """(phase, params) pairs: each phase's axes varied one at a time around BASE."""
+    seen = set()
+    for phase in phases or PHASE_AXES:
+        for axis in PHASE_AXES[phase]:
+            for value in AXES[axis]:
+                if axis == "classrooms" and max_classrooms and value > max_classrooms:
+                    continue
+                params = dict(BASE, **{axis: value})
+                if "horizon" not in PHASE_AXES[phase]:
+                    params = {k: params[k] for k in ("classrooms", "offsets", "rounds")}
+                key = (phase, tuple(sorted(params.items())))
+                if key not in seen:
+                    seen.add(key)
+                    yield phase, params
+
+
+def run_benchmarks(phases=None, max_classrooms: Optional[int] = None, budget: int = 50,
+                   log=sys.stderr) -> List[BenchResult]:
+    results = []
+    for phase, params in scenarios(phases, max_classrooms):
+        r = bench_phase(phase, params, budget)
+        if log is not None:
+            print(f"{r.key:70s} {r.wall_s * 1e3:10.3f} ms  peak {r.peak_bytes / 1024:9.1f} KiB", file=log)
+        results.append(r)
+    return results
+
+
+def save_baseline(results: List[BenchResult], path: str):
+    doc = {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "numpy": np.__version__},
+        "results": [dict(asdict(r), key=r.key) for r in results],
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2)
+
+
+def load_baseline(path: str) -> Dict[str, Dict]:
+    with open(path) as f:
+        return {r["key"]: r for r in json.load(f)["results"]}
+
+
+def compare(results: List[BenchResult], baseline: Dict[str, Dict], time_tolerance: float = 0.25,
+            memory_tolerance: float = 0.25, min_time_s: float = 50e-6) -> List[str]:
+    """Human-readable regressions: time or peak memory above baseline by more than the tolerance.
+
+    Time is compared on the fastest repeat, the least noisy statistic; timings
+    below `min_time_s` in both runs are too noisy to judge and are skipped.
+    """
+    regressions = []
+    for r in results:
+        base = baseline.get(r.key)
+        if base is None:
+            continue
+        if max(r.min_s, base["min_s"]) >= min_time_s and r.min_s > base["min_s"] * (1 + time_tolerance):
+            regressions.append(f"{r.key}: best {base['min_s'] * 1e3:.3f} -> {r.min_s * 1e3:.3f} ms "
+                               f"({r.min_s / base['min_s']:.2f}x)")
+        if base["peak_bytes"] and r.peak_bytes > base["peak_bytes"] * (1 + memory_tolerance):
+            regressions.append(f"{r.key}: peak {base['peak_bytes']} -> {r.peak_bytes} bytes "
+                               f"({r.peak_bytes / base['peak_bytes']:.2f}x)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--phase", action="append", choices=list(PHASE_AXES), help="limit to these phases")
+    parser.add_argument("--max-classrooms", type=int, default=None, help="skip larger campus sizes")
+    parser.add_argument("--budget", type=int, default=50, help="max repeats per measurement")
+    parser.add_argument("--save", metavar="PATH", help="write results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON file to check against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown / memory growth")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.phase, args.max_classrooms, args.budget)
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        regressions = compare(results, load_baseline(args.compare), args.tolerance, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print(f"no regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
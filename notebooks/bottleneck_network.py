@@ -0,0 +1,285 @@
+"""Campus-scale CEFO: many exits (BottleneckAgents) and sparse classroom -> exit reachability.
+
+Config additions on top of the usual CEFO config:
+
+    "exits":        [{"id": "E1", "capacity_per_minute": 40, "batch_duration_min": 2}, ...]
+    "reachability": {"C1": ["E1", "E3"], ...}   # first exit listed is the classroom's default
+
+A classroom's schedule is a route map {(exit, offset): students}. Load is kept
+per exit in a SlotLedger, so the congested (exit, offset) pairs, the load at a
+pair and the top contributors at a pair are all maintained by deltas. Every
+step only touches the exits a classroom can reach, never the whole campus.
+
+Protocol per episode, mirroring run_episode:
+  1. broadcast: every classroom starts on its default exit at offset 0;
+  2. fulfilment: a proposer repays a due commitment by moving `moved_students`
+     of its own students, each to the least-loaded reachable (exit, offset) pair
+     that still has room. Only a complete move fulfils it; the acceptor is then
+     credited as in fulfill_due_commitments, at its first route shifted by
+     |shift_min| if there is room. A partial or failed move is a miss, with the
+     usual violation penalty;
+  3. negotiation: for each congested pair the two biggest contributors negotiate.
+     The proposer asks the other classroom to move, as many students as fit, to
+     the least-loaded other exit it reaches at the same time; only if none has
+     room, to its least-loaded reachable pair, which may be another exit, another
+     offset or both. Rerouting to a different exit at the same time costs the
+     classroom nothing and is always acceptable. Rejected offers get the usual
+     counter-offer path.
+"""
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from CEFO import BottleneckAgent, ClassroomAgent, Commitment, CommitmentLedger, Offer, SlotLedger
+
+Route = Tuple[str, int]  # (exit id, offset)
+
+
+class NetworkLedger:
+    """One SlotLedger per exit plus the campus-wide set of congested (exit, offset) pairs."""
+    def __init__(self, exits: Dict[str, BottleneckAgent]):
+        self.exits = {eid: SlotLedger(b.per_batch) for eid, b in exits.items()}
+        self.congested: set = set()
+
+    def add(self, route: Route, delta: int, agent=None):
+        exit_id, offset = route
+        ledger = self.exits[exit_id]
+        ledger.add(offset, delta, agent)
+        if offset in ledger.congested:
+            self.congested.add(route)
+        else:
+            self.congested.discard(route)
+
+    def load(self, route: Route) -> int:
+        return self.exits[route[0]].get(route[1], 0)
+
+    def spare(self, route: Route) -> int:
+        ledger = self.exits[route[0]]
+        return ledger.per_batch - ledger.get(route[1], 0)
+
+    def congested_routes(self) -> List[Route]:
+        return sorted(self.congested)
+
+    def top_contributors(self, route: Route, k: int = 2) -> list:
+        return self.exits[route[0]].top_contributors(route[1], k)
+
+    def peak_load(self) -> int:
+        return max((max(l.loads.values(), default=0) for l in self.exits.values()), default=0)
+
+
+class NetworkClassroom(ClassroomAgent):
+    """ClassroomAgent whose students are split over (exit, offset) routes."""
+    def __init__(self, id_, attendance, cfg, exits: Tuple[str, ...], network: NetworkLedger, rng=None):
+        super().__init__(id_, attendance, cfg, rng=rng)
+        self.exits = tuple(exits)
+        self.network = network
+        self.routes: Dict[Route, int] = {}
+        for eid in self.exits:
+            network.exits[eid].register(self)
+
+    @property
+    def home(self) -> Route:
+        return (self.exits[0], 0)
+
+    def on_capacity_broadcast(self, msg, index=0):
+        for route, cnt in self.routes.items():
+            self.network.add(route, -cnt, self)
+        self.routes = {self.home: self.attendance}
+        self.network.add(self.home, self.attendance, self)
+
+    def students_on(self, route: Route) -> int:
+        return self.routes.get(route, 0)
+
+    def move_route(self, src: Route, dst: Route, count: int):
+        left = self.routes[src] - count
+        if left > 0:
+            self.routes[src] = left
+        else:
+            del self.routes[src]
+        self.routes[dst] = self.routes.get(dst, 0) + count
+        self.network.add(src, -count, self)
+        self.network.add(dst, count, self)
+
+    def best_route(self, avoid: Route, offsets: Optional[Iterable[int]] = None, room_for: int = 0,
+                   exclude: Iterable[Route] = ()) -> Optional[Route]:
+        """Least-loaded reachable route other than `avoid` (and `exclude`); with room_for, only routes that fit it."""
+        best, best_load = None, float('inf')
+        for eid in self.exits:
+            ledger = self.network.exits[eid]
+            for off in (offsets if offsets is not None else self.cfg["time_offsets"]):
+                route = (eid, off)
+                if route == avoid or route in exclude:
+                    continue
+                load = ledger.get(off, 0)
+                if room_for and load + room_for > ledger.per_batch:
+                    continue
+                if load < best_load:
+                    best, best_load = route, load
+        return best
+
+    def evaluate_route(self, offer: Offer, new_exit: str, old_exit: str) -> bool:
+        if offer.shift_min == 0 and new_exit != old_exit:
+            return True  # same time, different stairwell
+        return self.evaluate_offer(offer)
+
+    def add_students(self, route: Route, count: int):
+        self.routes[route] = self.routes.get(route, 0) + count
+        self.network.add(route, count, self)
+
+    def reroute_for_fulfillment(self, amount: int, forbidden: Optional[Route] = None) -> int:
+        """Network counterpart of reduce_load_for_fulfillment: moves up to `amount` students, spread
+        over the least-loaded routes with room other than `forbidden`. Returns how many moved."""
+        if self.is_stubborn:
+            return 0
+        left = amount
+        for src in list(self.routes):
+            while left and self.routes.get(src):
+                dst = self.best_route(avoid=src, room_for=1, exclude=(forbidden,))
+                if dst is None:
+                    return amount - left
+                take = min(self.routes[src], left, self.network.spare(dst))
+                self.move_route(src, dst, take)
+                left -= take
+            if not left:
+                break
+        return amount - left
+
+
+class BottleneckNetwork:
+    """Exits, shared network ledger and classrooms for one campus-scale run."""
+    def __init__(self, cfg, rng=None):
+        self.cfg = cfg
+        self.exits = {e["id"]: BottleneckAgent({"bottleneck": e}) for e in cfg["exits"]}
+        self.ledger = NetworkLedger(self.exits)
+        reach = cfg["reachability"]
+        self.classrooms = [NetworkClassroom(f"C{i+1}", att, cfg, reach[f"C{i+1}"], self.ledger, rng=rng)
+                           for i, att in enumerate(cfg["attendance"])]
+        self.agents_by_id = {c.id: c for c in self.classrooms}
+        for c in self.classrooms:
+            c.is_stubborn = c.id in cfg.get("stubborn_classrooms", [])
+        self.commitments = CommitmentLedger()
+
+    def _commit(self, offer: Offer, ep: int):
+        self.commitments.append(Commitment.from_offer(offer, ep))
+
+    def fulfill(self, ep: int):
+        threshold = self.cfg["violation_threshold"]
+        for c in self.classrooms:
+            for com in self.commitments.due(c.id, ep):
+                acceptor = self.agents_by_id[com.acceptor]
+                if not acceptor.routes:
+                    continue
+                exit_id, off = next(iter(acceptor.routes))
+                target = (exit_id, off + abs(com.shift_min))
+                # a counter-offer's commitment is sized by the other side's students; repay what c has
+                owed = min(com.moved_students, sum(c.routes.values()))
+                moved = c.reroute_for_fulfillment(owed, forbidden=target)
+                if moved < owed:
+                    violated = c._note_miss(com, acceptor, threshold)
+                    c.events.emit("fulfill_partial" if moved else "fulfill_failed", agent=c.id,
+                                  commitment=com.commitment_id, times_missed=com.times_missed)
+                    if violated:
+                        c.events.emit("violation", agent=c.id, commitment=com.commitment_id, partial=moved > 0)
+                    continue
+                credit = min(moved, max(0, self.ledger.spare(target)))
+                if credit:
+                    acceptor.add_students(target, credit)
+                com.fulfilled = True
+                com.fulfilled_episode = ep
+                c.events.emit("fulfilled", agent=c.id, commitment=com.commitment_id, students=credit,
+                              acceptor=acceptor.id, slot=target)
+        self.commitments.close_episode(ep)
+
+    def negotiate_route(self, route: Route, ep: int) -> bool:
+        """One pairwise negotiation at a congested route; True if students moved."""
+        top = self.ledger.top_contributors(route, 2)
+        if len(top) < 2:
+            return False
+        a1, a2 = top
+        if a2.reputation < 0.5:
+            return False
+        exit_id, off = route
+        per_batch = self.ledger.exits[exit_id].per_batch
+        amount = min(a1.students_on(route), per_batch)
+        # another exit at the same time costs a2 nothing: ask for as many as fit there before shifting in time
+        target = a2.best_route(avoid=route, offsets=(off,), room_for=1)
+        if target is not None:
+            amount = min(amount, self.ledger.spare(target))
+        else:
+            target = a2.best_route(avoid=route)
+        if target is None:
+            return False
+        offer = Offer(offer_id=None, proposer=a1.id, acceptor=a2.id,
+                      old_offset=off, shift_min=target[1] - off, moved_students=amount, episode_created=ep)
+        if a2.evaluate_route(offer, target[0], exit_id):
+            moved = min(a2.students_on(route), amount)
+            if moved > 0:
+                a2.move_route(route, target, moved)
+            self._commit(offer, ep)
+            return moved > 0
+        # counter-offer: a2 asks a1 to move instead, towards a2's preferred side
+        if a2.personality == 'flexible':
+            return False
+        preferred = [o for o in self.cfg["time_offsets"] if (o < off if a2.personality == 'prefers_early' else o > off)]
+        alt = a1.best_route(avoid=route, offsets=preferred or None)
+        if alt is None:
+            return False
+        counter = Offer(offer_id=None, proposer=a2.id, acceptor=a1.id,
+                        old_offset=off, shift_min=alt[1] - off, moved_students=min(a1.students_on(route), per_batch),
+                        episode_created=ep, counter_to_offer_id=offer.offer_id)
+        if not a1.evaluate_route(counter, alt[0], exit_id):
+            return False
+        if counter.moved_students > 0:
+            a1.move_route(route, alt, counter.moved_students)
+        self._commit(counter, ep)
+        return counter.moved_students > 0
+
+    def run_episode(self, ep: int) -> Dict:
+        msg = {"cap_per_min": None, "total_estimate": sum(self.cfg["attendance"]), "episode_tag": ep}
+        for c in self.classrooms:
+            c.on_capacity_broadcast(msg)
+        fulfilled_before, created_before = self.commitments.fulfilled, self.commitments.created
+        self.fulfill(ep)
+        rounds = 0
+        for _ in range(self.cfg["max_negotiation_rounds"]):
+            congested = self.ledger.congested_routes()
+            if not congested:
+                break
+            rounds += 1
+            for route in congested:
+                if route in self.ledger.congested:
+                    self.negotiate_route(route, ep)
+        return {
+            "episode": ep,
+            "rounds": rounds,
+            "cleared": not self.ledger.congested,
+            "congested_routes": len(self.ledger.congested),
+            "peak_load": self.ledger.peak_load(),
+            "commitments_created": self.commitments.created - created_before,
+            "commitments_fulfilled": self.commitments.fulfilled - fulfilled_before,
+        }
+
+    def exit_loads(self) -> Dict[str, Dict[int, int]]:
+        return {eid: l.snapshot() for eid, l in self.ledger.exits.items()}
+
+
+def random_campus(num_classrooms: int, num_exits: int, exits_per_classroom: int = 3,
+                  capacity_per_minute: int = 40, attendance_range=(5, 25), seed: int = 0, base_cfg=None) -> Dict:
+    """Synthetic campus config: exits in a row, each classroom reaching a few neighbouring exits."""
+    rng = random.Random(seed)
+    cfg = dict(base_cfg or {})
+    cfg.setdefault("time_offsets", [0, -2, 2, -4, 4, -6, 6])
+    cfg.setdefault("max_negotiation_rounds", 5)
+    cfg.setdefault("violation_threshold", 1)
+    cfg["bottleneck"] = {"capacity_per_minute": capacity_per_minute, "batch_duration_min": 2}
+    cfg["exits"] = [{"id": f"E{j+1}", "capacity_per_minute": capacity_per_minute, "batch_duration_min": 2}
+                    for j in range(num_exits)]
+    cfg["attendance"] = [rng.randint(*attendance_range) for _ in range(num_classrooms)]
+    cfg["num_classrooms"] = num_classrooms
+    reach = {}
+    for i in range(num_classrooms):
+        home = i * num_exits // num_classrooms
+        near = sorted(range(max(0, home - exits_per_classroom), min(num_exits, home + exits_per_classroom + 1)),
+                      key=lambda j: abs(j - home))
+        reach[f"C{i+1}"] = [f"E{j+1}" for j in near[:exits_per_classroom]]
+    cfg["reachability"] = reach
+    return cfg
@@ -0,0 +1,172 @@
+"""Centralized schedule for one episode, solved exactly as a min-cost flow.
+
+Every classroom's students are assigned to cfg["time_offsets"] so that no offset
+carries more than B.per_batch, minimising personality-weighted displacement.
+A student moved by `o` minutes costs |o| times
+
+    prefers_early:  1 if o < 0, 3 if o > 0
+    prefers_late:   3 if o < 0, 1 if o > 0
+    flexible:       2 either way
+
+(half-minute units; report_cost() converts back). Students that fit nowhere
+stay at offset 0 (the offset nearest it) as overflow, which costs more than any displacement, so the
+solver minimises overflow first. Classrooms that share a personality have
+identical costs, so the flow runs on personality groups x offsets and is then
+split back onto classrooms. It is tiny whatever the campus size.
+
+Uses: a baseline (optimal cost is a lower bound for any negotiated schedule
+with the same overflow), and a fallback for run_episode when negotiation
+leaves congestion (cfg["central_fallback"]).
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+PERSONALITY_WEIGHTS = {
+    "prefers_early": (1, 3),  # (per minute earlier, per minute later)
+    "prefers_late": (3, 1),
+    "flexible": (2, 2),
+}
+
+
+def move_cost(personality: str, offset: int) -> int:
+    early, late = PERSONALITY_WEIGHTS[personality]
+    return -offset * early if offset < 0 else offset * late
+
+
+def report_cost(cost: int) -> float:
+    """Solver cost units (half-minutes) to weighted student-minutes."""
+    return cost / 2
+
+
+@dataclass
+class Assignment:
+    schedules: Dict[str, List[Tuple[int, int]]]   # classroom id -> [(offset, students)]
+    slot_map: Dict[int, int]
+    cost: int                                     # weighted displacement, half-minute units
+    overflow: int                                 # students above capacity (all at the offset nearest 0)
+
+
+def _min_cost_flow(num_nodes: int, arcs: List[list], source: int, sink: int) -> int:
+    """Successive shortest paths (Bellman-Ford) on arcs [u, v, cap, cost]; fills arc flows in place as arc[4]."""
+    graph = [[] for _ in range(num_nodes)]
+    edges = []  # [to, residual cap, cost, reverse edge index]
+    for u, v, cap, cost in arcs:
+        graph[u].append(len(edges)); edges.append([v, cap, cost, len(edges) + 1])
+        graph[v].append(len(edges)); edges.append([u, 0, -cost, len(edges) - 1])
+    total = 0
+    while True:
+        dist = [None] * num_nodes
+        via = [None] * num_nodes
+        dist[source] = 0
+        for _ in range(num_nodes - 1):
+            changed = False
+            for u in range(num_nodes):
+                if dist[u] is None:
+                    continue
+                for e in graph[u]:
+                    v, cap, cost, _ = edges[e]
+                    if cap > 0 and (dist[v] is None or dist[u] + cost < dist[v]):
+                        dist[v], via[v], changed = dist[u] + cost, e, True
+            if not changed:
+                break
+        if dist[sink] is None:
+            break
+        push, v = float("inf"), sink
+        while v != source:
+            e = via[v]
+            push = min(push, edges[e][1])
+            v = edges[edges[e][3]][0]
+        v = sink
+        while v != source:
+            e = via[v]
+            edges[e][1] -= push
+            edges[edges[e][3]][1] += push
+            v = edges[edges[e][3]][0]
+        total += push * dist[sink]
+    for i, arc in enumerate(arcs):
+        arc.append(edges[2 * i + 1][1])  # flow = residual of the reverse edge
+    return total
+
+
+def solve_schedule(classrooms, time_offsets: List[int], per_batch: int) -> Assignment:
+    """Optimal capacity-respecting assignment of every classroom's attendance to time_offsets."""
+    groups: Dict[str, list] = {}
+    for c in classrooms:
+        groups.setdefault(c.personality, []).append(c)
+    names = sorted(groups)
+    offsets = list(time_offsets)
+    total = sum(c.attendance for c in classrooms)
+    home = min(offsets, key=abs)  # where students that fit nowhere stay
+    overflow_cost = 1 + max(abs(o) for o in offsets) * 3  # dearer than any move
+
+    # nodes: 0 source, 1..G groups, then offsets, then sink
+    G, K = len(names), len(offsets)
+    source, sink = 0, 1 + G + K
+    arcs = [[0, 1 + g, sum(c.attendance for c in groups[n]), 0] for g, n in enumerate(names)]
+    for g, n in enumerate(names):
+        for k, off in enumerate(offsets):
+            arcs.append([1 + g, 1 + G + k, total, move_cost(n, off)])
+    for k, off in enumerate(offsets):
+        arcs.append([1 + G + k, sink, per_batch, 0])
+        if off == home:
+            arcs.append([1 + G + k, sink, total, overflow_cost])
+    _min_cost_flow(sink + 1, arcs, source, sink)
+
+    schedules: Dict[str, List[Tuple[int, int]]] = {c.id: [] for c in classrooms}
+    slot_map: Dict[int, int] = {}
+    cost = 0
+    for g, n in enumerate(names):
+        # fill the group's classrooms one after another, offset by offset
+        members = iter(groups[n])
+        current, room = None, 0
+        for k, off in enumerate(offsets):
+            amount = arcs[G + g * K + k][4]
+            if amount:
+                slot_map[off] = slot_map.get(off, 0) + amount
+                cost += amount * move_cost(n, off)
+            while amount:
+                if room == 0:
+                    current = next(members)
+                    room = current.attendance
+                    continue
+                take = min(room, amount)
+                schedules[current.id].append((off, take))
+                room -= take
+                amount -= take
+    overflow = max(0, slot_map.get(home, 0) - per_batch)
+    return Assignment(schedules=schedules, slot_map=slot_map, cost=cost, overflow=overflow)
+
+
+def schedule_cost(classrooms, per_batch: int) -> Tuple[int, int]:
+    """(weighted displacement, students above capacity) of the classrooms' current schedules."""
+    cost, loads = 0, {}
+    for c in classrooms:
+        for off, cnt in c.planned_slots:
+            cost += cnt * move_cost(c.personality, off)
+            loads[off] = loads.get(off, 0) + cnt
+    return cost, sum(max(0, load - per_batch) for load in loads.values())
+
+
+def score_against_optimum(classrooms, time_offsets: List[int], per_batch: int) -> Dict:
+    """Negotiated schedules next to the solver's optimum for the same campus."""
+    cost, overflow = schedule_cost(classrooms, per_batch)
+    best = solve_schedule(classrooms, time_offsets, per_batch)
+    return {
+        "negotiated_cost": report_cost(cost),
+        "negotiated_overflow": overflow,
+        "optimal_cost": report_cost(best.cost),
+        "optimal_overflow": best.overflow,
+        # only meaningful when both cleared the same amount of congestion
+        "cost_ratio": cost / best.cost if best.cost and overflow == best.overflow else None,
+    }
+
+
+def apply_assignment(assignment: Assignment, classrooms):
+    """Replaces every classroom's schedule with the solver's (the setter keeps a ledger in sync)."""
+    moved = 0
+    for c in classrooms:
+        before = dict(c.planned_slots)
+        after = assignment.schedules[c.id]
+        moved += sum(max(0, cnt - before.get(off, 0)) for off, cnt in after)
+        c.planned_slots = list(after)
+    return moved
@@ -1,46 +1,181 @@
-from flask import Flask, render_template_string
-from flask_socketio import SocketIO
+import copy
 import threading
+import time
 import random
-from dataclasses import asdict, dataclass
-from typing import List, Dict, Optional
-from CEFO import BottleneckAgent, ClassroomAgent, Commitment, Offer, compute_slot_map
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from CEFO import CommitmentLedger, EventBus, RingBufferSink, build_agents, run_episode as run_engine_episode
+from episode_checkpoint import checkpoint, restore
+from episode_delta import DeltaStream, snapshot
+from episode_metrics import MetricsSink, gauge
+from episode_trace import TraceReader, TraceWriter
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'multiagent_secret_123'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# Flask and SocketIO are only imported by create_app(), so the engine side of this
+# module (SimulationState, run_episode) can be used without them.
+app = None
+socketio = None
+# counters and phase timings of every session, served on /metrics
+metrics = MetricsSink()
+
+@dataclass
+class SessionLimits:
+    workers: int = 4               # threads shared by every session's runs
+    max_sessions: int = 64
+    max_episodes: int = 500        # per run; bounds a session's trace and commitment archive
+    log_events: int = 10_000       # events kept per episode
+    idle_timeout_s: float = 900.0  # sessions untouched this long are evicted
+
+DEFAULT_CONFIG = {
+    "episode_base_name": "Monday_11AM",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {
+        "capacity_per_minute": 40,
+        "batch_duration_min": 2
+    },
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,  # Changed from 3 to 1 to match CEFO.py
+    "stubborn_classrooms": ["C4"],
+    "compact_schedules": False,
+    "random_seed": 42
+}
 
 class SimulationState:
-    def __init__(self):
-        self.states = []
+    """One browser session's isolated simulation: its own agents, RNG, trace and delta stream."""
+    def __init__(self, sid=None, limits: Optional[SessionLimits] = None):
+        self.sid = sid
+        self.limits = limits or SessionLimits()
         self.current_episode = 0
         self.is_running = False
-        self.commitments_global = []
-        self.config = {
-            "episode_base_name": "Monday_11AM",
-            "num_classrooms": 6,
-            "attendance": [60, 45, 20, 80, 35, 50],
-            "bottleneck": {
-                "capacity_per_minute": 40,
-                "batch_duration_min": 2
-            },
-            "time_offsets": [0, -2, 2, -4, 4, -6, 6],
-            "max_negotiation_rounds": 5,
-            "violation_threshold": 1,  # Changed from 3 to 1 to match CEFO.py
-            "random_seed": 42
-        }
-        random.seed(self.config["random_seed"])
-        self.B = BottleneckAgent(self.config)
-        self.classrooms = [ClassroomAgent(f"C{i+1}", self.config["attendance"][i], self.config) 
-                          for i in range(self.config["num_classrooms"])]
-        self.agents_by_id = {c.id: c for c in self.classrooms}
-        
-        self.classrooms[3].is_stubborn = True
-        
-        personalities_str = ', '.join([f'{c.id}:{c.personality}' for c in self.classrooms])
-        print(f"System Config: Agent C4 is 'stubborn'. Personalities: {personalities_str}")
+        self.run_id = 0  # bumped by start/stop/reset; queued steps of an older run drop out
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+        self.commitments_global = CommitmentLedger()
+        self.config = copy.deepcopy(DEFAULT_CONFIG)
+        # a private generator, so concurrent sessions do not disturb each other's draws
+        rng = random.Random(self.config["random_seed"])
+        # every agent reports into one bus; the ring buffer holds the current episode's events
+        self.log = RingBufferSink(maxlen=self.limits.log_events)
+        self.events = EventBus(self.log, metrics)
+        self.B, self.ledger, self.classrooms, self.agents_by_id = build_agents(self.config, rng=rng, events=self.events)
+        # what reset goes back to
+        self.initial = checkpoint(0, self.config, self.classrooms, self.commitments_global, rng)
+
+        # episodes are served from an on-disk trace instead of being kept in memory,
+        # and reach the client as deltas against what it has acknowledged
+        self.stream = DeltaStream(send_to_client)
+        self.trace_dir = None
+        self.new_trace()
+        if sid is not None:
+            self.stream.connect(sid)
+
+    def new_trace(self, logs=None):
+        self.remove_trace()
+        self.trace_dir = tempfile.mkdtemp(prefix="cefo_trace_")
+        self.trace = TraceWriter(self.trace_dir, self.classrooms, self.B.per_batch)
+        self.replay = TraceReader(self.trace_dir)
+        self.stream.reset(self.replay, snapshot(self.classrooms), logs)
+
+    def restore(self, cp):
+        """Puts the agents and commitments back to a checkpoint (the trace is left alone)."""
+        self.B, self.ledger, self.classrooms, self.agents_by_id, self.commitments_global = restore(cp, self.events)
+        self.current_episode = cp.episode
+
+    def remove_trace(self):
+        if self.trace_dir is not None:
+            shutil.rmtree(self.trace_dir, ignore_errors=True)
+            self.trace_dir = None
+
+class SessionManager:
+    """Sessions keyed by SocketIO sid, with runs executed one episode per task on a shared bounded pool.
+
+    A run's next episode is queued behind everybody else's, so the workers take
+    turns over all running sessions instead of one thread being held per run.
+    """
+    def __init__(self, limits: Optional[SessionLimits] = None):
+        self.limits = limits or SessionLimits()
+        self.pool = ThreadPoolExecutor(max_workers=self.limits.workers, thread_name_prefix="cefo-run")
+        self._sessions: Dict[str, SimulationState] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def open(self, sid) -> Optional[SimulationState]:
+        """The session for `sid`, created on demand; None when the server is full."""
+        with self._lock:
+            state = self._sessions.get(sid)
+            if state is None:
+                self._evict_idle()
+                if len(self._sessions) >= self.limits.max_sessions:
+                    return None
+                state = self._sessions[sid] = SimulationState(sid, self.limits)
+        state.last_seen = time.monotonic()
+        return state
+
+    def close(self, sid):
+        with self._lock:
+            state = self._sessions.pop(sid, None)
+        if state is not None:
+            self._discard(state)
+
+    def evict_idle(self) -> List[str]:
+        with self._lock:
+            return self._evict_idle()
+
+    def _evict_idle(self) -> List[str]:
+        cutoff = time.monotonic() - self.limits.idle_timeout_s
+        idle = [sid for sid, s in self._sessions.items() if s.last_seen < cutoff]
+        for sid in idle:
+            self._discard(self._sessions.pop(sid))
+        return idle
+
+    @staticmethod
+    def _discard(state: SimulationState):
+        with state.lock:
+            state.run_id += 1
+            state.is_running = False
+            state.remove_trace()
 
-sim_state = SimulationState()
+    def start(self, state: SimulationState, episodes: int):
+        with state.lock:
+            state.run_id += 1
+            state.is_running = True
+            state.current_episode = 0
+            state.new_trace()
+            run = state.run_id
+        self.pool.submit(self._step, state, run, 1, episodes)
+
+    def _step(self, state: SimulationState, run: int, ep: int, last: int):
+        try:
+            with state.lock:
+                if state.run_id != run:
+                    return  # stopped, reset or evicted since this step was queued
+                run_episode(state, ep)
+                state.current_episode = ep
+                # a client still busy with an earlier update gets this one coalesced into its next
+                with state.events.phase("stream"):
+                    state.stream.publish(ep)
+                if ep == last:
+                    state.is_running = False
+            if ep == last:
+                send_to_client(state.sid, 'simulation_complete', {})
+            else:
+                self.pool.submit(self._step, state, run, ep + 1, last)
+        except Exception as e:
+            state.is_running = False
+            send_to_client(state.sid, 'error', {'message': f'Simulation error: {str(e)}'})
+
+sessions: Optional[SessionManager] = None
+
+def send_to_client(sid, event, payload):
+    # every session is its own room: nothing is broadcast to other browsers
+    if socketio is not None and sid is not None:
+        socketio.emit(event, payload, to=sid)
 
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -413,20 +548,53 @@ HTML_TEMPLATE = '''
     <script>
         const socket = io();
         let currentData = {};
+        let agentIds = [];
+        let commitments = new Map();
+        let simulationDone = false;
         
         socket.on('connect', () => {
             addLog('✅ Connected to simulation server');
             updateStatus('Connected and ready');
         });
         
-        socket.on('episode_update', (data) => {
-            currentData = data;
+        // full state once per trace; everything after it is a delta
+        socket.on('keyframe', (kf) => {
+            agentIds = kf.agents.map(a => a.id);
+            commitments = new Map();
+            currentData = {
+                episode: 0,
+                capacity: kf.capacity,
+                slot_map: {},
+                schedules: kf.schedules,
+                commitments: [],
+                agent_info: {}
+            };
+            kf.agents.forEach(a => {
+                currentData.agent_info[a.id] = Object.assign({}, a, {
+                    reputation: kf.reputation[a.id],
+                    violations: kf.violations[a.id]
+                });
+                kf.schedules[a.id].forEach(([offset, count]) => {
+                    currentData.slot_map[offset] = (currentData.slot_map[offset] || 0) + count;
+                });
+            });
             updateCharts();
-            updateLogs(data.logs);
-            updateStatus(`Running Episode ${data.episode}`);
+            if (kf.logs.length) updateLogs(kf.logs);
+        });
+        
+        socket.on('episode_delta', (delta) => {
+            applyDelta(delta);
+            updateCharts();
+            updateLogs(delta.logs);
+            const skipped = delta.episode - delta.base - 1;
+            if (skipped > 0) addLog(`⏩ ${skipped} episode(s) coalesced into this update`);
+            updateStatus(simulationDone ? 'Simulation complete' : `Running Episode ${delta.episode}`);
+            // acknowledge once drawn: the server sends the next update only then
+            requestAnimationFrame(() => socket.emit('ack', { generation: delta.generation, episode: delta.episode }));
         });
         
         socket.on('simulation_complete', () => {
+            simulationDone = true;
             addLog('🎉 Simulation completed successfully!');
             updateStatus('Simulation complete');
         });
@@ -436,6 +604,11 @@ HTML_TEMPLATE = '''
             updateStatus('Simulation stopped');
         });
         
+        socket.on('connect_error', (err) => {
+            addLog('❌ Could not connect: ' + err.message);
+            updateStatus('Not connected');
+        });
+        
         socket.on('error', (data) => {
             addLog('❌ Error: ' + data.message);
             updateStatus('Error occurred');
@@ -443,6 +616,7 @@ HTML_TEMPLATE = '''
 
         function startSimulation() {
             const episodes = parseInt(document.getElementById('episodesCount').value);
+            simulationDone = false;
             socket.emit('start_simulation', { episodes });
             updateStatus('Starting simulation...');
         }
@@ -461,6 +635,49 @@ HTML_TEMPLATE = '''
             updateStatus('Resetting simulation...');
         }
 
+        // layout of delta.data: see episode_delta.py
+        function applyDelta(delta) {
+            const i32 = new Int32Array(delta.data);
+            const f32 = new Float32Array(delta.data);
+            const [nLoads, nSched, nAgents, nCommitments] = i32;
+            let p = 4;
+            currentData.episode = delta.episode;
+            currentData.slot_map = {};
+            for (let k = 0; k < nLoads; k++, p += 2) {
+                currentData.slot_map[i32[p]] = i32[p + 1];
+            }
+            const replaced = new Set();
+            for (let k = 0; k < nSched; k++, p += 3) {
+                const id = agentIds[i32[p]];
+                if (!replaced.has(id)) {
+                    replaced.add(id);
+                    currentData.schedules[id] = [];
+                }
+                currentData.schedules[id].push([i32[p + 1], i32[p + 2]]);
+            }
+            for (let k = 0; k < nAgents; k++, p += 3) {
+                const info = currentData.agent_info[agentIds[i32[p]]];
+                info.violations = i32[p + 1];
+                info.reputation = f32[p + 2];
+            }
+            // ids repeat: key by (created_episode, due_episode, ordinal) instead
+            for (let k = 0; k < nCommitments; k++, p += 10) {
+                commitments.set(`${i32[p + 4]}/${i32[p + 5]}/${i32[p + 9]}`, {
+                    commitment_id: delta.commitment_ids[k],
+                    proposer: agentIds[i32[p]],
+                    acceptor: agentIds[i32[p + 1]],
+                    shift_min: i32[p + 2],
+                    moved_students: i32[p + 3],
+                    created_episode: i32[p + 4],
+                    due_episode: i32[p + 5],
+                    times_missed: i32[p + 6],
+                    fulfilled: i32[p + 7] === 1,
+                    fulfilled_episode: i32[p + 8] < 0 ? null : i32[p + 8]
+                });
+            }
+            currentData.commitments = Array.from(commitments.values());
+        }
+
         function addLog(message) {
             const logContent = document.getElementById('logContent');
             const logEntry = document.createElement('div');
@@ -820,249 +1037,139 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
-@app.route('/')
 def index():
+    from flask import render_template_string
     return render_template_string(HTML_TEMPLATE)
 
-@socketio.on('start_simulation')
+def _sid():
+    from flask import request
+    return request.sid
+
+def _session():
+    state = sessions.open(_sid())
+    if state is None:
+        send_to_client(_sid(), 'error', {'message': 'Server is at its session limit, try again later'})
+    return state
+
+def handle_connect(auth=None):
+    if sessions.open(_sid()) is None:
+        from flask_socketio import ConnectionRefusedError
+        raise ConnectionRefusedError('Server is at its session limit, try again later')
+
+def handle_disconnect(*args):
+    sessions.close(_sid())
+
 def handle_start_simulation(data):
-    if sim_state.is_running:
-        socketio.emit('error', {'message': 'Simulation is already running'})
+    state = _session()
+    if state is None:
         return
-    sim_state.is_running = True
-    episodes = data.get('episodes', 3)
-    def run_simulation():
-        try:
-            sim_state.states = []
-            for ep in range(1, episodes + 1):
-                if not sim_state.is_running:
-                    break
-                state = run_episode(ep)
-                sim_state.states.append(state)
-                sim_state.current_episode = ep
-                socketio.emit('episode_update', state)
-                import time; time.sleep(2)
-            if sim_state.is_running:
-                socketio.emit('simulation_complete')
-        except Exception as e:
-            socketio.emit('error', {'message': f'Simulation error: {str(e)}'})
-        finally:
-            sim_state.is_running = False
-    thread = threading.Thread(target=run_simulation)
-    thread.daemon = True
-    thread.start()
+    if state.is_running:
+        send_to_client(state.sid, 'error', {'message': 'Simulation is already running'})
+        return
+    episodes = int(data.get('episodes', 3))
+    if episodes > state.limits.max_episodes:
+        send_to_client(state.sid, 'error', {'message': f'Runs are limited to {state.limits.max_episodes} episodes'})
+        episodes = state.limits.max_episodes
+    sessions.start(state, max(1, episodes))
 
-@socketio.on('stop_simulation')
 def handle_stop_simulation():
-    sim_state.is_running = False
-    socketio.emit('simulation_stopped')
+    state = _session()
+    if state is None:
+        return
+    with state.lock:
+        state.run_id += 1
+        state.is_running = False
+    send_to_client(state.sid, 'simulation_stopped', {})
 
-@socketio.on('next_episode')
 def handle_next_episode():
-    if sim_state.current_episode < len(sim_state.states):
-        sim_state.current_episode += 1
-        socketio.emit('episode_update', sim_state.states[sim_state.current_episode - 1])
-    else:
-        socketio.emit('error', {'message': 'No more episodes available'})
+    state = _session()
+    if state is None:
+        return
+    with state.lock:
+        state.replay.refresh()
+        if state.current_episode < len(state.replay):
+            state.current_episode += 1
+            state.stream.publish(state.current_episode)
+            return
+    send_to_client(state.sid, 'error', {'message': 'No more episodes available'})
 
-@socketio.on('reset_simulation')
 def handle_reset_simulation():
-    sim_state.is_running = False
-    sim_state.states = []
-    sim_state.current_episode = 0
-    sim_state.commitments_global = []
-    
-    # Reset all classrooms to initial state
-    for classroom in sim_state.classrooms:
-        classroom.planned_slots = [(0, classroom.attendance)]
-        classroom.commitment_history = []
-        # Reset reputation but keep personality and stubborn flag
-        classroom.reputation = 1.0
-        classroom.is_stubborn = (classroom.id == "C4")
-        # Reassign personality (optional - if you want to keep same personalities, remove this)
-        # classroom.personality = random.choice(['prefers_early', 'prefers_late', 'flexible'])
-    
-    socketio.emit('episode_update', get_initial_state())
+    state = _session()
+    if state is None:
+        return
+    with state.lock:
+        state.run_id += 1
+        state.is_running = False
+        # back to the freshly built agents, personalities included
+        state.restore(state.initial)
+        state.new_trace(logs=initial_logs(state))
 
-def run_episode(episode_num):
-    logs = []
-    ep_tag = f"{sim_state.config['episode_base_name']}_ep{episode_num}"
-    
-    logs.append(f"Starting Episode {episode_num} ({ep_tag})")
-    
-    # 1) Broadcast capacity, initial slot assignment = 0
-    msg = sim_state.B.broadcast_capacity(sim_state.config["attendance"], ep_tag)
-    for c in sim_state.classrooms:
-        c.on_capacity_broadcast(msg)
-    
-    slot_map = compute_slot_map(sim_state.classrooms)
-    logs.append(f"[Initial slot map] {slot_map}")
-    
-    # 2) Fulfill carry-over commitments
-    for c in sim_state.classrooms:
-        c.fulfill_due_commitments(
-            sim_state.commitments_global, 
-            current_episode=episode_num,
-            slot_map=slot_map, 
-            B_agent=sim_state.B, 
-            agents_by_id=sim_state.agents_by_id,
-            violation_threshold=sim_state.config["violation_threshold"]
-        )
-    
-    slot_map = compute_slot_map(sim_state.classrooms)
-    logs.append(f"[After fulfill attempts] slot_map: {slot_map}")
-    
-    # 3) Enhanced Negotiation rounds with counter-offer logic
-    for round_ in range(sim_state.config["max_negotiation_rounds"]):
-        slot_map = compute_slot_map(sim_state.classrooms)
-        congested_offsets = [off for off, val in slot_map.items() if val > sim_state.B.per_batch]
-        
-        if not congested_offsets:
-            logs.append(f"No congestion after negotiation round {round_} in episode {episode_num}")
-            break
-            
-        logs.append(f"[Negotiation round {round_}] congested offsets: {congested_offsets}")
-        
-        for off in congested_offsets:
-            congested_agents = [c for c in sim_state.classrooms if any(s[0]==off for s in c.planned_slots)]
-            
-            if len(congested_agents) < 2:
-                continue
-                
-            # Sort by number of students at this offset (descending)
-            congested_agents.sort(key=lambda agent: next((s[1] for s in agent.planned_slots if s[0] == off), 0), reverse=True)
-            
-            a1 = congested_agents[0]
-            a2 = congested_agents[1]
+def handle_ack(data):
+    state = _session()
+    if state is not None:
+        state.stream.ack(state.sid, data.get('generation'), data.get('episode'))
 
-            logs.append(f"[{a1.id}] (most students) is proposing to [{a2.id}].")
+def run_episode(state, episode_num):
+    """Runs one episode of the shared engine loop and records it to the session's trace; returns the engine's summary."""
+    state.log.clear()
+    summary = run_engine_episode(episode_num, state.config, state.B, state.classrooms,
+                                 state.agents_by_id, state.commitments_global, state.ledger)
+    with state.events.phase("serialize"):
+        state.trace.record_episode(episode_num, state.ledger, state.classrooms, state.commitments_global, state.log)
+        state.trace.flush()
+    return summary
 
-            # REPUTATION CHECK
-            if a2.reputation < 0.5:
-                logs.append(f"[{a1.id}] refuses to negotiate with {a2.id} due to low reputation ({a2.reputation:.2f}).")
-                continue
-                
-            offer = a1.propose_shift(a2, off, episode_num, slot_map)
-            
-            if offer:
-                # Calculate utility for the offer
-                utility = a2.calculate_utility(offer)
-                logs.append(f"[{a2.id}] calculated utility for offer: {utility:.2f} (threshold: {a2.utility_threshold})")
-                
-                if a2.evaluate_offer(offer):
-                    # --- Offer Accepted ---
-                    logs.append(f"[{a1.id}]'s offer to shift by {offer.shift_min} min was ACCEPTED by [{a2.id}].")
-                    a2.apply_offer(offer)
-                    com = Commitment(
-                        commitment_id=f"com_{offer.offer_id}",
-                        proposer=offer.proposer,
-                        acceptor=offer.acceptor,
-                        shift_min=offer.shift_min,
-                        moved_students=offer.moved_students,
-                        created_episode=episode_num,
-                        due_episode=episode_num + 1
-                    )
-                    sim_state.commitments_global.append(com)
-                    a1.commitment_history.append(com)
-                    a2.commitment_history.append(com)
-                    logs.append(f"[COMMITTED] {com.commitment_id} created, due in episode {episode_num+1}.")
-                else:
-                    # --- Offer Rejected, Initiating Counter-Offer Sequence ---
-                    logs.append(f"[{a1.id}]'s offer was REJECTED by [{a2.id}] (utility too low). Checking for a counter-offer...")
-                    counter_offer = a2.formulate_counter_offer(offer, episode_num, slot_map)
+def metrics_endpoint():
+    from flask import Response
+    text = metrics.prometheus() + "\n".join(gauge("cefo_sessions", "Open simulation sessions.", len(sessions or ()))) + "\n"
+    return Response(text, content_type="text/plain; version=0.0.4; charset=utf-8")
 
-                    if counter_offer:
-                        # a2 made a counter-offer. Now a1 must evaluate it.
-                        counter_utility = a1.calculate_utility(counter_offer)
-                        logs.append(f"[{a2.id}] counters with a proposal to shift by {counter_offer.shift_min} min.")
-                        logs.append(f"[{a1.id}] calculated utility for counter-offer: {counter_utility:.2f} (threshold: {a1.utility_threshold})")
-                        
-                        if a1.evaluate_offer(counter_offer):
-                            # a1 accepts the counter-offer
-                            logs.append(f"[{a1.id}] ACCEPTS the counter-offer from [{a2.id}].")
-                            a1.apply_offer(counter_offer)
-                            com = Commitment(
-                                commitment_id=f"com_{counter_offer.offer_id}",
-                                proposer=counter_offer.proposer,
-                                acceptor=counter_offer.acceptor,
-                                shift_min=counter_offer.shift_min,
-                                moved_students=counter_offer.moved_students,
-                                created_episode=episode_num,
-                                due_episode=episode_num + 1
-                            )
-                            sim_state.commitments_global.append(com)
-                            a1.commitment_history.append(com)
-                            a2.commitment_history.append(com)
-                            logs.append(f"[COMMITTED] {com.commitment_id} created from counter-offer, due in episode {episode_num+1}.")
-                        else:
-                            # a1 rejects the counter-offer
-                            logs.append(f"[{a1.id}] REJECTS the counter-offer from [{a2.id}] (utility too low). Negotiation ends.")
-                    else:
-                        # a2 did not provide a counter-offer
-                        logs.append(f"[{a2.id}] did not provide a counter-offer. Negotiation ends.")
-    
-    final_slot_map = compute_slot_map(sim_state.classrooms)
-    logs.append(f"[Final slot_map after episode] {final_slot_map}")
-    logs.append("Schedules:")
-    for c in sim_state.classrooms:
-        logs.append(f" {c.id}: {c.planned_slots}")
-    
-    # Include enhanced agent information
-    return {
-        'episode': episode_num,
-        'slot_map': final_slot_map,
-        'schedules': {classroom.id: classroom.planned_slots for classroom in sim_state.classrooms},
-        'commitments': [asdict(commitment) for commitment in sim_state.commitments_global],
-        'capacity': sim_state.B.per_batch,
-        'logs': logs,
-        'agent_info': {
-            classroom.id: {
-                'personality': classroom.personality,
-                'reputation': classroom.reputation,
-                'is_stubborn': classroom.is_stubborn,
-                'utility_threshold': classroom.utility_threshold,
-                'violations': len([c for c in classroom.commitment_history if c.times_missed > 0])
-            } for classroom in sim_state.classrooms
-        }
-    }
+def initial_logs(state):
+    personality_str = ", ".join(f"{c.id}: {c.personality}" for c in state.classrooms)
+    return [
+        'Multi-Agent Traffic Simulation Ready',
+        'All classrooms start at time offset 0',
+        f'Agent Personalities: {personality_str}',
+        'Agent C4 is stubborn (will not fulfill commitments)',
+        'Click "Start Simulation" to begin...'
+    ]
 
-def get_initial_state():
-    # Reset to initial state with all classrooms at offset 0
-    for classroom in sim_state.classrooms:
-        classroom.planned_slots = [(0, classroom.attendance)]
-        classroom.commitment_history = []
-    
-    slot_map = compute_slot_map(sim_state.classrooms)
-    
-    # Get personalities for initial display
-    personalities = [f"{c.id}: {c.personality}" for c in sim_state.classrooms]
-    personality_str = ", ".join(personalities)
-    
-    return {
-        'episode': 0,
-        'slot_map': slot_map,
-        'schedules': {classroom.id: classroom.planned_slots for classroom in sim_state.classrooms},
-        'commitments': [asdict(commitment) for commitment in sim_state.commitments_global],
-        'capacity': sim_state.B.per_batch,
-        'logs': [
-            'Multi-Agent Traffic Simulation Ready', 
-            'All classrooms start at time offset 0', 
-            f'Agent Personalities: {personality_str}',
-            'Agent C4 is stubborn (will not fulfill commitments)',
-            'Click "Start Simulation" to begin...'
-        ],
-        'agent_info': {
-            classroom.id: {
-                'personality': classroom.personality,
-                'reputation': classroom.reputation,
-                'is_stubborn': classroom.is_stubborn
-            } for classroom in sim_state.classrooms
-        }
-    }
+
+def system_config() -> str:
+    """The startup line naming every classroom's personality; each session is seeded alike, so it holds for all."""
+    _, _, classrooms, _ = build_agents(DEFAULT_CONFIG, rng=random.Random(DEFAULT_CONFIG["random_seed"]))
+    personalities_str = ', '.join([f'{c.id}:{c.personality}' for c in classrooms])
+    return f"System Config: Agent C4 is 'stubborn'. Personalities: {personalities_str}"
+
+
+def create_app(limits: Optional[SessionLimits] = None):
+    """Builds the Flask app, the SocketIO server and the session manager, and wires up the handlers."""
+    global app, socketio, sessions
+    from flask import Flask
+    from flask_socketio import SocketIO
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'multiagent_secret_123'
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+    if sessions is None:
+        sessions = SessionManager(limits)
+
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    socketio.on_event('connect', handle_connect)
+    socketio.on_event('disconnect', handle_disconnect)
+    socketio.on_event('start_simulation', handle_start_simulation)
+    socketio.on_event('stop_simulation', handle_stop_simulation)
+    socketio.on_event('next_episode', handle_next_episode)
+    socketio.on_event('reset_simulation', handle_reset_simulation)
+    socketio.on_event('ack', handle_ack)
+    return app, socketio
 
 
 def start_server():
     try:
+        create_app()
+        print(system_config())
         print("Starting Multi-Agent Simulation Server...")
         print("Open your browser and go to: http://localhost:5010")
         socketio.run(
@@ -0,0 +1,125 @@
+"""Checkpoints of a CEFO run between episodes: resume it, or fork what-if branches.
+
+A Checkpoint holds everything that carries over from one episode to the next:
+each classroom's schedule, personality, stubbornness, reputation and violation
+counters, the commitment ledger and, optionally, the state of the run's RNG.
+The slot ledger is not stored; restore() rebuilds it from the schedules. The
+commitment ledger comes back in the mode it was run in (keep_archive,
+compact_archive).
+
+Checkpoints are immutable. Settled commitments can no longer change, so every
+restore shares the checkpoint's archived Commitment objects instead of copying
+them (a compact archive is one array, copied whole); only the open commitments
+and the agents are rebuilt. Restoring is therefore cheap, and many branches can
+start from one warm checkpoint:
+
+    cp = checkpoint(500, cfg, classrooms, commitments, rng)
+    B, ledger, classrooms, agents_by_id, commitments = restore(cp)
+    agents_by_id["C4"].is_stubborn = False          # what if C4 gave in at 501?
+    run_episode(501, cp.cfg, B, classrooms, agents_by_id, commitments, ledger)
+
+dumps()/loads() give a compact byte form for disk.
+"""
+import copy
+import pickle
+import random
+import zlib
+from dataclasses import astuple, dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from CEFO import Commitment, CommitmentArray, CommitmentLedger, build_agents
+
+# per-agent row: (id, personality, is_stubborn, utility_threshold, reputation, violations,
+#                 missed_commitments, per_batch, schedule, history)
+# history refers to commitments by position: i >= 0 in the archive, i < 0 at open[-i - 1];
+# one the ledger no longer holds as that object (keep_archive=False, or a compact archive)
+# is stored as its fields instead
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    episode: int                          # the last episode run
+    cfg: Dict
+    agents: Tuple[tuple, ...]
+    open: Tuple[tuple, ...]               # open commitments' fields, rebuilt on every restore
+    archive: Union[Tuple[Commitment, ...], CommitmentArray]  # settled commitments, shared by every restore
+    totals: Tuple[int, int, int]          # CommitmentLedger created, fulfilled, expired
+    rng_state: Optional[tuple] = None
+    ledger: Tuple[bool, bool] = (True, False)  # CommitmentLedger keep_archive, compact_archive
+
+    def rng(self) -> Optional[random.Random]:
+        """A generator in the state the run's RNG was in, if one was checkpointed."""
+        if self.rng_state is None:
+            return None
+        rng = random.Random()
+        rng.setstate(self.rng_state)
+        return rng
+
+    def dumps(self) -> bytes:
+        archive = self.archive
+        if not isinstance(archive, CommitmentArray):
+            archive = tuple(astuple(c) for c in archive)
+        state = (self.episode, self.cfg, self.agents, self.open, archive, self.totals, self.rng_state, self.ledger)
+        return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def loads(cls, data: bytes) -> "Checkpoint":
+        episode, cfg, agents, open_, archive, totals, rng_state, ledger = pickle.loads(zlib.decompress(data))
+        if not isinstance(archive, CommitmentArray):
+            archive = tuple(Commitment(*fields) for fields in archive)
+        return cls(episode, cfg, agents, open_, archive, totals, rng_state, ledger)
+
+
+def checkpoint(episode: int, cfg: Dict, classrooms, commitments_global: CommitmentLedger,
+               rng: Optional[random.Random] = None) -> Checkpoint:
+    """The state of a run after `episode`, taken between episodes."""
+    archive = commitments_global.archive
+    compact = isinstance(archive, CommitmentArray)
+    # a compact archive reads back new objects, so no history entry is one of its rows
+    archive = archive.copy() if compact else tuple(archive)
+    open_ = commitments_global.open()
+    position = {} if compact else {id(c): i for i, c in enumerate(archive)}
+    position.update((id(c), -i - 1) for i, c in enumerate(open_))
+
+    def ref(com):
+        i = position.get(id(com))
+        return astuple(com) if i is None else i
+
+    agents = tuple(
+        (c.id, c.personality, c.is_stubborn, c.utility_threshold, c.reputation, c.violations,
+         c.missed_commitments, c.per_batch, tuple(c.planned_slots),
+         tuple(ref(com) for com in c.commitment_history))
+        for c in classrooms)
+    totals = (commitments_global.created, commitments_global.fulfilled, commitments_global.expired)
+    return Checkpoint(episode, copy.deepcopy(cfg), agents, tuple(astuple(c) for c in open_), archive, totals,
+                      rng.getstate() if rng is not None else None, (commitments_global.keep_archive, compact))
+
+
+def restore(cp: Checkpoint, events=None):
+    """A fresh run in the checkpointed state: (B, ledger, classrooms, agents_by_id, commitments_global).
+
+    Every call gives independent agents and open commitments; only the settled
+    archive is shared (a compact one is copied), so the branches do not affect
+    each other or the checkpoint.
+    """
+    # personalities are overwritten below, so the draw does not matter
+    B, ledger, classrooms, agents_by_id = build_agents(cp.cfg, rng=random.Random(0), events=events)
+    keep_archive, compact_archive = cp.ledger
+    commitments_global = CommitmentLedger(keep_archive=keep_archive, compact_archive=compact_archive)
+    commitments_global.archive = cp.archive.copy() if compact_archive else list(cp.archive)
+    open_: List[Commitment] = [Commitment(*fields) for fields in cp.open]
+    for com in open_:
+        commitments_global.append(com)
+    commitments_global.created, commitments_global.fulfilled, commitments_global.expired = cp.totals
+
+    def resolve(ref):
+        if isinstance(ref, tuple):
+            return Commitment(*ref)
+        return cp.archive[ref] if ref >= 0 else open_[-ref - 1]
+
+    for c, row in zip(classrooms, cp.agents):
+        (c.id, c.personality, c.is_stubborn, c.utility_threshold, c.reputation, c.violations,
+         c.missed_commitments, c.per_batch, schedule, history) = row
+        c.planned_slots = list(schedule)
+        c.commitment_history = [resolve(ref) for ref in history]
+    return B, ledger, classrooms, {c.id: c for c in classrooms}, commitments_global
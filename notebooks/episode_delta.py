@@ -0,0 +1,199 @@
+"""Delta-encoded, binary-packed episode updates for the demo's SocketIO stream.
+
+A client first gets a keyframe: the static agent info, the capacity and the
+state every later update is diffed against (the baseline, "episode 0"). After
+that it only gets deltas between the episode it last acknowledged and the
+newest one, read back from the episode trace:
+
+    slot map                       whole (one row per occupied offset)
+    schedules                      only agents whose schedule changed
+    reputation / violations        only agents whose values changed
+    commitments                    only those settled or created since
+    logs                           the newest episode's lines
+
+Numbers travel as one little-endian int32 buffer (reputation as float32 bits):
+
+    header   n_loads, n_sched, n_agents, n_commitments
+    loads    n_loads       x (offset, students)
+    sched    n_sched       x (agent, offset, students)   full schedule of each listed agent
+    agents   n_agents      x (agent, violations, reputation)
+    coms     n_commitments x (proposer, acceptor, shift_min, moved_students, created_episode,
+                              due_episode, times_missed, fulfilled, fulfilled_episode or -1, ordinal)
+
+with agents as indices into the keyframe's agent list and commitment ids in
+the payload's "commitment_ids". Ids repeat (the same pair can agree twice in
+an episode), so clients key commitments by (created_episode, due_episode,
+ordinal), the ordinal counting commitments created in that episode and due in
+that one, in creation order (see commitment_handles). Each client has at most one unacknowledged
+update; episodes finished meanwhile are coalesced into its next one, so a
+fast simulation streams at the client's pace and an update's size depends on
+how much changed, not on how long the run has been going.
+"""
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+HEADER = ("loads", "sched", "agents", "commitments")
+_WIDTH = {"loads": 2, "sched": 3, "agents": 3, "commitments": 10}
+
+
+def snapshot(classrooms) -> Dict:
+    """The per-agent state deltas are computed against: schedules, reputation and violations."""
+    return {
+        "schedules": {c.id: list(c.planned_slots) for c in classrooms},
+        "reputation": {c.id: c.reputation for c in classrooms},
+        "violations": {c.id: c.missed_commitments for c in classrooms},
+    }
+
+
+def commitment_handles(commitments) -> List[tuple]:
+    """A unique (created_episode, due_episode, ordinal) per commitment of one trace episode.
+
+    A commitment is traced in the episode that created it and in the one it came
+    due in. Both list it in creation order among the commitments sharing its
+    created and due episodes, so its ordinal there is the same both times.
+    """
+    seen: Dict[tuple, int] = {}
+    handles = []
+    for c in commitments:
+        group = (c.created_episode, c.due_episode)
+        ordinal = seen.get(group, 0)
+        seen[group] = ordinal + 1
+        handles.append(group + (ordinal,))
+    return handles
+
+
+def episode_state(reader, episode: int, baseline: Dict) -> Dict:
+    if episode == 0:
+        return baseline
+    return {
+        "schedules": reader.schedules(episode),
+        "reputation": reader.agent_column("reputation", episode),
+        "violations": reader.agent_column("missed", episode),
+    }
+
+
+def keyframe(reader, baseline: Dict, generation: int, logs: Optional[List[str]] = None) -> Dict:
+    return {
+        "generation": generation,
+        "capacity": reader.meta["capacity"],
+        "agents": reader.meta["agents"],
+        "schedules": baseline["schedules"],
+        "reputation": baseline["reputation"],
+        "violations": baseline["violations"],
+        "logs": logs or [],
+    }
+
+
+def encode_delta(reader, base: int, episode: int, baseline: Dict, generation: int = 0) -> Dict:
+    """Everything that changed between episode `base` (0: the baseline) and `episode`."""
+    old, new = episode_state(reader, base, baseline), episode_state(reader, episode, baseline)
+    ids = reader.agent_ids
+    loads = sorted(reader.slot_map(episode).items())
+    sched = [(i, off, cnt) for i, aid in enumerate(ids) if new["schedules"][aid] != old["schedules"][aid]
+             for off, cnt in new["schedules"][aid]]
+    agents = [i for i, aid in enumerate(ids)
+              if new["reputation"][aid] != old["reputation"][aid] or new["violations"][aid] != old["violations"][aid]]
+    settled = {}
+    for ep in range(base + 1, episode + 1):
+        commitments = reader.commitments(ep)
+        for handle, c in zip(commitment_handles(commitments), commitments):
+            settled[handle] = c  # later episodes hold the newer state
+    index = {aid: i for i, aid in enumerate(ids)}
+    coms = [(index[c.proposer], index[c.acceptor], c.shift_min, c.moved_students, c.created_episode,
+             c.due_episode, c.times_missed, int(c.fulfilled),
+             -1 if c.fulfilled_episode is None else c.fulfilled_episode, ordinal)
+            for (_, _, ordinal), c in settled.items()]
+
+    agent_rows = np.zeros((len(agents), 3), dtype="<i4")
+    agent_rows[:, 0] = agents
+    agent_rows[:, 1] = [new["violations"][ids[i]] for i in agents]
+    agent_rows[:, 2] = np.array([new["reputation"][ids[i]] for i in agents], dtype="<f4").view("<i4")
+    data = np.concatenate([
+        np.array([len(loads), len(sched), len(agents), len(coms)], dtype="<i4"),
+        np.array(loads, dtype="<i4").reshape(-1),
+        np.array(sched, dtype="<i4").reshape(-1),
+        agent_rows.reshape(-1),
+        np.array(coms, dtype="<i4").reshape(-1),
+    ])
+    return {
+        "generation": generation,
+        "episode": episode,
+        "base": base,
+        "commitment_ids": [c.commitment_id for c in settled.values()],
+        "logs": [line for e in reader.events(episode) for line in e.text().splitlines() if line],
+        "data": data.tobytes(),
+    }
+
+
+def decode_delta(payload: Dict) -> Dict[str, np.ndarray]:
+    """The numeric sections of an encoded delta as (rows, width) int32 arrays (agents' reputation as float32)."""
+    data = np.frombuffer(payload["data"], dtype="<i4")
+    counts = dict(zip(HEADER, data[:len(HEADER)].tolist()))
+    out, pos = {}, len(HEADER)
+    for name in HEADER:
+        size = counts[name] * _WIDTH[name]
+        out[name] = data[pos:pos + size].reshape(-1, _WIDTH[name])
+        pos += size
+    out["reputation"] = out["agents"][:, 2].copy().view("<f4")
+    return out
+
+
+class DeltaStream:
+    """Per-client cursors over a trace; send(sid, event, payload) delivers a message to one client.
+
+    A client is sent a delta only when it has acknowledged the previous one;
+    publish() just moves the newest episode forward.
+    """
+    def __init__(self, send: Callable[[str, str, Dict], None]):
+        self.send = send
+        self.reader = None
+        self.baseline: Dict = {}
+        self.latest = 0
+        self.generation = 0
+        self._keyframe: Dict = {}
+        self._clients: Dict[str, Dict] = {}  # sid -> {"acked": episode, "in_flight": episode or None}
+        self._lock = threading.Lock()
+
+    def reset(self, reader, baseline: Dict, logs: Optional[List[str]] = None):
+        """Starts over on a new trace: every client gets a keyframe and is back at episode 0."""
+        with self._lock:
+            self.reader, self.baseline, self.latest = reader, baseline, 0
+            self.generation += 1
+            self._keyframe = keyframe(reader, baseline, self.generation, logs)
+            for sid, cursor in self._clients.items():
+                cursor.update(acked=0, in_flight=None)
+                self.send(sid, "keyframe", self._keyframe)
+
+    def connect(self, sid: str):
+        with self._lock:
+            self._clients[sid] = {"acked": 0, "in_flight": None}
+            self.send(sid, "keyframe", self._keyframe)
+            self._pump(sid)
+
+    def disconnect(self, sid: str):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def publish(self, episode: int):
+        with self._lock:
+            self.latest = episode
+            for sid in self._clients:
+                self._pump(sid)
+
+    def ack(self, sid: str, generation: int, episode: int):
+        with self._lock:
+            cursor = self._clients.get(sid)
+            if cursor is None or generation != self.generation or cursor["in_flight"] != episode:
+                return  # unknown client, or an ack for a trace that has since been reset
+            cursor.update(acked=episode, in_flight=None)
+            self._pump(sid)
+
+    def _pump(self, sid: str):
+        cursor = self._clients[sid]
+        if cursor["in_flight"] is not None or cursor["acked"] >= self.latest:
+            return
+        cursor["in_flight"] = self.latest
+        self.send(sid, "episode_delta",
+                  encode_delta(self.reader, cursor["acked"], self.latest, self.baseline, self.generation))
@@ -0,0 +1,139 @@
+"""Counters and per-phase timings of CEFO runs, read in process or as Prometheus text.
+
+MetricsSink is an EventBus sink. It counts the negotiation and fulfilment events
+the agents emit, and receives the wall time of every EventBus.phase() block:
+broadcast, fulfill, negotiation_round or auction, central_fallback and, in the demo
+server, serialize. A bus with no sinks skips both, so runs that do not
+subscribe one pay nothing.
+
+    metrics = MetricsSink()
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, events=EventBus(metrics))
+    ...                                  # run episodes
+    metrics.snapshot()                   # {"counters": ..., "phases": ..., "rates": ...}
+    metrics.prometheus()                 # text exposition format, as served on /metrics
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# metric -> help text; every one is exported as cefo_<metric>_total
+COUNTERS = {
+    "episodes": "Episodes started.",
+    "negotiation_rounds": "Negotiation rounds run.",
+    "negotiations": "Pairwise negotiations opened at a congested offset.",
+    "negotiations_refused": "Negotiations refused for the other side's low reputation.",
+    "offers": "Offers answered, by type (initial or counter) and outcome.",
+    "counters_declined": "Rejected offers the acceptor did not counter.",
+    "commitments_created": "Commitments created by accepted offers.",
+    "fulfillments": "Due commitments settled, by outcome (fulfilled, failed or partial).",
+    "violations": "Commitments missed past the violation threshold.",
+    "central_fallbacks": "Episodes that fell back to the central scheduler.",
+    "auctions": "Sealed-bid auctions cleared.",
+}
+
+# event kind -> (metric, labels)
+EVENT_COUNTERS: Dict[str, Tuple[str, Tuple[Tuple[str, str], ...]]] = {
+    "episode_start": ("episodes", ()),
+    "round_start": ("negotiation_rounds", ()),
+    "propose": ("negotiations", ()),
+    "low_reputation": ("negotiations_refused", ()),
+    "offer_accepted": ("offers", (("type", "initial"), ("outcome", "accepted"))),
+    "offer_rejected": ("offers", (("type", "initial"), ("outcome", "rejected"))),
+    "counter_accepted": ("offers", (("type", "counter"), ("outcome", "accepted"))),
+    "counter_rejected": ("offers", (("type", "counter"), ("outcome", "rejected"))),
+    "no_counter": ("counters_declined", ()),
+    "committed": ("commitments_created", ()),
+    "fulfilled": ("fulfillments", (("outcome", "fulfilled"),)),
+    "fulfill_failed": ("fulfillments", (("outcome", "failed"),)),
+    "fulfill_partial": ("fulfillments", (("outcome", "partial"),)),
+    "violation": ("violations", ()),
+    "central_fallback": ("central_fallbacks", ()),
+    "auction": ("auctions", ()),
+}
+
+
+def _labels(labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+def gauge(name: str, help_text: str, value: float) -> List[str]:
+    """Exposition lines for a single gauge, for callers adding their own values to prometheus()."""
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+
+class MetricsSink:
+    """Event counters and phase timings; safe to share between buses on different threads."""
+    def __init__(self):
+        self.counters: Dict[Tuple[str, tuple], int] = {}
+        self.phases: Dict[str, List[float]] = {}  # phase -> [calls, total seconds, slowest]
+        self._lock = threading.Lock()
+
+    def write(self, event):
+        metric = EVENT_COUNTERS.get(event.kind)
+        if metric is None:
+            return
+        with self._lock:
+            self.counters[metric] = self.counters.get(metric, 0) + 1
+
+    def record_phase(self, name: str, seconds: float):
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                self.phases[name] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.phases.clear()
+
+    def count(self, metric: str, **labels) -> int:
+        """Sum of a counter over the label values not given."""
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(n for (name, lbl), n in self.counters.items() if name == metric and wanted <= set(lbl))
+
+    def rates(self) -> Dict[str, Optional[float]]:
+        """Offer and fulfilment ratios (None until there is something to divide by)."""
+        offers = self.count("offers")
+        initial_rejected = self.count("offers", type="initial", outcome="rejected")
+        settled = self.count("fulfillments")
+        ratio = lambda n, d: n / d if d else None
+        return {
+            "accept_rate": ratio(self.count("offers", outcome="accepted"), offers),
+            "reject_rate": ratio(self.count("offers", outcome="rejected"), offers),
+            "counter_rate": ratio(self.count("offers", type="counter"), initial_rejected),
+            "fulfillment_failure_rate": ratio(settled - self.count("fulfillments", outcome="fulfilled"), settled),
+        }
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = {name + _labels(lbl): n for (name, lbl), n in sorted(self.counters.items())}
+            phases = {name: {"calls": calls, "total_s": total, "mean_s": total / calls, "max_s": slowest}
+                      for name, (calls, total, slowest) in sorted(self.phases.items())}
+        return {"counters": counters, "phases": phases, "rates": self.rates()}
+
+    def prometheus(self, prefix: str = "cefo") -> str:
+        """The metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = dict(self.counters)
+            phases = {name: list(stats) for name, stats in self.phases.items()}
+        lines = []
+        for metric, help_text in COUNTERS.items():
+            name = f"{prefix}_{metric}_total"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            series = sorted((lbl, n) for (m, lbl), n in counters.items() if m == metric)
+            for lbl, n in series or [((), 0)]:
+                lines.append(f"{name}{_labels(lbl)} {n}")
+        name = f"{prefix}_phase_seconds"
+        lines += [f"# HELP {name} Wall time spent in each episode phase.", f"# TYPE {name} summary"]
+        for phase, (calls, total, _) in sorted(phases.items()):
+            lines.append(f'{name}_sum{{phase="{phase}"}} {total:.9f}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {calls}')
+        name = f"{prefix}_phase_max_seconds"
+        lines += [f"# HELP {name} Slowest single run of each episode phase.", f"# TYPE {name} gauge"]
+        for phase, (_, _, slowest) in sorted(phases.items()):
+            lines.append(f'{name}{{phase="{phase}"}} {slowest:.9f}')
+        return "\n".join(lines) + "\n"
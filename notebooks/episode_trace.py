@@ -0,0 +1,311 @@
+"""Columnar, chunked on-disk trace of a CEFO run, replayed through memory maps.
+
+A trace directory holds
+
+    meta.json                   agents, capacity, chunk size, event kinds, episodes written
+    chunk_00000.cols            every typed column of the first `chunk_size` episodes
+    chunk_00001.cols ...
+
+Ragged per-episode data (loads, schedules, commitments, events) is stored CSR
+style: a `<group>_ptr` array of n+1 positions into flat value columns, so
+episode i of a chunk is the slice ptr[i]:ptr[i+1]. Per-agent values are dense
+[n, agents] arrays. A chunk file is a JSON column table (name, dtype, shape,
+byte offset) followed by the columns' bytes; TraceReader memory-maps the file
+and views each column in place, so seeking to an episode touches only that
+episode's slices, never the whole run.
+
+Commitments are not re-embedded every episode. Episode k stores the commitments
+it settled (final state) and the ones it created (still open).
+"""
+import ast
+import json
+import os
+from dataclasses import asdict, replace
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from CEFO import EVENT_TEMPLATES, Commitment, Event
+
+_COMMITMENT_INT_FIELDS = ("shift_min", "moved_students", "created_episode", "due_episode", "times_missed")
+
+
+_ALIGN = 64
+
+
+def _chunk_file(path: str, chunk: int) -> str:
+    return os.path.join(path, f"chunk_{chunk:05d}.cols")
+
+
+def _write_chunk(target: str, cols: Dict[str, np.ndarray]):
+    """Writes all of a chunk's columns to one file and renames it into place.
+
+    A reader maps either the previous version of the chunk or this one, never
+    a mix of both.
+    """
+    table, offset = {}, 0
+    for name, array in cols.items():
+        table[name] = (array.dtype.str, array.shape, offset)
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps(table).encode("utf-8")
+    start = -(-(8 + len(header)) // _ALIGN) * _ALIGN
+    with open(target + ".tmp", "wb") as f:
+        f.write(np.uint64(len(header)).tobytes() + header)
+        for name, array in cols.items():
+            f.seek(start + table[name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+    os.replace(target + ".tmp", target)
+
+
+def _map_chunk(target: str) -> Dict[str, np.ndarray]:
+    raw = np.memmap(target, dtype=np.uint8, mode="r")
+    size = int(raw[:8].view(np.uint64)[0])
+    table = json.loads(bytes(raw[8:8 + size]).decode("utf-8"))
+    start = -(-(8 + size) // _ALIGN) * _ALIGN
+    cols = {}
+    for name, (dtype, shape, offset) in table.items():
+        dtype = np.dtype(dtype)
+        at = start + offset
+        cols[name] = raw[at:at + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+    return cols
+
+
+def _ptr(lengths: List[int]) -> np.ndarray:
+    ptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=ptr[1:])
+    return ptr
+
+
+def _pack_strings(strings: List[str]):
+    """Ragged utf-8 column: (positions int64[n+1], bytes uint8)."""
+    encoded = [s.encode("utf-8") for s in strings]
+    return _ptr([len(b) for b in encoded]), np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _unpack_string(ptr: np.ndarray, blob: np.ndarray, i: int) -> str:
+    return bytes(blob[ptr[i]:ptr[i + 1]]).decode("utf-8")
+
+
+class TraceWriter:
+    """Appends episodes to a trace directory, one chunk of `chunk_size` episodes at a time.
+
+    flush() writes the chunk in progress (rewriting it if it was flushed before)
+    and publishes the episode count in meta.json, so a reader can follow a run live.
+    """
+    def __init__(self, path: str, classrooms, capacity: int, chunk_size: int = 64):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.agent_ids = [c.id for c in classrooms]
+        self._agent_index = {aid: i for i, aid in enumerate(self.agent_ids)}
+        self.event_kinds = sorted(EVENT_TEMPLATES)
+        self._kind_code = {k: i for i, k in enumerate(self.event_kinds)}
+        self.meta = {
+            "agents": [{"id": c.id, "personality": c.personality, "is_stubborn": c.is_stubborn,
+                        "utility_threshold": c.utility_threshold} for c in classrooms],
+            "capacity": capacity,
+            "chunk_size": chunk_size,
+            "event_kinds": self.event_kinds,
+            "first_episode": None,
+            "episodes": 0,
+        }
+        self._rows: List[Dict] = []
+        os.makedirs(path, exist_ok=True)
+        self._write_meta()
+
+    def __len__(self):
+        return self.meta["episodes"] + len(self._rows)
+
+    def record_episode(self, episode: int, ledger, classrooms, commitments, events: Iterable[Event] = ()):
+        """Captures the end-of-episode state of one run.
+
+        `ledger` is the SlotLedger, `commitments` the CommitmentLedger (after
+        the episode's close_episode), `events` whatever the episode emitted.
+        """
+        first = self.meta["first_episode"]
+        if first is None:
+            self.meta["first_episode"] = first = episode
+        if episode != first + len(self):
+            raise ValueError(f"episode {episode} recorded out of order, expected {first + len(self)}")
+        settled = commitments.last_settled
+        created = [com for com in commitments.open() if com.created_episode == episode]
+        self._rows.append({
+            "episode": episode,
+            "loads": sorted(ledger.items()),
+            "schedules": [(i, off, cnt) for i, c in enumerate(classrooms) for off, cnt in c.planned_slots],
+            # copies: open commitments keep changing after this episode
+            "commitments": [replace(com) for com in settled + created],
+            "events": [(e.kind, e.data) for e in events],
+            "reputation": [c.reputation for c in classrooms],
+            "violations": [c.violations for c in classrooms],
+            "missed": [c.missed_commitments for c in classrooms],
+        })
+        if len(self._rows) == self.chunk_size:
+            self.flush()
+            self.meta["episodes"] += len(self._rows)
+            self._rows = []
+            self._write_meta()
+
+    def flush(self):
+        if not self._rows:
+            return
+        chunk = self.meta["episodes"] // self.chunk_size
+        _write_chunk(_chunk_file(self.path, chunk), self._columns(self._rows))
+        # the chunk is in place before meta.json counts its rows; partial chunks are
+        # published by count only, the writer keeps their rows
+        self._write_meta(episodes=self.meta["episodes"] + len(self._rows))
+
+    def close(self):
+        self.flush()
+
+    def _write_meta(self, episodes: Optional[int] = None):
+        meta = dict(self.meta, episodes=self.meta["episodes"] if episodes is None else episodes)
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def _columns(self, rows: List[Dict]) -> Dict[str, np.ndarray]:
+        cols = {"episode": np.array([r["episode"] for r in rows], dtype=np.int32)}
+
+        loads = [r["loads"] for r in rows]
+        cols["load_ptr"] = _ptr([len(l) for l in loads])
+        cols["load_offset"] = np.array([off for l in loads for off, _ in l], dtype=np.int32)
+        cols["load_count"] = np.array([cnt for l in loads for _, cnt in l], dtype=np.int32)
+
+        sched = [r["schedules"] for r in rows]
+        cols["sched_ptr"] = _ptr([len(s) for s in sched])
+        flat = [entry for s in sched for entry in s]
+        cols["sched_agent"] = np.array([a for a, _, _ in flat], dtype=np.int32)
+        cols["sched_offset"] = np.array([o for _, o, _ in flat], dtype=np.int32)
+        cols["sched_count"] = np.array([n for _, _, n in flat], dtype=np.int32)
+
+        coms = [r["commitments"] for r in rows]
+        cols["com_ptr"] = _ptr([len(c) for c in coms])
+        flat = [com for c in coms for com in c]
+        cols["com_proposer"] = np.array([self._agent_index[c.proposer] for c in flat], dtype=np.int32)
+        cols["com_acceptor"] = np.array([self._agent_index[c.acceptor] for c in flat], dtype=np.int32)
+        for field in _COMMITMENT_INT_FIELDS:
+            cols["com_" + field] = np.array([getattr(c, field) for c in flat], dtype=np.int32)
+        cols["com_fulfilled"] = np.array([c.fulfilled for c in flat], dtype=np.bool_)
+        cols["com_fulfilled_episode"] = np.array(
+            [-1 if c.fulfilled_episode is None else c.fulfilled_episode for c in flat], dtype=np.int32)
+        cols["com_id_ptr"], cols["com_id"] = _pack_strings([c.commitment_id for c in flat])
+
+        evts = [r["events"] for r in rows]
+        cols["evt_ptr"] = _ptr([len(e) for e in evts])
+        flat = [e for es in evts for e in es]
+        cols["evt_kind"] = np.array([self._kind_code[k] for k, _ in flat], dtype=np.int16)
+        # payloads are Python literals (int-keyed dicts, tuples), decoded only on replay
+        cols["evt_data_ptr"], cols["evt_data"] = _pack_strings([repr(d) for _, d in flat])
+
+        for name in ("reputation", "violations", "missed"):
+            dtype = np.float64 if name == "reputation" else np.int32
+            cols[name] = np.array([r[name] for r in rows], dtype=dtype).reshape(len(rows), len(self.agent_ids))
+        return cols
+
+
+class TraceReader:
+    """Random access to a trace directory; columns are memory-mapped per chunk on first use."""
+    def __init__(self, path: str):
+        self.path = path
+        self._chunks: Dict[int, Dict[str, np.ndarray]] = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads meta.json, picking up episodes a live writer has flushed since."""
+        with open(os.path.join(self.path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.agent_ids = [a["id"] for a in self.meta["agents"]]
+        self.chunk_size = self.meta["chunk_size"]
+        self.event_kinds = self.meta["event_kinds"]
+
+    def __len__(self):
+        return self.meta["episodes"]
+
+    @property
+    def episodes(self) -> range:
+        first = self.meta["first_episode"] or 1
+        return range(first, first + len(self))
+
+    def _locate(self, episode: int):
+        i = episode - (self.meta["first_episode"] or 1)
+        if not 0 <= i < len(self):
+            self.refresh()
+            if not 0 <= i < len(self):
+                raise IndexError(f"episode {episode} not in trace ({self.episodes})")
+        chunk, row = divmod(i, self.chunk_size)
+        cols = self._chunks.get(chunk)
+        if cols is None or row >= len(cols["episode"]):
+            # first use, or a chunk that was still filling up when it was mapped
+            cols = self._chunks[chunk] = _map_chunk(_chunk_file(self.path, chunk))
+        return cols, row
+
+    @staticmethod
+    def _span(cols, group: str, row: int) -> slice:
+        ptr = cols[group + "_ptr"]
+        return slice(int(ptr[row]), int(ptr[row + 1]))
+
+    def slot_map(self, episode: int) -> Dict[int, int]:
+        cols, row = self._locate(episode)
+        s = self._span(cols, "load", row)
+        return dict(zip(cols["load_offset"][s].tolist(), cols["load_count"][s].tolist()))
+
+    def schedules(self, episode: int) -> Dict[str, List[tuple]]:
+        cols, row = self._locate(episode)
+        s = self._span(cols, "sched", row)
+        out = {aid: [] for aid in self.agent_ids}
+        for a, off, cnt in zip(cols["sched_agent"][s].tolist(), cols["sched_offset"][s].tolist(),
+                               cols["sched_count"][s].tolist()):
+            out[self.agent_ids[a]].append((off, cnt))
+        return out
+
+    def commitments(self, episode: int) -> List[Commitment]:
+        """Commitments settled or created in `episode`, as they stood at its end."""
+        cols, row = self._locate(episode)
+        out = []
+        s = self._span(cols, "com", row)
+        for k in range(s.start, s.stop):
+            fulfilled_ep = int(cols["com_fulfilled_episode"][k])
+            out.append(Commitment(
+                commitment_id=_unpack_string(cols["com_id_ptr"], cols["com_id"], k),
+                proposer=self.agent_ids[cols["com_proposer"][k]],
+                acceptor=self.agent_ids[cols["com_acceptor"][k]],
+                fulfilled=bool(cols["com_fulfilled"][k]),
+                fulfilled_episode=None if fulfilled_ep < 0 else fulfilled_ep,
+                **{f: int(cols["com_" + f][k]) for f in _COMMITMENT_INT_FIELDS}))
+        return out
+
+    def events(self, episode: int) -> List[Event]:
+        cols, row = self._locate(episode)
+        s = self._span(cols, "evt", row)
+        return [Event(self.event_kinds[kind], episode,
+                      ast.literal_eval(_unpack_string(cols["evt_data_ptr"], cols["evt_data"], k)))
+                for k, kind in zip(range(s.start, s.stop), cols["evt_kind"][s].tolist())]
+
+    def agent_column(self, name: str, episode: int) -> Dict[str, float]:
+        """Per-agent value ("reputation", "violations" or "missed") at the end of `episode`."""
+        cols, row = self._locate(episode)
+        return dict(zip(self.agent_ids, cols[name][row].tolist()))
+
+    def state(self, episode: int) -> Dict:
+        """The demo server's per-episode payload, rebuilt from the trace."""
+        reputation = self.agent_column("reputation", episode)
+        missed = self.agent_column("missed", episode)
+        return {
+            "episode": episode,
+            "slot_map": self.slot_map(episode),
+            "schedules": self.schedules(episode),
+            "commitments": [asdict(c) for c in self.commitments(episode)],
+            "capacity": self.meta["capacity"],
+            "logs": [line for e in self.events(episode) for line in e.text().splitlines() if line],
+            "agent_info": {
+                a["id"]: {
+                    "personality": a["personality"],
+                    "reputation": reputation[a["id"]],
+                    "is_stubborn": a["is_stubborn"],
+                    "utility_threshold": a["utility_threshold"],
+                    "violations": missed[a["id"]],
+                } for a in self.meta["agents"]
+            },
+        }
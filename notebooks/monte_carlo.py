@@ -0,0 +1,135 @@
+"""Monte Carlo over attendance: how often does the campus stay congested?
+
+cfg["attendance"] gives each classroom's expected headcount. Every sample
+draws fresh headcounts per classroom and episode from cfg["attendance_model"]
+and runs the full protocol (broadcast, fulfilment, negotiation rounds) on them.
+All samples advance together in a BatchSimulator, one batched step per
+protocol stage, so 10k samples take seconds rather than 10k scalar runs.
+
+    attendance_model = {"kind": "poisson"}                         # variance = mean
+                       {"kind": "normal", "cv": 0.15}              # or "sd": per classroom / scalar
+                       {"kind": "binomial", "enrolled": [...]}     # each enrolled student shows up with p = mean / enrolled
+                       {"kind": "fixed"}                           # the scalar engine's behaviour
+
+    result = run_monte_carlo(cfg, num_samples=10_000, num_episodes=10, seed=0)
+    result.overload_probability        # per offset, after negotiation, over all episodes
+    result.peak_load_quantiles()       # {0.5: ..., 0.9: ..., 0.99: ...}
+    result.reputation_quantiles()      # per classroom
+
+Personalities and stubborn classrooms are those of the campus build_agents()
+creates from the same config, so only attendance varies between samples.
+Moves use the config's own time_offsets window; configs BatchSimulator cannot
+reproduce (other negotiation protocols, finer time grids, the central
+fallback) raise ValueError.
+"""
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from batch_simulation import PERSONALITIES, BatchSimulator
+from CEFO import build_agents
+
+QUANTILES = (0.05, 0.5, 0.9, 0.95, 0.99)
+
+
+def sample_attendance(model: Dict, mean: Sequence[float], size: tuple, rng: np.random.Generator) -> np.ndarray:
+    """Headcounts of shape size + (len(mean),), drawn around each classroom's `mean`."""
+    mean = np.asarray(mean, dtype=float)
+    shape = tuple(size) + mean.shape
+    kind = model.get("kind", "poisson")
+    if kind == "fixed":
+        return np.broadcast_to(mean.round().astype(np.int64), shape).copy()
+    if kind == "poisson":
+        return rng.poisson(mean, shape)
+    if kind == "normal":
+        sd = np.asarray(model["sd"], dtype=float) if "sd" in model else mean * model.get("cv", 0.1)
+        return np.maximum(0, rng.normal(mean, sd, shape).round()).astype(np.int64)
+    if kind == "binomial":
+        enrolled = np.asarray(model["enrolled"], dtype=np.int64)
+        if (enrolled < mean).any():
+            raise ValueError("enrolled must be at least the expected attendance of every classroom")
+        return rng.binomial(enrolled, mean / np.maximum(enrolled, 1), shape)
+    raise ValueError(f"unknown attendance model {kind!r}")
+
+
+@dataclass
+class MonteCarloResult:
+    offsets: List[int]                    # column order of the per-offset arrays
+    per_batch: int
+    overloaded: np.ndarray                # (episodes, offsets): fraction of samples over capacity after negotiation
+    congested: np.ndarray                 # (episodes,): fraction of samples with any offset over capacity
+    peak_load: np.ndarray                 # (episodes, samples)
+    rounds: np.ndarray                    # (episodes, samples): negotiation rounds used
+    reputation: np.ndarray                # (samples, classrooms) at the end of the run
+    violations: np.ndarray                # (samples,)
+    classroom_ids: List[str]
+
+    @property
+    def overload_probability(self) -> Dict[int, float]:
+        """P(offset over capacity after negotiation), over all samples and episodes."""
+        return {off: float(p) for off, p in zip(self.offsets, self.overloaded.mean(axis=0))}
+
+    @property
+    def congestion_probability(self) -> float:
+        return float(self.congested.mean())
+
+    def peak_load_quantiles(self, qs: Sequence[float] = QUANTILES) -> Dict[float, float]:
+        return dict(zip(qs, np.quantile(self.peak_load, qs).tolist()))
+
+    def reputation_quantiles(self, qs: Sequence[float] = QUANTILES) -> Dict[str, Dict[float, float]]:
+        q = np.quantile(self.reputation, qs, axis=0)
+        return {cid: dict(zip(qs, q[:, a].tolist())) for a, cid in enumerate(self.classroom_ids)}
+
+    def reputation_histogram(self, bins: int = 10):
+        """(counts per classroom, bin edges) of final reputations over [0, 1]."""
+        edges = np.linspace(0.0, 1.0, bins + 1)
+        counts = np.stack([np.histogram(self.reputation[:, a], edges)[0] for a in range(self.reputation.shape[1])])
+        return counts, edges
+
+    def summary(self) -> Dict:
+        return {
+            "congestion_probability": self.congestion_probability,
+            "overload_probability": self.overload_probability,
+            "peak_load_quantiles": self.peak_load_quantiles(),
+            "mean_reputation": dict(zip(self.classroom_ids, self.reputation.mean(axis=0).tolist())),
+            "p_reputation_below_0.5": dict(zip(self.classroom_ids, (self.reputation < 0.5).mean(axis=0).tolist())),
+            "mean_violations": float(self.violations.mean()),
+        }
+
+
+def run_monte_carlo(cfg: Dict, num_samples: int, num_episodes: int, seed: int = 0,
+                    model: Optional[Dict] = None) -> MonteCarloResult:
+    """Runs num_samples attendance draws of num_episodes episodes each, all in one batch."""
+    model = model if model is not None else cfg.get("attendance_model", {"kind": "poisson"})
+    _, _, classrooms, _ = build_agents(cfg, rng=random.Random(cfg.get("random_seed")))
+    personalities = [PERSONALITIES.index(c.personality) for c in classrooms]
+    stubborn = [c.is_stubborn for c in classrooms]
+    mean = cfg["attendance"][:len(classrooms)]
+
+    rng = np.random.default_rng(seed)
+    draws = sample_attendance(model, mean, (num_episodes, num_samples), rng)
+    sim = BatchSimulator(cfg, draws[0], np.tile(personalities, (num_samples, 1)), stubborn,
+                         utility_threshold=[c.utility_threshold for c in classrooms])
+    overloaded, congested = [], []
+    for ep in range(1, num_episodes + 1):
+        sim.run_episode(ep, draws[ep - 1])
+        overloaded.append((sim.loads > sim.per_batch).mean(axis=0))
+        congested.append(sim.congested().mean())
+
+    # columns can be appended mid-run (fulfilment outside the window); report them in offset order
+    width = len(sim.offsets)
+    order = np.argsort(sim.offsets, kind="stable")
+    overloaded = np.stack([np.pad(o, (0, width - o.size)) for o in overloaded])[:, order]
+    return MonteCarloResult(
+        offsets=[sim.offsets[j] for j in order],
+        per_batch=sim.per_batch,
+        overloaded=overloaded,
+        congested=np.array(congested),
+        peak_load=np.stack(sim.peak_load),
+        rounds=np.stack(sim.rounds_used),
+        reputation=sim.reputation.copy(),
+        violations=sim.violations.copy(),
+        classroom_ids=[c.id for c in classrooms],
+    )
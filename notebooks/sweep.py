@@ -0,0 +1,116 @@
+"""Parameter sweeps over the CEFO engine on a process pool.
+
+Every run builds its own agents from its own config and a private
+random.Random(seed), so a run's result depends only on (config, seed) and
+never on which worker executed it or how many workers there were.
+"""
+import copy
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from CEFO import CommitmentLedger, EpisodeCache, build_agents, run_episode
+
+
+@dataclass(frozen=True)
+class RunSummary:
+    run_index: int
+    seed: int
+    params: Tuple[Tuple[str, object], ...]   # the swept values, as (dotted key, value)
+    episodes: int
+    rounds_to_clear: Tuple[Optional[int], ...]  # per episode; None if congestion outlived max_negotiation_rounds
+    peak_load: int
+    commitments_created: int
+    commitments_fulfilled: int
+    reputation_drift: float                  # mean final reputation minus the starting 1.0
+    min_reputation: float
+
+
+def _set(cfg: Dict, dotted_key: str, value):
+    *path, leaf = dotted_key.split(".")
+    for key in path:
+        cfg = cfg[key]
+    cfg[leaf] = value
+
+
+def config_grid(base: Dict, axes: Dict[str, Iterable]) -> List[Tuple[Dict, Tuple]]:
+    """Cartesian product of `axes` applied to copies of `base`.
+
+    Axis keys address nested entries with dots, e.g. "bottleneck.capacity_per_minute".
+    Returns (config, params) pairs, params being the swept (key, value) tuple.
+    """
+    keys = list(axes)
+    out = []
+    for values in itertools.product(*(list(axes[k]) for k in keys)):
+        cfg = copy.deepcopy(base)
+        for k, v in zip(keys, values):
+            _set(cfg, k, v)
+        out.append((cfg, tuple(zip(keys, values))))
+    return out
+
+
+def run_one(run_index: int, cfg: Dict, seed: int, num_episodes: int, params: Tuple = ()) -> RunSummary:
+    """Runs a single configuration in isolation and condenses it to a RunSummary."""
+    rng = random.Random(seed)
+    # no sinks on the event bus, so nothing is formatted or kept
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=rng)
+    commitments = CommitmentLedger()
+    cache = EpisodeCache()
+    episodes = []
+    for ep in range(1, num_episodes + 1):
+        summary = run_episode(ep, cfg, B, classrooms, agents_by_id, commitments, ledger, cache=cache)
+        episodes.append(summary)
+        if summary["steady"]:
+            # every later episode starts from this same state, so it repeats this one
+            episodes += [dict(summary, episode=e) for e in range(ep + 1, num_episodes + 1)]
+            break
+    reputations = [c.reputation for c in classrooms]
+    return RunSummary(
+        run_index=run_index,
+        seed=seed,
+        params=params,
+        episodes=num_episodes,
+        rounds_to_clear=tuple(e["rounds"] if e["cleared"] else None for e in episodes),
+        peak_load=max((e["peak_load"] for e in episodes), default=0),
+        commitments_created=sum(e["commitments_created"] for e in episodes),
+        commitments_fulfilled=sum(e["commitments_fulfilled"] for e in episodes),
+        reputation_drift=sum(reputations) / len(reputations) - 1.0,
+        min_reputation=min(reputations),
+    )
+
+
+def _run_job(job) -> RunSummary:
+    return run_one(*job)
+
+
+def run_sweep(configs, seeds: Optional[Iterable[int]] = None, num_episodes: int = 5,
+              max_workers: Optional[int] = None, chunksize: int = 1) -> Iterator[RunSummary]:
+    """Fans every (config, seed) pair out over a ProcessPoolExecutor.
+
+    `configs` is a list of config dicts or the (config, params) pairs from
+    config_grid. Without `seeds`, each config runs once with its own
+    "random_seed". Summaries stream back in submission order as they finish;
+    max_workers=0 runs everything in-process.
+    """
+    jobs = []
+    for cfg in configs:
+        cfg, params = cfg if isinstance(cfg, tuple) else (cfg, ())
+        for seed in (seeds if seeds is not None else [cfg["random_seed"]]):
+            jobs.append((len(jobs), cfg, seed, num_episodes, params))
+    if max_workers == 0:
+        yield from map(_run_job, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        yield from pool.map(_run_job, jobs, chunksize=chunksize)
+
+
+def summaries_to_rows(summaries: Iterable[RunSummary]) -> List[Dict]:
+    """Flattens summaries (swept params become columns) for a DataFrame or CSV."""
+    rows = []
+    for s in summaries:
+        row = asdict(s)
+        row.update(dict(row.pop("params")))
+        rows.append(row)
+    return rows
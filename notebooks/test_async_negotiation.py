@@ -0,0 +1,58 @@
+import random
+from dataclasses import astuple
+
+import pytest
+
+from async_negotiation import AsyncNegotiationEngine
+from benchmarks import scaled_config
+from CEFO import CommitmentLedger, EventBus, RingBufferSink, build_agents, run_episode, with_time_resolution
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+}
+CONFIGS = {
+    "default": CFG,
+    "dense": dict(CFG, compact_schedules=True),
+    "fine_grid": with_time_resolution(CFG, 30, 6),
+    "scaled": scaled_config(120, 9, 5),
+}
+
+
+def run(cfg, engine, episodes=12, seed=3):
+    sink = RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(seed), events=EventBus(sink))
+    commitments = CommitmentLedger()
+    if engine == "async":
+        runner = AsyncNegotiationEngine(cfg, B, classrooms, agents_by_id, commitments, ledger)
+        summaries = [runner.run_episode(ep) for ep in range(1, episodes + 1)]
+    else:
+        summaries = [run_episode(ep, cfg, B, classrooms, agents_by_id, commitments, ledger)
+                     for ep in range(1, episodes + 1)]
+    agents = [(c.planned_slots, c.reputation, c.violations, c.missed_commitments, len(c.commitment_history))
+              for c in classrooms]
+    return summaries, agents, [astuple(c) for c in commitments], [e.text() for e in sink]
+
+
+@pytest.mark.parametrize("protocol", ["pairwise", "n_way", "auction"])
+@pytest.mark.parametrize("name", sorted(CONFIGS))
+def test_async_matches_sync(name, protocol):
+    cfg = dict(CONFIGS[name], negotiation_protocol=protocol)
+    sync, async_ = run(cfg, "sync"), run(cfg, "async")
+    assert sync[0] == async_[0]
+    assert sync[1] == async_[1]
+    assert sync[2] == async_[2]
+    assert sync[3] == async_[3]
+
+
+def test_agents_do_not_accumulate_commitments():
+    _, agents, commitments, _ = run(CFG, "async", episodes=30)
+    assert commitments
+    assert all(history == 0 for *_, history in agents)
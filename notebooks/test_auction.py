@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+from CEFO import (BottleneckAgent, CommitmentLedger, EventBus, RingBufferSink, auction, build_agents,
+                  compute_slot_map, run_episode, with_time_resolution)
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},  # 80 per batch
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+    "negotiation_protocol": "auction",
+}
+
+
+def classroom(personality, slots, reputation=1.0):
+    _, _, classrooms, _ = build_agents(dict(CFG, num_classrooms=1, attendance=[sum(n for _, n in slots)]),
+                                       rng=random.Random(0))
+    c = classrooms[0]
+    c.personality, c.reputation, c.planned_slots = personality, reputation, slots
+    return c
+
+
+@pytest.mark.parametrize("personality, targets", [
+    ("flexible", [0, -2, 2, -4, 4, -6, 6]),
+    ("prefers_early", [0, -2, -4, -6]),
+    ("prefers_late", [0, 2, 4, 6]),
+])
+def test_bids_cover_the_acceptable_moves(personality, targets):
+    c = classroom(personality, [(0, 50)], reputation=0.5)
+    bids = c.submit_bids(CFG["time_offsets"])
+    assert [(src, cnt, target) for src, cnt, target, _ in bids] == [(0, 50, t) for t in targets]
+    # staying is worth the proposer's 0.3, a move on the preferred side 0.5 more; all weighted by reputation
+    values = {target: value for _, _, target, value in bids}
+    assert values[0] == pytest.approx(0.15)
+    assert all(values[t] == pytest.approx(0.15 if personality == "flexible" else 0.4) for t in targets[1:])
+
+
+def test_empty_slots_do_not_bid():
+    c = classroom("flexible", [(0, 0), (2, 10)])
+    assert {src for src, *_ in c.submit_bids(CFG["time_offsets"])} == {2}
+
+
+def test_best_bids_are_served_first_and_spill_over():
+    B = BottleneckAgent(CFG)
+    bids = [
+        ("C1", [(0, 100, 0, 0.3), (0, 100, -2, 0.8), (0, 100, -4, 0.8)]),
+        ("C2", [(0, 70, 0, 0.3), (0, 70, -2, 0.8)]),
+        ("C3", [(2, 30, 2, 0.9)]),
+    ]
+    awards = B.clear_auction(bids)
+    assert awards == [
+        ("C3", 2, 2, 30),
+        # C1 and C2 tie at -2: C1 comes first and takes all of it, spilling into -4
+        ("C1", 0, -2, 80),
+        ("C1", 0, -4, 20),
+        ("C2", 0, 0, 70),
+    ]
+
+
+def test_unplaced_students_stay_over_capacity():
+    B = BottleneckAgent(CFG)
+    awards = B.clear_auction([("C1", [(0, 100, 0, 0.3)]), ("C2", [(0, 100, 0, 0.3), (0, 100, 2, 0.3)])])
+    # C1 fills offset 0 first; C2 gets 2, and what is left of both stays home
+    assert awards == [("C1", 0, 0, 80), ("C2", 0, 2, 80), ("C1", 0, 0, 20), ("C2", 0, 0, 20)]
+
+
+def test_a_batch_occupies_its_whole_span():
+    B = BottleneckAgent(CFG)
+    bids = [("C1", [(0, 60, 0, 0.5)]), ("C2", [(4, 60, 2, 0.4), (4, 60, 4, 0.3)])]
+    # with a span of 3 ticks, a batch at 2 overlaps the one at 0; C2 fits 20 there and the rest at 4
+    assert B.clear_auction(bids, span=3) == [("C1", 0, 0, 60), ("C2", 4, 2, 20), ("C2", 4, 4, 40)]
+
+
+@pytest.mark.parametrize("cfg", [CFG, with_time_resolution(CFG, 30, 6)], ids=["minutes", "seconds"])
+@pytest.mark.parametrize("seed", range(5))
+def test_auction_conserves_students(seed, cfg):
+    sink = RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(seed), events=EventBus(sink))
+    msg = B.broadcast_capacity(cfg["attendance"], "test")
+    for c in classrooms:
+        c.on_capacity_broadcast(msg)
+    created = auction(1, cfg, B, classrooms, B.events)
+    assert [sum(n for _, n in c.planned_slots) for c in classrooms] == cfg["attendance"]
+    assert dict(ledger.items()) == {off: load for off, load in compute_slot_map(classrooms).items() if load}
+    kinds = [e.kind for e in sink]
+    assert kinds.count("auction") == 1 and kinds.count("committed") == len(created)
+    for com in created:
+        assert com.proposer != com.acceptor and com.moved_students > 0 and com.due_episode == 2
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_auction_runs_replace_negotiation_rounds(seed):
+    sink = RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(seed), events=EventBus(sink))
+    commitments = CommitmentLedger()
+    for ep in range(1, 6):
+        run_episode(ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+    kinds = [e.kind for e in sink]
+    # each congested episode holds one auction as its only round
+    assert kinds.count("auction") == kinds.count("round_start") > 0
+    assert "propose" not in kinds and "propose_shares" not in kinds
+    assert kinds.count("committed") == commitments.created
@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+import pytest
+
+from batch_simulation import PERSONALITIES, BatchSimulator, random_personalities
+from CEFO import CommitmentLedger, build_agents, run_episode
+
+BASE = {
+    "episode_base_name": "test",
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+}
+WINDOWS = [
+    [0, -2, 2, -4, 4, -6, 6],
+    [0, -1, 1],
+    [0, 3, -3, 9, -9],
+    [-2, 2, -4, 4],
+]
+
+
+def scalar_run(cfg, attendance, personalities, stubborn, episodes):
+    """Per-episode (slot map, schedules, reputations) of one scenario on the scalar engine."""
+    cfg = dict(cfg, attendance=list(attendance), num_classrooms=len(attendance))
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(0))
+    for c, p, s in zip(classrooms, personalities, stubborn):
+        c.personality, c.is_stubborn = PERSONALITIES[p], bool(s)
+    commitments = CommitmentLedger()
+    out = []
+    for ep in range(1, episodes + 1):
+        run_episode(ep, cfg, B, classrooms, agents_by_id, commitments, ledger)
+        out.append((dict(sorted(ledger.items())), [c.planned_slots for c in classrooms],
+                    [c.reputation for c in classrooms]))
+    return out, commitments.created
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("threshold", [1, 2])
+def test_matches_scalar_engine(window, threshold):
+    cfg = dict(BASE, time_offsets=window, violation_threshold=threshold)
+    rng = np.random.default_rng(len(window) * 10 + threshold)
+    n, agents, episodes = 40, 6, 6
+    attendance = rng.integers(0, 120, size=(n, agents))
+    personalities = random_personalities(n, agents, rng)
+    stubborn = rng.random((n, agents)) < 0.15
+    sim = BatchSimulator(cfg, attendance, personalities, stubborn)
+    batch = []
+    for ep in range(1, episodes + 1):
+        sim.run_episode(ep)
+        batch.append([(sim.slot_map(i), sim.schedules(i), sim.reputation[i].tolist()) for i in range(n)])
+    for i in range(n):
+        scalar, created = scalar_run(cfg, attendance[i], personalities[i], stubborn[i], episodes)
+        assert scalar == [batch[ep][i] for ep in range(episodes)], f"scenario {i}"
+        assert created == sim.commitments_created[i]
+
+
+def test_moves_stay_near_window():
+    cfg = dict(BASE, time_offsets=[0, -1, 1])
+    rng = np.random.default_rng(0)
+    sim = BatchSimulator(cfg, rng.integers(40, 120, size=(50, 6)), random_personalities(50, 6, rng)).run(5)
+    # negotiation only moves students within the window; fulfilment lands at a first slot + |shift| <= 1 + 2
+    assert set(sim.offsets) <= {-1, 0, 1, 2, 3}
+
+
+@pytest.mark.parametrize("option", [{"negotiation_protocol": "n_way"}, {"negotiation_protocol": "auction"},
+                                    {"time_resolution_s": 30}, {"central_fallback": True}])
+def test_rejects_configs_it_cannot_reproduce(option):
+    with pytest.raises(ValueError):
+        BatchSimulator(dict(BASE, **option), np.full((2, 3), 50), np.zeros((2, 3), int))
+
+
+def test_accepts_the_pairwise_defaults():
+    BatchSimulator(dict(BASE, negotiation_protocol="pairwise", time_resolution_s=120), np.full((2, 3), 50),
+                   np.zeros((2, 3), int))
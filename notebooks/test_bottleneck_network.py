@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from bottleneck_network import BottleneckNetwork, random_campus
+from CEFO import Commitment, EventBus, RingBufferSink
+
+
+def two_exits(attendance):
+    """C1 reaches only E1 and C2 only E2; each (exit, offset) pair takes 20 students."""
+    exit_ = {"capacity_per_minute": 10, "batch_duration_min": 2}
+    cfg = {
+        "episode_base_name": "test",
+        "time_offsets": [0, -2, 2],
+        "max_negotiation_rounds": 5,
+        "violation_threshold": 1,
+        "bottleneck": exit_,
+        "exits": [dict(exit_, id="E1"), dict(exit_, id="E2")],
+        "attendance": [attendance, 5],
+        "num_classrooms": 2,
+        "reachability": {"C1": ["E1"], "C2": ["E2"]},
+    }
+    net = BottleneckNetwork(cfg, rng=random.Random(0))
+    sink = RingBufferSink()
+    for c in net.classrooms:
+        c.events = EventBus(sink)
+        c.on_capacity_broadcast({})
+    return net, sink
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_spare_capacity_clears(seed):
+    cfg = random_campus(200, 40, seed=seed, base_cfg={"episode_base_name": "test"})
+    net = BottleneckNetwork(cfg, rng=random.Random(seed))
+    summaries = [net.run_episode(ep) for ep in range(1, 11)]
+    assert all(s["cleared"] for s in summaries[1:])
+    assert net.commitments.expired == 0
+    assert all(c.reputation == 1.0 for c in net.classrooms)
+
+
+def test_fulfilment_moves_every_owed_student_and_credits_the_acceptor():
+    net, sink = two_exits(30)
+    com = Commitment(None, "C1", "C2", 2, 30, 1, 2)
+    net.commitments.append(com)
+    net.fulfill(2)
+    c1, c2 = net.agents_by_id["C1"], net.agents_by_id["C2"]
+    # no single route has room for 30, so they are spread over both other offsets
+    assert c1.routes == {("E1", -2): 20, ("E1", 2): 10}
+    assert com.fulfilled and com.fulfilled_episode == 2
+    # the acceptor gets them at its first route shifted by |shift_min|, as far as there is room
+    assert c2.routes == {("E2", 0): 5, ("E2", 2): 20}
+    assert [e.kind for e in sink] == ["fulfilled"]
+
+
+def test_partial_fulfilment_is_a_miss():
+    net, sink = two_exits(50)
+    com = Commitment(None, "C1", "C2", 2, 50, 1, 2)
+    net.commitments.append(com)
+    net.fulfill(2)
+    c1 = net.agents_by_id["C1"]
+    assert sum(cnt for route, cnt in c1.routes.items() if route != ("E1", 0)) == 40
+    assert not com.fulfilled and com.times_missed == 1
+    assert c1.reputation == pytest.approx(0.8) and c1.violations == 1
+    assert [e.kind for e in sink] == ["fulfill_partial", "violation"]
+    assert net.agents_by_id["C2"].routes == {("E2", 0): 5}
+
+
+def test_stubborn_proposer_misses():
+    net, sink = two_exits(10)
+    net.agents_by_id["C1"].is_stubborn = True
+    com = Commitment(None, "C1", "C2", 2, 10, 1, 2)
+    net.commitments.append(com)
+    net.fulfill(2)
+    assert not com.fulfilled and com.times_missed == 1
+    assert [e.kind for e in sink] == ["fulfill_failed", "violation"]
@@ -0,0 +1,103 @@
+import itertools
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from CEFO import CommitmentLedger, EventBus, RingBufferSink, build_agents, run_episode
+from central_scheduler import (apply_assignment, move_cost, schedule_cost, score_against_optimum,
+                               solve_schedule)
+
+PERSONALITIES = ["prefers_early", "prefers_late", "flexible"]
+OFFSETS = [0, -2, 2]
+# what the solver charges per student left over capacity, in half-minute units
+OVERFLOW_COST = 1 + max(abs(o) for o in OFFSETS) * 3
+
+
+def campus(seed, n=3, most=5):
+    r = random.Random(seed)
+    return [SimpleNamespace(id=f"C{i+1}", personality=r.choice(PERSONALITIES), attendance=r.randint(0, most),
+                            planned_slots=[]) for i in range(n)]
+
+
+def splits(total, parts):
+    """Every way of putting `total` students into `parts` offsets."""
+    for cuts in itertools.combinations(range(total + parts - 1), parts - 1):
+        bounds = (-1,) + cuts + (total + parts - 1,)
+        yield [bounds[i + 1] - bounds[i] - 1 for i in range(parts)]
+
+
+def brute_force(classrooms, per_batch):
+    """Least displacement plus overflow charge over every assignment of every classroom."""
+    best = None
+    for choice in itertools.product(*(list(splits(c.attendance, len(OFFSETS))) for c in classrooms)):
+        loads = [sum(col) for col in zip(*choice)]
+        overflow = sum(max(0, load - per_batch) for load in loads)
+        cost = sum(cnt * move_cost(c.personality, off)
+                   for c, counts in zip(classrooms, choice) for off, cnt in zip(OFFSETS, counts))
+        total = cost + overflow * OVERFLOW_COST
+        best = total if best is None else min(best, total)
+    return best
+
+
+def check_assignment(assignment, classrooms, per_batch):
+    loads = {}
+    for c in classrooms:
+        slots = assignment.schedules[c.id]
+        assert sum(cnt for _, cnt in slots) == c.attendance
+        assert all(cnt > 0 for _, cnt in slots)
+        for off, cnt in slots:
+            loads[off] = loads.get(off, 0) + cnt
+    assert loads == {off: load for off, load in assignment.slot_map.items() if load}
+    # only the offset nearest 0 may be over capacity
+    assert all(load <= per_batch for off, load in loads.items() if off != 0)
+    assert assignment.overflow == max(0, loads.get(0, 0) - per_batch)
+    apply_assignment(assignment, classrooms)
+    assert schedule_cost(classrooms, per_batch) == (assignment.cost, assignment.overflow)
+
+
+@pytest.mark.parametrize("per_batch", [2, 4, 6])
+@pytest.mark.parametrize("seed", range(20))
+def test_solver_is_optimal(seed, per_batch):
+    classrooms = campus(seed)
+    assignment = solve_schedule(classrooms, OFFSETS, per_batch)
+    assert assignment.cost + assignment.overflow * OVERFLOW_COST == brute_force(classrooms, per_batch)
+    check_assignment(assignment, classrooms, per_batch)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_overflow_is_dearer_than_any_move(seed):
+    classrooms = campus(seed, n=4, most=30)
+    total = sum(c.attendance for c in classrooms)
+    per_batch = total // 4
+    assignment = solve_schedule(classrooms, OFFSETS, per_batch)
+    # every offset is filled before anyone is left over, whatever the displacement
+    assert assignment.overflow == max(0, total - per_batch * len(OFFSETS))
+    assert all(assignment.slot_map.get(off, 0) == per_batch for off in OFFSETS if off != 0)
+    check_assignment(assignment, classrooms, per_batch)
+
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 1,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fallback_clears_what_negotiation_left(seed):
+    cfg = dict(CFG, central_fallback=True)
+    sink = RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(seed), events=EventBus(sink))
+    run_episode(1, cfg, B, classrooms, agents_by_id, CommitmentLedger(), ledger)
+    assert [e.kind for e in sink].count("central_fallback") == 1
+    assert not ledger.congested
+    score = score_against_optimum(classrooms, cfg["time_offsets"], B.per_batch)
+    assert score["negotiated_overflow"] == score["optimal_overflow"] == 0
+    assert score["cost_ratio"] == 1
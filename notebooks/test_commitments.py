@@ -0,0 +1,46 @@
+import pickle
+from dataclasses import asdict, astuple
+
+import pytest
+
+from CEFO import Commitment, CommitmentArray, Offer
+
+KEYS = ["commitment_id", "proposer", "acceptor", "shift_min", "moved_students", "created_episode", "due_episode",
+        "fulfilled", "fulfilled_episode", "times_missed"]
+
+
+def commitments():
+    offer = Offer(None, "C1", "C2", 0, -2, 40, 3)
+    counter = Offer(None, "C2", "C1", 0, 4, 30, 3, counter_to_offer_id=offer.offer_id)
+    given = Offer("counter_C3_to_C4_ep3", "C3", "C4", 2, 2, 10, 3, counter_to_offer_id="x")
+    return [Commitment.from_offer(o, 3) for o in (offer, counter, given)] + [
+        Commitment("com_7", "C5", "C6", -2, 5, 3, 4, True, 4, 1)]
+
+
+def test_asdict_keeps_the_original_fields():
+    for com in commitments():
+        assert list(asdict(com)) == KEYS
+
+
+def test_counter_is_read_off_the_id():
+    ids = [(c.commitment_id, c.counter) for c in commitments()]
+    assert ids == [("com_offer_C1_to_C2_ep3", False), ("com_counter_C2_to_C1_ep3", True),
+                   ("com_counter_C3_to_C4_ep3", True), ("com_7", False)]
+
+
+def stored(coms):
+    archive = CommitmentArray(capacity=1)
+    archive.extend(coms)
+    return archive
+
+
+@pytest.mark.parametrize("copy", [
+    lambda coms: [Commitment(*astuple(c)) for c in coms],
+    lambda coms: pickle.loads(pickle.dumps(coms)),
+    lambda coms: list(stored(coms)),
+])
+def test_round_trips_keep_ids_and_counter(copy):
+    coms = commitments()
+    back = copy(coms)
+    assert back == coms
+    assert [c.counter for c in back] == [c.counter for c in coms]
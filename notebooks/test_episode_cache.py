@@ -0,0 +1,97 @@
+import random
+from dataclasses import astuple
+
+import pytest
+
+import sweep
+from CEFO import CommitmentLedger, EpisodeCache, EventBus, RingBufferSink, build_agents, run_episode
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+}
+# with a threshold of 1 the stubborn C4 loses reputation every episode, so no entry state comes back;
+# at 2 most seeds settle within a few episodes, and without C4 the runs cycle
+SETTLING = dict(CFG, violation_threshold=2)
+CONFIGS = {
+    "settling": SETTLING,
+    "compact_fallback": dict(SETTLING, compact_schedules=True, central_fallback=True),
+    "tight": dict(SETTLING, bottleneck={"capacity_per_minute": 30, "batch_duration_min": 2}),
+    "no_stubborn": dict(CFG, stubborn_classrooms=[]),
+}
+STEADY = ["compact_fallback", "settling", "tight"]
+
+
+def run(cfg, seed, episodes, cache=None):
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(seed))
+    commitments = CommitmentLedger()
+    summaries = []
+    for ep in range(1, episodes + 1):
+        summary = run_episode(ep, cfg, B, classrooms, agents_by_id, commitments, ledger, cache=cache)
+        summaries.append({k: v for k, v in summary.items() if k not in ("cached", "steady")})
+    agents = [(c.id, c.planned_slots, c.reputation, c.violations, c.missed_commitments) for c in classrooms]
+    totals = (commitments.created, commitments.fulfilled, commitments.expired)
+    return summaries, agents, [astuple(com) for com in commitments], totals, sorted(ledger.items())
+
+
+@pytest.mark.parametrize("name", sorted(CONFIGS))
+def test_replay_matches_the_full_run(name):
+    cfg = CONFIGS[name]
+    # one cache for every seed, so runs also replay episodes other runs recorded
+    cache = EpisodeCache(maxsize=64)
+    for seed in range(6):
+        assert run(cfg, seed, 30, cache) == run(cfg, seed, 30)
+    assert cache.hits > 0
+    assert len(cache) <= 64
+
+
+def test_runs_with_sinks_are_never_replayed():
+    cache = EpisodeCache()
+    run(SETTLING, 1, 10, cache)
+    hits = cache.hits
+    assert hits > 0
+    events = EventBus(RingBufferSink())
+    B, ledger, classrooms, agents_by_id = build_agents(SETTLING, rng=random.Random(1), events=events)
+    commitments = CommitmentLedger()
+    for ep in range(1, 11):
+        assert not run_episode(ep, SETTLING, B, classrooms, agents_by_id, commitments, ledger, cache=cache)["cached"]
+    assert cache.hits == hits
+
+
+def test_steady_episodes_repeat():
+    cache = EpisodeCache()
+    B, ledger, classrooms, agents_by_id = build_agents(SETTLING, rng=random.Random(1))
+    commitments = CommitmentLedger()
+    summaries = [run_episode(ep, SETTLING, B, classrooms, agents_by_id, commitments, ledger, cache=cache)
+                 for ep in range(1, 31)]
+    first = next(i for i, s in enumerate(summaries) if s["steady"])
+    assert all(s["steady"] for s in summaries[first:])
+    strip = lambda s: {k: v for k, v in s.items() if k not in ("episode", "cached", "steady")}
+    assert all(strip(s) == strip(summaries[first]) for s in summaries[first:])
+
+
+@pytest.mark.parametrize("name", STEADY)
+def test_sweep_early_stop_matches_the_full_run(monkeypatch, name):
+    cfg = CONFIGS[name]
+    episodes_run = []
+
+    def counted(ep, *args, cache=None):
+        episodes_run.append(ep)
+        return run_episode(ep, *args, cache=cache)
+
+    def full(ep, *args, cache=None):
+        return dict(counted(ep, *args), steady=False)
+
+    monkeypatch.setattr(sweep, "run_episode", counted)
+    stopped = [sweep.run_one(i, cfg, seed, 40) for i, seed in enumerate(range(5))]
+    # most runs settle long before their 40th episode
+    assert len(episodes_run) < 5 * 40
+    monkeypatch.setattr(sweep, "run_episode", full)
+    assert [sweep.run_one(i, cfg, seed, 40) for i, seed in enumerate(range(5))] == stopped
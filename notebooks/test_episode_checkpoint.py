@@ -0,0 +1,98 @@
+import random
+from dataclasses import astuple
+
+import pytest
+
+from async_negotiation import AsyncNegotiationEngine
+from CEFO import CommitmentArray, CommitmentLedger, build_agents, run_episode
+from episode_checkpoint import Checkpoint, checkpoint, restore
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+}
+MODES = {
+    "archive": {},
+    "no_archive": {"keep_archive": False},
+    "compact": {"compact_archive": True},
+}
+
+
+def step(engine, ep, cfg, B, classrooms, agents_by_id, commitments, ledger):
+    if engine == "async":
+        summary = AsyncNegotiationEngine(cfg, B, classrooms, agents_by_id, commitments, ledger).run_episode(ep)
+    else:
+        summary = run_episode(ep, cfg, B, classrooms, agents_by_id, commitments, ledger)
+    # keep each proposer's own record, so histories reach into the archive and out of the ledger
+    for com in commitments.open():
+        if com.created_episode == ep:
+            agents_by_id[com.proposer].commitment_history.append(com)
+    return summary
+
+
+def state(summaries, classrooms, commitments):
+    agents = [(c.id, c.planned_slots, c.reputation, c.violations, c.missed_commitments,
+               [astuple(com) for com in c.commitment_history]) for c in classrooms]
+    totals = (commitments.created, commitments.fulfilled, commitments.expired, len(commitments.archive))
+    return summaries, agents, [astuple(c) for c in commitments], totals
+
+
+def run(engine, mode, episodes, split=None, reload=False):
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(3))
+    commitments = CommitmentLedger(**MODES[mode])
+    summaries = []
+    for ep in range(1, episodes + 1):
+        summaries.append(step(engine, ep, CFG, B, classrooms, agents_by_id, commitments, ledger))
+        if ep == split:
+            cp = checkpoint(ep, CFG, classrooms, commitments)
+            if reload:
+                cp = Checkpoint.loads(cp.dumps())
+            B, ledger, classrooms, agents_by_id, commitments = restore(cp)
+    return state(summaries, classrooms, commitments)
+
+
+@pytest.mark.parametrize("reload", [False, True])
+@pytest.mark.parametrize("mode", sorted(MODES))
+@pytest.mark.parametrize("engine", ["sync", "async"])
+def test_restore_continues_the_run(engine, mode, reload):
+    assert run(engine, mode, 16, split=7, reload=reload) == run(engine, mode, 16)
+
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_restore_keeps_the_ledger_mode(mode):
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(3))
+    commitments = CommitmentLedger(**MODES[mode])
+    for ep in range(1, 9):
+        step("sync", ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+    cp = checkpoint(8, CFG, classrooms, commitments)
+    *_, restored = restore(cp)
+    assert restored.keep_archive == commitments.keep_archive
+    assert type(restored.archive) is type(commitments.archive)
+    assert [astuple(c) for c in restored] == [astuple(c) for c in commitments]
+    if mode == "no_archive":
+        assert len(restored.archive) == 0
+        # settled history is kept by the agents only, and still comes back
+        assert any(com.due_episode <= 8 for c in classrooms for com in c.commitment_history)
+
+
+def test_branches_do_not_share_a_compact_archive():
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(3))
+    commitments = CommitmentLedger(compact_archive=True)
+    for ep in range(1, 6):
+        step("sync", ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+    cp = checkpoint(5, CFG, classrooms, commitments)
+    settled = len(cp.archive)
+    first, second = restore(cp), restore(cp)
+    for ep in range(6, 10):
+        B, ledger, classrooms, agents_by_id, commitments = first
+        step("sync", ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+    assert isinstance(cp.archive, CommitmentArray)
+    assert len(first[-1].archive) > settled
+    assert len(second[-1].archive) == len(cp.archive) == settled
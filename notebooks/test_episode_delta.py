@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from CEFO import CommitmentLedger, build_agents, run_episode
+from episode_delta import DeltaStream, commitment_handles, decode_delta, snapshot
+from episode_trace import TraceReader, TraceWriter
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+}
+FIELDS = ("proposer", "acceptor", "shift_min", "moved_students", "created_episode", "due_episode",
+          "times_missed", "fulfilled", "fulfilled_episode")
+
+
+class Client:
+    """What the demo page keeps, rebuilt from keyframes and deltas as applyDelta() does."""
+    def __init__(self):
+        self.episode = None
+
+    def keyframe(self, kf):
+        self.ids = [a["id"] for a in kf["agents"]]
+        self.schedules = {aid: list(map(tuple, slots)) for aid, slots in kf["schedules"].items()}
+        self.reputation, self.violations = dict(kf["reputation"]), dict(kf["violations"])
+        self.commitments = {}
+        self.episode = 0
+
+    def episode_delta(self, payload):
+        rows = decode_delta(payload)
+        self.slot_map = {off: cnt for off, cnt in rows["loads"].tolist()}
+        replaced = set()
+        for a, off, cnt in rows["sched"].tolist():
+            if a not in replaced:
+                replaced.add(a)
+                self.schedules[self.ids[a]] = []
+            self.schedules[self.ids[a]].append((off, cnt))
+        for (a, violations, _), reputation in zip(rows["agents"].tolist(), rows["reputation"].tolist()):
+            self.violations[self.ids[a]], self.reputation[self.ids[a]] = violations, reputation
+        for cid, row in zip(payload["commitment_ids"], rows["commitments"].tolist()):
+            p, a, shift, moved, created, due, missed, fulfilled, fulfilled_ep, ordinal = row
+            self.commitments[created, due, ordinal] = (
+                cid, self.ids[p], self.ids[a], shift, moved, created, due, missed, bool(fulfilled),
+                None if fulfilled_ep < 0 else fulfilled_ep)
+        self.episode = payload["episode"]
+
+
+def ledger_state(commitments):
+    return sorted((c.commitment_id,) + tuple(getattr(c, f) for f in FIELDS) for c in commitments)
+
+
+@pytest.mark.parametrize("ack_every", [1, 3, 7])
+@pytest.mark.parametrize("seed", [0, 4, 7])
+def test_client_rebuilds_every_episode(tmp_path, seed, ack_every):
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(seed))
+    commitments = CommitmentLedger()
+    writer = TraceWriter(str(tmp_path), classrooms, B.per_batch, chunk_size=4)
+    client, inbox = Client(), []
+    stream = DeltaStream(lambda sid, event, payload: inbox.append((event, payload)))
+    stream.reset(TraceReader(str(tmp_path)), snapshot(classrooms))
+    stream.connect("sid")
+    for ep in range(1, 21):
+        run_episode(ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+        writer.record_episode(ep, ledger, classrooms, commitments)
+        writer.flush()
+        stream.publish(ep)
+        for event, payload in inbox:
+            getattr(client, event)(payload)
+        inbox.clear()
+        if ep % ack_every == 0 or ep == 20:
+            stream.ack("sid", stream.generation, client.episode)
+            for event, payload in inbox:
+                getattr(client, event)(payload)
+            inbox.clear()
+            assert client.episode == ep
+            assert client.slot_map == dict(ledger.items())
+            assert client.schedules == {c.id: c.planned_slots for c in classrooms}
+            assert client.violations == {c.id: c.missed_commitments for c in classrooms}
+            assert client.reputation == pytest.approx({c.id: c.reputation for c in classrooms})
+            assert sorted(client.commitments.values()) == ledger_state(commitments)
+
+
+def test_handles_are_unique_when_ids_repeat(tmp_path):
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(7))
+    commitments = CommitmentLedger()
+    writer = TraceWriter(str(tmp_path), classrooms, B.per_batch)
+    for ep in range(1, 11):
+        run_episode(ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+        writer.record_episode(ep, ledger, classrooms, commitments)
+    writer.close()
+    ids = [c.commitment_id for c in commitments]
+    assert len(set(ids)) < len(ids)  # the same pair agreed twice in one episode
+
+    reader, traced = TraceReader(str(tmp_path)), {}
+    for ep in reader.episodes:
+        coms = reader.commitments(ep)
+        handles = commitment_handles(coms)
+        assert len(set(handles)) == len(handles)
+        for handle, c in zip(handles, coms):
+            traced.setdefault(handle, set()).add((c.commitment_id, c.proposer, c.acceptor, c.shift_min))
+    # one handle per commitment, naming the same commitment in both episodes it is traced in
+    assert len(traced) == len(ids)
+    assert all(len(seen) == 1 for seen in traced.values())
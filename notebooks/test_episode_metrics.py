@@ -0,0 +1,95 @@
+import random
+from collections import Counter
+
+import pytest
+
+from CEFO import CommitmentLedger, Event, EventBus, RingBufferSink, build_agents, run_episode
+from episode_metrics import COUNTERS, EVENT_COUNTERS, MetricsSink
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+}
+
+
+def run(episodes, seed=3):
+    metrics, log = MetricsSink(), RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(seed), events=EventBus(metrics, log))
+    commitments = CommitmentLedger()
+    for ep in range(1, episodes + 1):
+        run_episode(ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+    return metrics, log, commitments
+
+
+def events(*kinds):
+    return [Event(kind, 1, {}) for kind in kinds]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_counters_follow_the_events(seed):
+    metrics, log, commitments = run(8, seed)
+    kinds = Counter(e.kind for e in log)
+    for metric in COUNTERS:
+        expected = sum(n for kind, n in kinds.items() if EVENT_COUNTERS.get(kind, (None,))[0] == metric)
+        assert metrics.count(metric) == expected
+    assert metrics.count("episodes") == 8
+    assert metrics.count("commitments_created") == commitments.created
+    assert metrics.count("fulfillments", outcome="fulfilled") == commitments.fulfilled
+    assert metrics.count("offers", type="counter") == kinds["counter_accepted"] + kinds["counter_rejected"]
+    # every episode broadcasts and fulfils once
+    phases = metrics.snapshot()["phases"]
+    assert phases["broadcast"]["calls"] == phases["fulfill"]["calls"] == 8
+    assert phases["negotiation_round"]["calls"] == metrics.count("negotiation_rounds")
+
+
+def test_rates():
+    metrics = MetricsSink()
+    assert set(metrics.rates().values()) == {None}
+    for e in events("offer_accepted", "offer_rejected", "offer_rejected", "offer_rejected",
+                    "counter_accepted", "fulfilled", "fulfilled", "fulfill_failed", "fulfill_partial"):
+        metrics.write(e)
+    assert metrics.rates() == {
+        "accept_rate": 2 / 5,
+        "reject_rate": 3 / 5,
+        "counter_rate": 1 / 3,
+        "fulfillment_failure_rate": 2 / 4,
+    }
+
+
+def test_prometheus_exposition():
+    metrics = MetricsSink()
+    for e in events("episode_start", "offer_accepted", "counter_rejected", "counter_rejected", "utility"):
+        metrics.write(e)
+    metrics.record_phase("fulfill", 0.25)
+    metrics.record_phase("fulfill", 0.5)
+    lines = metrics.prometheus().splitlines()
+    for metric in COUNTERS:
+        name = f"cefo_{metric}_total"
+        assert f"# TYPE {name} counter" in lines
+        assert lines.index(f"# TYPE {name} counter") == lines.index(f"# HELP {name} {COUNTERS[metric]}") + 1
+    assert "cefo_episodes_total 1" in lines
+    assert 'cefo_offers_total{type="counter",outcome="rejected"} 2' in lines
+    assert 'cefo_offers_total{type="initial",outcome="accepted"} 1' in lines
+    # a counter nothing has touched is still exported, at 0
+    assert "cefo_auctions_total 0" in lines
+    assert 'cefo_phase_seconds_sum{phase="fulfill"} 0.750000000' in lines
+    assert 'cefo_phase_seconds_count{phase="fulfill"} 2' in lines
+    assert 'cefo_phase_max_seconds{phase="fulfill"} 0.500000000' in lines
+    assert all(line.startswith("# ") or line.split()[-1].replace(".", "").isdigit() for line in lines)
+
+
+def test_prometheus_matches_the_counters_of_a_run():
+    metrics, _, _ = run(5)
+    lines = metrics.prometheus(prefix="x").splitlines()
+    for metric in COUNTERS:
+        values = [int(line.split()[-1]) for line in lines if line.startswith(f"x_{metric}_total")]
+        assert sum(values) == metrics.count(metric)
+    metrics.reset()
+    assert "x_episodes_total 0" in metrics.prometheus(prefix="x").splitlines()
@@ -0,0 +1,80 @@
+import random
+from dataclasses import astuple, replace
+
+import pytest
+
+from CEFO import CommitmentLedger, EventBus, RingBufferSink, build_agents, run_episode
+from episode_trace import TraceReader, TraceWriter
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+}
+
+
+def record(path, episodes, chunk_size):
+    """Runs the engine, writing each episode to a trace and keeping what was written alongside."""
+    sink = RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(7), events=EventBus(sink))
+    commitments = CommitmentLedger()
+    writer = TraceWriter(path, classrooms, B.per_batch, chunk_size=chunk_size)
+    expected = {}
+    for ep in range(1, episodes + 1):
+        sink.clear()
+        run_episode(ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+        writer.record_episode(ep, ledger, classrooms, commitments, sink)
+        expected[ep] = {
+            "slot_map": dict(sorted(ledger.items())),
+            "schedules": {c.id: list(c.planned_slots) for c in classrooms},
+            "commitments": [astuple(replace(com)) for com in commitments.last_settled + [
+                com for com in commitments.open() if com.created_episode == ep]],
+            "events": [(e.kind, e.data) for e in sink],
+            "texts": sink.texts(),
+            "reputation": {c.id: c.reputation for c in classrooms},
+            "missed": {c.id: c.missed_commitments for c in classrooms},
+        }
+    return writer, expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64])
+def test_replay_matches_the_run(tmp_path, chunk_size):
+    writer, expected = record(str(tmp_path), 10, chunk_size)
+    writer.close()
+    reader = TraceReader(str(tmp_path))
+    assert list(reader.episodes) == list(range(1, 11))
+    # out of order on purpose, so chunks are mapped in any order
+    for ep in sorted(expected, reverse=True):
+        want = expected[ep]
+        assert reader.slot_map(ep) == want["slot_map"]
+        assert reader.schedules(ep) == want["schedules"]
+        assert [astuple(c) for c in reader.commitments(ep)] == want["commitments"]
+        assert [(e.kind, e.data) for e in reader.events(ep)] == want["events"]
+        assert [e.text() for e in reader.events(ep)] == want["texts"]
+        assert reader.agent_column("reputation", ep) == want["reputation"]
+        assert reader.state(ep)["agent_info"]["C4"]["violations"] == want["missed"]["C4"]
+
+
+def test_reader_follows_a_live_writer(tmp_path):
+    writer, expected = record(str(tmp_path), 4, chunk_size=3)
+    reader = TraceReader(str(tmp_path))
+    # the first chunk is on disk, the fourth episode is still only in the writer
+    assert len(reader) == 3
+    with pytest.raises(IndexError):
+        reader.slot_map(4)
+    writer.flush()
+    assert reader.slot_map(4) == expected[4]["slot_map"]
+    assert reader.schedules(3) == expected[3]["schedules"]
+
+
+def test_episodes_must_follow_on(tmp_path):
+    writer, _ = record(str(tmp_path), 2, chunk_size=8)
+    B, ledger, classrooms, _ = build_agents(CFG, rng=random.Random(7))
+    with pytest.raises(ValueError):
+        writer.record_episode(4, ledger, classrooms, CommitmentLedger())
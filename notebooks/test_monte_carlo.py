@@ -0,0 +1,58 @@
+import random
+
+import numpy as np
+import pytest
+
+from CEFO import CommitmentLedger, build_agents, run_episode
+from monte_carlo import run_monte_carlo, sample_attendance
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -1, 1],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+    "attendance_model": {"kind": "poisson"},
+}
+
+
+def scalar_samples(cfg, draws):
+    """(overloaded offsets per episode, peak load per episode, final reputations) of every sample, on run_episode."""
+    out = []
+    for s in range(draws.shape[1]):
+        B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(cfg["random_seed"]))
+        commitments = CommitmentLedger()
+        over, peak = [], []
+        for ep in range(1, draws.shape[0] + 1):
+            for c, n in zip(classrooms, draws[ep - 1, s].tolist()):
+                c.attendance = n
+            run_episode(ep, cfg, B, classrooms, agents_by_id, commitments, ledger)
+            over.append({off for off, load in ledger.items() if load > B.per_batch})
+            peak.append(ledger.peak_load())
+        out.append((over, peak, [c.reputation for c in classrooms]))
+    return out
+
+
+@pytest.mark.parametrize("window", [[0, -1, 1], [0, -2, 2, -4, 4, -6, 6], [0, 5, -5, 10]])
+def test_matches_scalar_engine(window):
+    cfg = dict(CFG, time_offsets=window)
+    samples, episodes = 30, 5
+    result = run_monte_carlo(cfg, samples, episodes, seed=3)
+    draws = sample_attendance(cfg["attendance_model"], cfg["attendance"], (episodes, samples), np.random.default_rng(3))
+    scalar = scalar_samples(cfg, draws)
+    for s, (_, peak, reputation) in enumerate(scalar):
+        assert result.peak_load[:, s].tolist() == peak
+        assert result.reputation[s].tolist() == reputation
+    for ep in range(episodes):
+        for off, p in zip(result.offsets, result.overloaded[ep]):
+            assert p == sum(off in over[ep] for over, _, _ in scalar) / samples
+
+
+def test_offsets_stay_near_the_window():
+    result = run_monte_carlo(CFG, 200, 5, seed=0)
+    # fulfilment lands at a first slot + |shift|, at most 1 + 2 here; never at the default window's -6 or 6
+    assert set(result.offsets) <= {-1, 0, 1, 2, 3}
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from CEFO import CommitmentLedger, EventBus, RingBufferSink, build_agents, run_episode, with_time_resolution
+
+CFG = {
+    "episode_base_name": "test",
+    "num_classrooms": 6,
+    "attendance": [60, 45, 20, 80, 35, 50],
+    "bottleneck": {"capacity_per_minute": 40, "batch_duration_min": 2},
+    "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+    "max_negotiation_rounds": 5,
+    "violation_threshold": 1,
+    "random_seed": 42,
+    "stubborn_classrooms": ["C4"],
+    "negotiation_protocol": "n_way",
+}
+CONFIGS = {
+    "minutes": CFG,
+    # 30 s ticks: a batch spans 4 of them
+    "seconds": with_time_resolution(CFG, 30, 6),
+}
+
+
+def broadcast(cfg, seed):
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(seed))
+    msg = B.broadcast_capacity(cfg["attendance"], "test")
+    for c in classrooms:
+        c.on_capacity_broadcast(msg)
+    return B, ledger, agents_by_id
+
+
+@pytest.mark.parametrize("name", sorted(CONFIGS))
+@pytest.mark.parametrize("seed", range(10))
+def test_shares_clear_the_offset(seed, name):
+    cfg = CONFIGS[name]
+    B, ledger, agents_by_id = broadcast(cfg, seed)
+    proposer, *acceptors = ledger.ranked_contributors(0)
+    offers = proposer.propose_shares(acceptors, 0, 1, ledger.snapshot())
+    excess = sum(cfg["attendance"]) - B.per_batch
+    assert sum(o.moved_students for o in offers) == excess
+    # acceptors are asked in order, never for more than they have, always towards the side they prefer
+    asked = [o.acceptor for o in offers]
+    assert asked == sorted(asked, key=[a.id for a in acceptors].index)
+    for a in acceptors:
+        assert sum(o.moved_students for o in offers if o.acceptor == a.id) <= a.attendance
+    for o in offers:
+        personality = agents_by_id[o.acceptor].personality
+        assert o.proposer == proposer.id and o.old_offset == 0 and o.shift_min != 0
+        assert personality == "flexible" or (o.shift_min > 0) == (personality == "prefers_late")
+    # taken together, the offers leave no batch over capacity
+    for o in offers:
+        agents_by_id[o.acceptor].apply_offer(o)
+    assert not ledger.congested
+
+
+def test_shares_stop_when_a_side_is_full():
+    cfg = dict(CFG, time_offsets=[0, -2, 2], attendance=[100, 100, 100, 0, 0, 0])
+    B, ledger, agents_by_id = broadcast(cfg, 0)
+    c1, c2, c3 = (agents_by_id[f"C{i}"] for i in (1, 2, 3))
+    c1.personality = c2.personality = c3.personality = "prefers_early"
+    offers = c1.propose_shares([c2, c3], 0, 1, ledger.snapshot())
+    # only offset -2 is on their side: one batch's worth moves, the rest stays over capacity
+    assert [(o.acceptor, o.shift_min, o.moved_students) for o in offers] == [("C2", -2, B.per_batch)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_every_offer_is_answered(seed):
+    sink = RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(CFG, rng=random.Random(seed), events=EventBus(sink))
+    commitments = CommitmentLedger()
+    for ep in range(1, 6):
+        run_episode(ep, CFG, B, classrooms, agents_by_id, commitments, ledger)
+    kinds = [e.kind for e in sink]
+    offered = sum(e.data["offers"] for e in sink if e.kind == "propose_shares")
+    answered = kinds.count("offer_accepted") + kinds.count("offer_rejected")
+    assert offered == answered > 0
+    assert kinds.count("committed") == commitments.created
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+import CEFO
+from CEFO import CommitmentLedger, EventBus, RingBufferSink, build_agents, compute_slot_map, run_episode
+
+
+def campus(seed):
+    """A small seeded campus with at least one empty classroom."""
+    r = random.Random(seed)
+    n = r.randint(3, 8)
+    attendance = [r.randint(0, 120) for _ in range(n)]
+    attendance[r.randrange(n)] = 0
+    return {
+        "episode_base_name": "test",
+        "num_classrooms": n,
+        "attendance": attendance,
+        "bottleneck": {"capacity_per_minute": r.choice([20, 40]), "batch_duration_min": 2},
+        "time_offsets": [0, -2, 2, -4, 4, -6, 6],
+        "max_negotiation_rounds": 5,
+        "violation_threshold": r.choice([1, 2]),
+        "random_seed": seed,
+        "stubborn_classrooms": [f"C{i+1}" for i in range(n) if r.random() < 0.2],
+    }
+
+
+class RebuiltSlotLedger(CEFO.SlotLedger):
+    """A SlotLedger that checks every answer the engine asks for against compute_slot_map()."""
+    def classrooms(self):
+        return sorted(self._agent_rank, key=self._agent_rank.__getitem__)
+
+    def congested_offsets(self):
+        slot_map = compute_slot_map(self.classrooms())
+        assert dict(self.items()) == {off: load for off, load in slot_map.items() if load}
+        rebuilt = [off for off, load in slot_map.items() if load > self.per_batch]
+        assert super().congested_offsets() == rebuilt
+        return rebuilt
+
+    def top_contributors(self, offset, k=2):
+        # every classroom with a slot at the offset, even an empty one, most students first
+        holders = [c for c in self.classrooms() if any(off == offset for off, _ in c.planned_slots)]
+        holders.sort(key=lambda c: next(cnt for off, cnt in c.planned_slots if off == offset), reverse=True)
+        assert super().top_contributors(offset, k) == holders[:k]
+        return holders[:k]
+
+
+@pytest.mark.parametrize("dense", [False, True])
+@pytest.mark.parametrize("seed", range(40))
+def test_ledger_matches_a_slot_map_rebuild(monkeypatch, seed, dense):
+    monkeypatch.setattr(CEFO, "SlotLedger", RebuiltSlotLedger)
+    cfg = dict(campus(seed), compact_schedules=dense)
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(seed))
+    assert isinstance(ledger, RebuiltSlotLedger)
+    commitments = CommitmentLedger()
+    for ep in range(1, 9):
+        run_episode(ep, cfg, B, classrooms, agents_by_id, commitments, ledger)
+        ledger.congested_offsets()
+
+
+def test_empty_classrooms_still_negotiate():
+    cfg = dict(campus(0), num_classrooms=4, attendance=[0, 98, 57, 68], stubborn_classrooms=["C1"],
+               bottleneck={"capacity_per_minute": 40, "batch_duration_min": 2})
+    sink = RingBufferSink()
+    B, ledger, classrooms, agents_by_id = build_agents(cfg, rng=random.Random(0), events=EventBus(sink))
+    for c in classrooms:
+        c.personality = "flexible"
+    run_episode(1, cfg, B, classrooms, agents_by_id, CommitmentLedger(), ledger)
+    # once C4 and C3 have moved off offset 0, the empty C1 is the one C2 proposes to
+    proposals = [(e.data["agent"], e.data["other"]) for e in sink if e.kind == "propose"]
+    assert proposals == [("C2", "C4"), ("C2", "C3"), ("C2", "C1")]
+    # taking the offer emptied C1's slot, so it leaves the schedule and the ledger's index
+    assert agents_by_id["C1"].planned_slots == []
+    assert all(agents_by_id["C1"] not in at for at in ledger.contributors.values())